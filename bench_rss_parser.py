@@ -0,0 +1,183 @@
+"""	Benchmarks of rss_parser cached_news database.
+
+	compress	size of stored descriptions and read throughput of db_iter_news for every description compression codec
+	xml			feed parsing throughput of every XML backend, with and without saved feed profile
+	extract		feed parsing throughput of every description extraction level, eager and lazy
+	html		html export time of rendering articles against reading them pre-rendered from database
+	insert		db_insert_many throughput in batches of store_stage and db_import, bare and with clusters and digests updated per batch
+
+	usage: python bench_rss_parser.py compress|xml|extract|html|insert [--rows N]
+"""
+
+
+import argparse
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from rss_parser.rss_parser import Tree, zstandard
+
+
+def synthetic_articles(rows: int) -> list[dict]:
+	"""Returns rows of articles with HTML-heavy descriptions similar to syndicated news feeds"""
+	random.seed(0)
+	words = ['census', 'city', 'losses', 'gains', 'election', 'market', 'stocks', 'inflation', 'court', 'ruling',
+			'storm', 'coast', 'officials', 'said', 'on', 'the', 'a', 'of', 'in', 'and', 'reported', 'Tuesday']
+	articles = []
+	for i in range(rows):
+		paragraphs = ''.join(f'<p class="story-body">{" ".join(random.choices(words, k=30))}.</p>' for _ in range(random.randint(1, 8)))
+		articles.append({'date': '2022-05-01',
+						'news_feed_title': 'Yahoo News - Latest News & Headlines',
+						'news_src': 'https://news.yahoo.com/rss',
+						'news_title': f'Story {i} ' + ' '.join(random.choices(words, k=8)),
+						'news_date': '2022-05-01 11:51:11',
+						'news_description': f'<div class="caas-body">{paragraphs}<img src="https://s.yimg.com/{i}.jpg" width="130" height="86"/></div>',
+						'news_url': f'https://news.yahoo.com/story-{i}.html (link)'})
+	return articles
+
+def bench_compress(rows: int) -> None:
+	"""Stores rows of synthetic articles with every codec, prints database size and read throughput"""
+	articles = synthetic_articles(rows)
+	codecs = [codec for codec in Tree.compression_codecs if codec != 'zstd' or zstandard is not None]
+	print(f"{'codec':<8}{'db bytes':>14}{'descriptions':>16}{'read rows/s':>14}")
+	with tempfile.TemporaryDirectory() as directory:
+		for codec in codecs:
+			filepath = os.path.join(directory, f'{codec}.db')
+			database = sqlite3.connect(filepath)
+			Tree.db_migrate(database)
+			with database:
+				Tree.db_insert_many(database, articles)
+			raw, stored = Tree.db_compress(database, codec, Tree.BATCH_SIZE)
+			database.execute("VACUUM")
+			start = time.perf_counter()
+			read = sum(1 for _ in Tree.db_iter_news(database, None, None))
+			elapsed = time.perf_counter() - start
+			database.close()
+			print(f"{codec:<8}{os.path.getsize(filepath):>14}{stored:>16}{read / elapsed:>14.0f}")
+	print(f"uncompressed descriptions: {raw} bytes")
+
+def synthetic_feed(articles: list[dict]) -> bytes:
+	"""Returns RSS 2.0 document with articles as items"""
+	items = ''.join(f'<item><title>{article["news_title"]}</title><link>{article["news_url"][:-7]}</link>'
+					f'<pubDate>Thu, 26 May 2022 11:25:03 -0400</pubDate><source url="https://www.ap.org/">Associated Press</source>'
+					f'<description><![CDATA[{article["news_description"]}]]></description></item>' for article in articles)
+	return (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Yahoo News - Latest News &amp; Headlines</title>'
+			f'<link>https://www.yahoo.com/news</link>{items}</channel></rss>').encode('utf-8')
+
+def bench_xml(rows: int) -> None:
+	"""Parses the same corpus of feeds of 50 articles with every backend, 
+	prints MB/s of building xml tree alone and parsed articles per second of whole parsing"""
+	articles = synthetic_articles(rows)
+	feeds = [synthetic_feed(articles[i:i + 50]) for i in range(0, rows, 50)]
+	profile = {'article_tag': 'item', 'description_tag': 'description', 'date_tag': 'pubDate', 'namespaces': {}, 
+				'date_format': '%a, %d %b %Y %H:%M:%S %z'}
+	size = sum(len(feed) for feed in feeds)
+	print(f"{'backend':<10}{'profile':<10}{'tree MB/s':>12}{'articles/s':>12}")
+	for backend in Tree.xml_backends:
+		Tree.BACKEND = backend
+		start = time.perf_counter()
+		for feed in feeds:
+			parser = Tree.xml_parser(None)
+			parser.feed(feed)
+			parser.close()
+		tree_speed = size / (time.perf_counter() - start) / 1e6
+		for feed_profile in (None, profile):
+			parsed = 0
+			start = time.perf_counter()
+			for feed in feeds:
+				tree = object.__new__(Tree)
+				tree.response = io.BytesIO(feed)
+				parsed += sum(1 for _ in tree.iter_feed(feed_profile))
+			elapsed = time.perf_counter() - start
+			print(f"{backend:<10}{'saved' if feed_profile else 'detect':<10}{tree_speed:>12.1f}{parsed / elapsed:>12.0f}")
+	Tree.BACKEND = 'etree'
+
+def bench_extract(rows: int) -> None:
+	"""Parses the same corpus of feeds with every extraction level, eager and lazy, prints parsed articles per second"""
+	articles = synthetic_articles(rows)
+	feeds = [synthetic_feed(articles[i:i + 50]) for i in range(0, rows, 50)]
+	print(f"{'extract':<10}{'mode':<8}{'articles/s':>12}")
+	for extract in Tree.extract_levels:
+		for lazy in (False, True):
+			if extract == 'none' and lazy:
+				continue
+			Tree.EXTRACT, Tree.LAZY = extract, lazy
+			parsed = 0
+			start = time.perf_counter()
+			for feed in feeds:
+				tree = object.__new__(Tree)
+				tree.response = io.BytesIO(feed)
+				parsed += sum(1 for _ in tree.iter_feed(None))
+			elapsed = time.perf_counter() - start
+			print(f"{extract:<10}{'lazy' if lazy else 'eager':<8}{parsed / elapsed:>12.0f}")
+	Tree.EXTRACT, Tree.LAZY = 'full', False
+
+def bench_html(rows: int) -> None:
+	"""Exports stored articles as html, prints time of rendering every article against the best case of a fragment cache: 
+	all fragments read pre-rendered by rowid in one query, with no hashing or validation at all"""
+	with tempfile.TemporaryDirectory() as directory:
+		database = sqlite3.connect(os.path.join(directory, 'html.db'))
+		Tree.db_migrate(database)
+		with database:
+			Tree.db_insert_many(database, synthetic_articles(rows), update_derived=False)
+		articles = list(Tree.db_iter_news(database, None, None))
+		start = time.perf_counter()
+		bodies = [Tree.render_article_body(dict_) for dict_ in articles]
+		render = time.perf_counter() - start
+		database.execute("CREATE TABLE fragments (news_id INTEGER PRIMARY KEY, fragment TEXT)")
+		with database:
+			database.executemany("INSERT INTO fragments VALUES (?, ?)", enumerate(bodies, 1))
+		start = time.perf_counter()
+		cached = [fragment for fragment, in database.execute("SELECT fragment FROM fragments ORDER BY news_id")]
+		read = time.perf_counter() - start
+		database.close()
+	assert cached == bodies
+	print(f"{'bodies':<10}{'seconds':>10}{'rows/s':>12}")
+	print(f"{'render':<10}{render:>10.3f}{rows / render:>12.0f}")
+	print(f"{'cached':<10}{read:>10.3f}{rows / read:>12.0f}")
+
+def bench_insert(rows: int) -> None:
+	"""Inserts rows of synthetic articles in batches of Tree.STORE_BATCH_SIZE as store_stage does and of Tree.BATCH_SIZE 
+	as db_import does, prints inserted rows per second without derived tables, with clustering only and with clustering 
+	and digests (see db_update_derived), best of three runs"""
+	articles = synthetic_articles(rows)
+	print(f"{'batch':>8}  {'derived':<20}{'rows/s':>12}")
+	for batch_size in (Tree.STORE_BATCH_SIZE, Tree.BATCH_SIZE):
+		for derived in ('none', 'clusters', 'clusters+digests'):
+			elapsed = []
+			for _ in range(3):
+				database = sqlite3.connect(':memory:')
+				Tree.db_migrate(database)
+				start = time.perf_counter()
+				with database:
+					for i in range(0, rows, batch_size):
+						Tree.db_insert_many(database, articles[i:i + batch_size], update_derived=False)
+						if derived == 'clusters':
+							Tree.db_cluster_new(database)
+						elif derived == 'clusters+digests':
+							Tree.db_update_derived(database)
+				elapsed.append(time.perf_counter() - start)
+				database.close()
+			print(f"{batch_size:>8}  {derived:<20}{rows / min(elapsed):>12.0f}")
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmarks of rss_parser cached_news database')
+	parser.add_argument('benchmark', choices=['compress', 'xml', 'extract', 'html', 'insert'])
+	parser.add_argument('--rows', metavar='N', type=int, default=20000, help='number of synthetic articles')
+	args = parser.parse_args()
+	if args.benchmark == 'compress':
+		bench_compress(args.rows)
+	elif args.benchmark == 'xml':
+		bench_xml(args.rows)
+	elif args.benchmark == 'extract':
+		bench_extract(args.rows)
+	elif args.benchmark == 'html':
+		bench_html(args.rows)
+	elif args.benchmark == 'insert':
+		bench_insert(args.rows)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,232 @@
+"""	Local HTTP stand-in for feed publishers, serves generated RSS 2.0 and Atom feeds for network tests and load_test.py.
+
+	GET /feeds/<name>.xml serves feed <name>, same name always gives the same feed. Behaviour is set for the whole server
+	by <class 'FeedServer'> arguments and can be overridden per request by query parameters of the same name:
+
+	items		number of articles in feed
+	format		rss or atom
+	latency		seconds before response is sent
+	bandwidth	bytes per second the body is sent with, 0 for unlimited
+	chunk		size of chunks of Transfer-Encoding: chunked body, 0 sends Content-Length
+	gzip		1 compresses body if request accepts gzip
+	etag		1 sends ETag and answers matching If-None-Match with 304 Not Modified
+	fail		probability of answering with status instead of feed
+	status		status code of failed responses, 429 and 503 carry Retry-After
+	retry_after	seconds sent in Retry-After header
+
+	usage: python feed_server.py [--port PORT] [--items N] [--format rss|atom] [--latency SECONDS] ...
+"""
+
+
+import argparse
+import gzip
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import formatdate
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+
+
+WORDS = ['census', 'city', 'losses', 'gains', 'election', 'market', 'stocks', 'inflation', 'court', 'ruling',
+		'storm', 'coast', 'officials', 'said', 'on', 'the', 'a', 'of', 'in', 'and', 'reported', 'Tuesday']
+
+@lru_cache(maxsize=1024)
+def generate_feed(name: str, items: int, format_: str) -> bytes:
+	"""Returns RSS 2.0 or Atom document named name with items articles, generated from name so it is the same on every call"""
+	rng = random.Random(name)
+	base = f'https://{name}.example.com'
+	published = 1653564303 - rng.randrange(3600)
+	entries = []
+	for i in range(items):
+		title = f"{name} story {i}: {' '.join(rng.choices(WORDS, k=8))}"
+		paragraphs = ''.join(f'<p>{" ".join(rng.choices(WORDS, k=30))}.</p>' for _ in range(rng.randint(1, 4)))
+		description = f'<div>{paragraphs}<img src="{base}/img/{i}.jpg" width="130" height="86"/></div>'
+		if format_ == 'atom':
+			entries.append(f'<entry><title>{escape(title)}</title><link href="{base}/{i}.html"/><id>{base}/{i}</id>'
+							f'<updated>{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(published - i * 60))}</updated>'
+							f'<summary type="html">{escape(description)}</summary></entry>')
+		else:
+			entries.append(f'<item><title>{escape(title)}</title><link>{base}/{i}.html</link><guid>{base}/{i}</guid>'
+							f'<pubDate>{formatdate(published - i * 60)}</pubDate>'
+							f'<description><![CDATA[{description}]]></description></item>')
+	if format_ == 'atom':
+		document = (f'<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom"><title>{name} news</title>'
+					f'<link href="{base}"/><id>{base}/</id>{"".join(entries)}</feed>')
+	else:
+		document = (f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>{name} news</title>'
+					f'<link>{base}</link>{"".join(entries)}</channel></rss>')
+	return document.encode('utf-8')
+
+
+class FeedServer(ThreadingHTTPServer):
+	"""Serves generated feeds (see module docstring), counts responses by status and records duration of every response,
+	from request received to last byte sent, in self.durations"""
+
+	daemon_threads = True
+	failure_codes = 429, 500, 503
+
+	def __init__(self, server_address: tuple, items: int = 20, format_: str = 'rss', latency: float = 0.0, bandwidth: int = 0,
+					chunk: int = 0, gzip_: bool = False, etag: bool = True, fail: float = 0.0, status: int = 503,
+					retry_after: int = 1, seed: int = 0):
+		super().__init__(server_address, FeedRequestHandler)
+		self.defaults = {'items': items, 'format': format_, 'latency': latency, 'bandwidth': bandwidth, 'chunk': chunk,
+						'gzip': int(gzip_), 'etag': int(etag), 'fail': fail, 'status': status, 'retry_after': retry_after}
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.statuses = Counter()
+		self.durations = []
+
+	@property
+	def url(self) -> str:
+		"""Returns base url of server, feeds are at url + '/feeds/<name>.xml'"""
+		host, port = self.server_address[:2]
+		return f'http://{host}:{port}'
+
+	def feed_url(self, name: str, **params) -> str:
+		"""Returns url of feed name with query parameters overriding server defaults"""
+		query = '&'.join(f'{key}={value}' for key, value in params.items())
+		return f'{self.url}/feeds/{name}.xml' + (f'?{query}' if query else '')
+
+	def options(self, query: str) -> dict:
+		"""Returns server defaults overridden by query parameters, converted to the type of default"""
+		options = dict(self.defaults)
+		for key, values in parse_qs(query).items():
+			if key in options:
+				options[key] = type(options[key])(values[-1])
+		return options
+
+	def failed(self, rate: float) -> bool:
+		with self.lock:
+			return self.random.random() < rate
+
+	def record(self, status: int, duration: float) -> None:
+		with self.lock:
+			self.statuses[status] += 1
+			self.durations.append(duration)
+
+	def start(self) -> threading.Thread:
+		"""Serves in daemon thread, returns the thread"""
+		thread = threading.Thread(target=self.serve_forever, daemon=True)
+		thread.start()
+		return thread
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+	"""Handles GET /feeds/<name>.xml requests of <class 'FeedServer'>"""
+
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self) -> None:
+		started = time.monotonic()
+		url = urlsplit(self.path)
+		if not (url.path.startswith('/feeds/') and url.path.endswith('.xml')):
+			self.send_error(404, 'Use /feeds/<name>.xml')
+			self.server.record(404, time.monotonic() - started)
+			return
+		try:
+			options = self.server.options(url.query)
+		except ValueError:
+			self.send_error(400, 'Invalid query parameter')
+			self.server.record(400, time.monotonic() - started)
+			return
+		if options['latency'] > 0:
+			time.sleep(options['latency'])
+		if self.server.failed(options['fail']):
+			self.send_response(options['status'])
+			if options['status'] in (429, 503):
+				self.send_header('Retry-After', str(options['retry_after']))
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			self.server.record(options['status'], time.monotonic() - started)
+			return
+		body = generate_feed(url.path[len('/feeds/'):-len('.xml')], options['items'], options['format'])
+		etag = f'"{hashlib.sha1(body).hexdigest()}"'
+		if options['etag'] and self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.end_headers()
+			self.server.record(304, time.monotonic() - started)
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', f"application/{'atom' if options['format'] == 'atom' else 'rss'}+xml; charset=utf-8")
+		if options['etag']:
+			self.send_header('ETag', etag)
+		if options['gzip'] and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = gzip.compress(body, compresslevel=1)
+			self.send_header('Content-Encoding', 'gzip')
+		if options['chunk'] > 0:
+			self.send_header('Transfer-Encoding', 'chunked')
+		else:
+			self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		try:
+			self.write_body(body, options['chunk'], options['bandwidth'])
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+		self.server.record(200, time.monotonic() - started)
+
+	def write_body(self, body: bytes, chunk: int, bandwidth: int) -> None:
+		"""Writes body in pieces of chunk bytes (chunked encoding) or 16 KiB, sleeping between pieces to keep to bandwidth"""
+		size = chunk if chunk > 0 else 16 * 1024
+		started = time.monotonic()
+		for offset in range(0, len(body), size):
+			piece = body[offset:offset + size]
+			if chunk > 0:
+				self.wfile.write(f'{len(piece):x}\r\n'.encode('ascii') + piece + b'\r\n')
+			else:
+				self.wfile.write(piece)
+			self.wfile.flush()
+			if bandwidth > 0:
+				delay = (offset + len(piece)) / bandwidth - (time.monotonic() - started)
+				if delay > 0:
+					time.sleep(delay)
+		if chunk > 0:
+			self.wfile.write(b'0\r\n\r\n')
+
+	def log_message(self, format: str, *args) -> None:
+		pass
+
+
+def server_arg_parser() -> argparse.ArgumentParser:
+	"""Returns parser of FeedServer options, shared with load_test.py"""
+	parser = argparse.ArgumentParser(add_help=False)
+	parser.add_argument('--items', metavar='N', type=int, default=20, help='number of articles in every feed')
+	parser.add_argument('--format', type=str, choices=['rss', 'atom'], default='rss', help='feed format')
+	parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0, help='delay before every response')
+	parser.add_argument('--bandwidth', metavar='BYTES', type=int, default=0, help='bytes per second of every response, 0 for unlimited')
+	parser.add_argument('--chunk', metavar='BYTES', type=int, default=0, help='size of chunks of chunked responses, 0 sends Content-Length')
+	parser.add_argument('--gzip', action='store_true', help='compress responses if client accepts gzip')
+	parser.add_argument('--no-etag', action='store_true', help='send no ETag and never answer 304')
+	parser.add_argument('--fail', metavar='RATE', type=float, default=0.0, help='probability of failed response')
+	parser.add_argument('--status', type=int, choices=FeedServer.failure_codes, default=503, help='status code of failed responses')
+	parser.add_argument('--retry-after', metavar='SECONDS', type=int, default=1, help='Retry-After of failed 429 and 503 responses')
+	parser.add_argument('--seed', type=int, default=0, help='seed of failure sampling')
+	return parser
+
+def create_server(args: argparse.Namespace, port: int = 0) -> FeedServer:
+	"""Returns FeedServer listening on 127.0.0.1:port configured by args parsed with server_arg_parser"""
+	return FeedServer(('127.0.0.1', port), items=args.items, format_=args.format, latency=args.latency, bandwidth=args.bandwidth,
+					chunk=args.chunk, gzip_=args.gzip, etag=not args.no_etag, fail=args.fail, status=args.status,
+					retry_after=args.retry_after, seed=args.seed)
+
+def main():
+	parser = argparse.ArgumentParser(description='local HTTP stand-in for feed publishers', parents=[server_arg_parser()])
+	parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+	args = parser.parse_args()
+	server = create_server(args, args.port)
+	print(f"Serving feeds on {server.url}/feeds/<name>.xml")
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+
+
+if __name__ == '__main__':
+	main()
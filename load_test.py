@@ -0,0 +1,95 @@
+"""	End-to-end load test of rss_parser against local feed server (see feed_server.py).
+
+	Starts FeedServer, runs rss_parser with --json on --feeds feed urls --runs times, every run with a new temporary database,
+	and reports throughput (feeds and articles per second), run durations and response latency percentiles measured by server
+	(request received to last byte sent, including injected latency and bandwidth limit).
+
+	usage: python load_test.py [--feeds N] [--runs N] [--fetch-workers N] [--per-host N] [--host-rate RATE] [feed server options]
+"""
+
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from feed_server import server_arg_parser, create_server
+from rss_parser.rss_parser import Tree
+
+
+class LineCounter(io.TextIOBase):
+	"""Text stream counting written lines which start with prefix, stands in for stdout and stderr of a run"""
+
+	def __init__(self, prefix: str):
+		self.prefix = prefix
+		self.lines = 0
+		self.pending = ''
+
+	def writable(self) -> bool:
+		return True
+
+	def write(self, text: str) -> int:
+		*lines, self.pending = (self.pending + text).split('\n')
+		self.lines += sum(1 for line in lines if line.startswith(self.prefix))
+		return len(text)
+
+def percentile(values: list[float], q: float) -> float:
+	"""Returns q-th percentile (0-100) of values by nearest rank"""
+	if not values:
+		return float('nan')
+	values = sorted(values)
+	return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+def run_parser(urls: list[str], db_filepath: str, args: argparse.Namespace) -> tuple[int, int]:
+	"""Runs rss_parser with --json on urls like the command line does, returns tuple (printed articles, skipped feeds)"""
+	stdout, stderr = LineCounter('{'), LineCounter('Skipping')
+	Tree.CACHE, Tree.BREAKERS = [], {}
+	with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+		try:
+			Tree(urls, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None,
+				db_filepath=db_filepath, timeout=args.timeout, fetch_workers=args.fetch_workers, per_host=args.per_host,
+				host_rate=args.host_rate, retries=args.retries)
+		except SystemExit:
+			pass
+	return stdout.lines, stderr.lines
+
+def main():
+	parser = argparse.ArgumentParser(description='end-to-end load test of rss_parser against local feed server', parents=[server_arg_parser()])
+	parser.add_argument('--feeds', metavar='N', type=int, default=200, help='number of feeds fetched in every run')
+	parser.add_argument('--runs', metavar='N', type=int, default=3, help='number of runs')
+	parser.add_argument('--fetch-workers', metavar='N', type=int, default=Tree.FETCH_WORKERS, help='feeds fetched at the same time')
+	parser.add_argument('--per-host', metavar='N', type=int, default=16, help='connections to feed server at the same time')
+	parser.add_argument('--host-rate', metavar='RATE', type=float, default=10000.0, help='requests per second to feed server')
+	parser.add_argument('--retries', metavar='N', type=int, default=Tree.RETRIES, help='retries of failed fetches')
+	parser.add_argument('--timeout', metavar='SECONDS', type=float, default=Tree.TIMEOUT, help='connect/read timeout')
+	args = parser.parse_args()
+
+	server = create_server(args)
+	server.start()
+	urls = [server.feed_url(f'feed{i}') for i in range(args.feeds)]
+	durations, articles, skipped = [], 0, 0
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			for run in range(args.runs):
+				start = time.perf_counter()
+				printed, failed = run_parser(urls, os.path.join(directory, f'run{run}.db'), args)
+				durations.append(time.perf_counter() - start)
+				articles += printed
+				skipped += failed
+				print(f"run {run + 1}: {durations[-1]:.2f} s, {printed} articles, {failed} feeds skipped")
+	finally:
+		server.shutdown()
+		server.server_close()
+
+	total = sum(durations)
+	latencies = [duration * 1000 for duration in server.durations]
+	print(f"\nfeeds/s: {args.feeds * args.runs / total:.1f}  articles/s: {articles / total:.1f}  skipped feeds: {skipped}")
+	print(f"run seconds      p50 {percentile(durations, 50):8.2f}  p90 {percentile(durations, 90):8.2f}  max {max(durations):8.2f}")
+	print(f"response ms      p50 {percentile(latencies, 50):8.1f}  p90 {percentile(latencies, 90):8.1f}  "
+			f"p99 {percentile(latencies, 99):8.1f}  max {max(latencies, default=float('nan')):8.1f}")
+	print("responses        " + '  '.join(f"{status}: {count}" for status, count in sorted(server.statuses.items())))
+
+
+if __name__ == '__main__':
+	main()
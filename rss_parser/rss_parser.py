@@ -1,14 +1,30 @@
 """	Module for parsing XML format RSS feeds.
 	
     <function 'rss_arg_parser'> creates <class 'ArgumentParser' object with following arguments: 
-    url	, --version, --json, --date, --source, --verbose, --limit, --pdf, --html, --log
+    url	, --version, --json, --date, --source, --verbose, --limit, --pdf, --html, --log, --timeout, --max-bytes, --workers, --format, --latest, --collapse, --timeline, --backend, --huge-tree, --extract, --lazy, --retries, --deadline,
+    --user-agent, --fetch-workers, --per-host, --host-rate, --page-size
 	
 	<class 'Tree'> with methods for fetching and parsing XML document from provided url, caching news in database, converting result to json, html, pdf format.
 
     <class 'FeedParserException'> custom exception class for exception handling.
 
+    <class 'HostScheduler'> limits connections and request rate per host while fetching several feeds.
+
+    <class 'NewsQueryServer'> local HTTP JSON API over cached news with pooled read-only connections and LRU of query results.
+
+    <class 'NewsRequestHandler'> handles GET requests of <class 'NewsQueryServer'>.
+
+    <function 'rss_subcommand_parser'> creates <class 'ArgumentParser' object for subcommands:
+    export FILEPATH, import FILEPATH, serve, compress, merge FILEPATH [FILEPATH ...]
+
+    <function 'run_subcommand'> runs subcommand against cached_news database.
+
     <function 'logging_basicConfig'> for setting logging level for this module.
 
+    <function 'ingest_file'> parses local feed file in a worker process while ingesting directories.
+
+    <function 'write_html_page'> writes page of paginated html export in a worker process.
+
     """
 
 
@@ -20,20 +36,50 @@ import re
 import sys
 import sqlite3
 from urllib.request import Request, urlopen, urlretrieve
+from urllib.error import URLError, HTTPError
+import http.client
+import socket
+import random
+from email.utils import parsedate_to_datetime
 import xml.etree.ElementTree as ET
 from lxml import html
+from lxml import etree as lxml_etree
 import pdfkit
 import dateutil.parser
-from datetime import date
+from datetime import date, datetime
 import json
 import colorama
 from colorama import Fore, Back, Style
 from pyunpack import Archive
 import time
+import gzip
+import lzma
+import mmap
+import itertools
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlunsplit, parse_qs, parse_qsl, urlencode
+from collections import OrderedDict, Counter, deque
+import queue
+import threading
+import csv
+import io
+import tempfile
+import heapq
+import functools
+import contextlib
+import zlib
+try:
+	import zstandard
+except ImportError: 				# zstd compression of descriptions is optional
+	zstandard = None
+
+CWD = os.getcwd()
 
 def rss_arg_parser() -> argparse.Namespace:
 	"""	Creates custom parser with following arguments: 
-	\nurl					URL to XML format RSS feed
+	\nurl					URLs to XML format RSS feeds, local feed files (.gz/.xz compressed), directory of feed files or '-' for stdin
 	\n--version				print version info
 	\n--json				print result as JSON in stdout
 	\n--date				outputs articles from specified date
@@ -42,9 +88,27 @@ def rss_arg_parser() -> argparse.Namespace:
 	\n--limit				limit news topics, if provided
 	\n--pdf					export result as PDF to provided destination (default=cwd)
 	\n--html				export result as HTML to provided destination (default=cwd)
+	\n--timeout				connect/read timeout in seconds for fetching feed
+	\n--max-bytes			maximum size of feed body in bytes, larger feeds are aborted
+	\n--workers				number of worker processes for ingesting directory of feed files and writing html pages
+	\n--format				print result as tab/comma separated rows or plain text without colors
+	\n--latest				output only N most recent articles by publication date
+	\n--collapse			output one article per cluster of near-duplicate stories
+	\n--timeline			output articles of all sources ordered by publication time
+	\n--backend				XML parser for feeds: etree (xml.etree.ElementTree) or lxml (recovers from malformed feeds)
+	\n--huge-tree			lift lxml limits on depth and text size of feed XML
+	\n--extract			what is extracted from article descriptions: none, text or full (text and links of images and anchors)
+	\n--lazy				store raw descriptions, extraction runs when articles are printed or exported
+	\n--retries			number of retries of failed connection with jittered exponential backoff
+	\n--deadline			seconds the whole run may spend fetching feeds
+	\n--user-agent			User-Agent header sent with requests
+	\n--fetch-workers		number of feeds fetched at the same time
+	\n--per-host			maximum number of connections open to one host
+	\n--host-rate			maximum requests per second to one host
+	\n--page-size			with --html, export pages of N articles and index page linking them
 			"""
 	parser = argparse.ArgumentParser(description='tool for parsing RSS feeds')
-	parser.add_argument('url', metavar='URL', nargs='?', help='URL to XML format RSS feed')
+	parser.add_argument('url', metavar='URL', nargs='*', help="URLs to XML format RSS feeds, local feed files (.gz/.xz compressed), directory of feed files or '-' for stdin")
 	parser.add_argument('--version', action='store_true', help='print version info')
 	parser.add_argument('--json', action='store_true', help='print result as JSON in stdout')
 	parser.add_argument('--log', metavar='FILEPATH', type=str, default=None, help='sets logging level to logging.DEBUG')
@@ -54,9 +118,98 @@ def rss_arg_parser() -> argparse.Namespace:
 	parser.add_argument('--limit', help='limit news topics, if provided', type=int, nargs='?', default=-1, const=5)
 	parser.add_argument('--pdf', metavar='FILEPATH', type=str, const='cached_news.pdf', nargs='?', help='export result as PDF to provided destination, might take time for downloading images')
 	parser.add_argument('--html', metavar='FILEPATH', type=str,  const='cached_news.html', nargs='?', help='export result as HTML to provided destination')
+	parser.add_argument('--timeout', metavar='SECONDS', type=float, default=10, help='connect/read timeout in seconds for fetching feed')
+	parser.add_argument('--max-bytes', metavar='BYTES', type=int, default=16 * 1024 * 1024, help='maximum size of feed body in bytes, larger feeds are aborted')
+	parser.add_argument('--workers', metavar='N', type=int, default=os.cpu_count(), help='number of worker processes for ingesting directory of feed files and writing html pages')
+	parser.add_argument('--format', type=str, choices=Tree.output_formats, default=None, help='print result as tab/comma separated rows or plain text without colors')
+	parser.add_argument('--latest', metavar='N', type=int, default=None, help='output only N most recent articles by publication date')
+	parser.add_argument('--collapse', action='store_true', help='output one article per cluster of near-duplicate stories')
+	parser.add_argument('--timeline', action='store_true', help='output articles of all sources ordered by publication time')
+	parser.add_argument('--backend', type=str, choices=Tree.xml_backends, default=Tree.BACKEND, help='XML parser for feeds: etree or lxml (recovers from malformed feeds)')
+	parser.add_argument('--huge-tree', action='store_true', help='lift lxml limits on depth and text size of feed XML')
+	parser.add_argument('--extract', type=str, choices=Tree.extract_levels, default=Tree.EXTRACT, 
+						help='what is extracted from article descriptions: none, text or full (text and links of images and anchors)')
+	parser.add_argument('--lazy', action='store_true', help='store raw descriptions, extraction runs when articles are printed or exported')
+	parser.add_argument('--retries', metavar='N', type=int, default=Tree.RETRIES, help='number of retries of failed connection with jittered exponential backoff')
+	parser.add_argument('--deadline', metavar='SECONDS', type=float, default=None, help='seconds the whole run may spend fetching feeds')
+	parser.add_argument('--user-agent', type=str, default=Tree.USER_AGENT, help='User-Agent header sent with requests')
+	parser.add_argument('--fetch-workers', metavar='N', type=int, default=Tree.FETCH_WORKERS, help='number of feeds fetched at the same time')
+	parser.add_argument('--per-host', metavar='N', type=int, default=HostScheduler.PER_HOST, help='maximum number of connections open to one host')
+	parser.add_argument('--host-rate', metavar='RATE', type=float, default=HostScheduler.RATE, help='maximum requests per second to one host')
+	parser.add_argument('--page-size', metavar='N', type=int, default=None, help='with --html, export pages of N articles and index page linking them')
+	args = parser.parse_args()
+	return args
+
+def rss_subcommand_parser() -> argparse.Namespace:
+	"""	Creates parser for subcommands working on cached_news database: 
+	\nexport FILEPATH		stream cached news to gzip-compressed NDJSON file ('-' for stdout)
+	\nimport FILEPATH		load cached news from gzip-compressed NDJSON file ('-' for stdin), skipping articles already in database
+	\nserve					serve cached news over local HTTP JSON API
+	\ncompress				compress stored descriptions with zlib or zstd (or decompress with none), new articles are compressed the same way
+	\nmerge FILEPATH ...		merge cached news of other cache files, keeping the newest copy of duplicate articles
+			"""
+	common = argparse.ArgumentParser(add_help=False)
+	common.add_argument('--verbose', action='store_true', help='output verbose status messages')
+	parser = argparse.ArgumentParser(prog='rss_parser', description='tool for parsing RSS feeds')
+	subparsers = parser.add_subparsers(dest='command', required=True)
+	export = subparsers.add_parser('export', parents=[common], help='stream cached news to gzip-compressed NDJSON file')
+	export.add_argument('filepath', metavar='FILEPATH', help="destination file, '-' for stdout")
+	export.add_argument('--batch-size', metavar='N', type=int, default=Tree.BATCH_SIZE, help='number of rows fetched from database at once')
+	import_ = subparsers.add_parser('import', parents=[common], help='load cached news from gzip-compressed NDJSON file')
+	import_.add_argument('filepath', metavar='FILEPATH', help="source file, '-' for stdin")
+	import_.add_argument('--batch-size', metavar='N', type=int, default=Tree.BATCH_SIZE, help='number of rows inserted into database at once')
+	serve = subparsers.add_parser('serve', parents=[common], help='serve cached news over local HTTP JSON API')
+	serve.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+	serve.add_argument('--port', type=int, default=8080, help='port to listen on')
+	serve.add_argument('--pool-size', metavar='N', type=int, default=NewsQueryServer.POOL_SIZE, help='number of pooled read-only database connections')
+	serve.add_argument('--cache-size', metavar='N', type=int, default=NewsQueryServer.CACHE_SIZE, help='number of query results kept in LRU cache')
+	compress = subparsers.add_parser('compress', parents=[common], help='compress stored descriptions, new articles are compressed the same way')
+	compress.add_argument('--codec', type=str, choices=Tree.compression_codecs, default='zstd' if zstandard is not None else 'zlib', 
+						help="compression codec, 'none' decompresses stored descriptions")
+	compress.add_argument('--batch-size', metavar='N', type=int, default=Tree.BATCH_SIZE, help='number of rows rewritten at once')
+	merge = subparsers.add_parser('merge', parents=[common], help='merge cached news of other cache files, keeping newest copy of duplicates')
+	merge.add_argument('filepaths', metavar='FILEPATH', nargs='+', help='cache database file to merge')
+	merge.add_argument('--batch-size', metavar='N', type=int, default=Tree.BATCH_SIZE, help='number of rows read and committed at once')
 	args = parser.parse_args()
 	return args
 
+def run_subcommand(args: argparse.Namespace) -> None:
+	"""Connects to cached_news database and runs subcommand parsed by rss_subcommand_parser"""
+	database = None
+	try:
+		database = Tree.db_connection('cached_news.db')
+		if args.command == 'export':
+			rows = Tree.db_export(database, args.filepath, args.batch_size)
+			print(f"Exported {rows} articles to {args.filepath}", file=sys.stderr)
+		elif args.command == 'import':
+			read, inserted = Tree.db_import(database, args.filepath, args.batch_size)
+			print(f"Imported {inserted} of {read} articles from {args.filepath}", file=sys.stderr)
+		elif args.command == 'serve':
+			database.close()
+			database = None
+			server = NewsQueryServer((args.host, args.port), os.path.join(os.path.dirname(__file__), 'data', 'cached_news.db'), 
+									args.pool_size, args.cache_size)
+			print(f"Serving cached news on http://{args.host}:{server.server_port}/news", file=sys.stderr)
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+			finally:
+				server.server_close()
+		elif args.command == 'compress':
+			raw, stored = Tree.db_compress(database, args.codec, args.batch_size)
+			print(f"Descriptions stored with {args.codec}: {raw} bytes -> {stored} bytes", file=sys.stderr)
+		elif args.command == 'merge':
+			read, inserted, replaced = Tree.db_merge(database, args.filepaths, args.batch_size)
+			print(f"Merged {inserted} of {read} articles from {len(args.filepaths)} files, {replaced} older copies replaced", file=sys.stderr)
+	except Exception as e:
+		print(str(e.args)[1:-2])
+		logging.exception(e)
+		sys.exit(1)
+	finally:
+		if database is not None:
+			database.close()
+
 def logging_basicConfig(LOGGING_LEVEL: int, LOG_FILEPATH: str) -> None:
 	"""	Sets logging level according to call arguments and should be called before instantiating class Tree object
 		if --log FILEPATH is specified sets logging level to INFO and creates log file in provided destination
@@ -100,31 +253,209 @@ class Tree:
 
 
 	# CONSTANTS
-	URL = None
+	URL = None 							# url, list of urls or None
+	source = None 						# url of feed parsed by instance, Tree.URL if None
 	HTML_FILEPATH = None
 	PDF_FILEPATH = None
 	DB_FILEPATH = None
 	DB = None
 	LIMIT = None
+	LATEST = None
+	COLLAPSE = False
+	TIMELINE = False
 	JSON = None
+	FORMAT = None
+	COLOR = False 						# colors are used only when stdout is a terminal
+	OUTPUT = None 						# buffered writer for --format output, sys.stdout if None
+	CSV_WRITER = None
+	output_formats = 'tsv', 'csv', 'plain'
+	output_columns = 'news_date', 'news_feed_title', 'news_src', 'news_title', 'news_description', 'news_url'
+	OUTPUT_BUFFER_SIZE = 1024 * 1024
 	FILTER_K = None
 	FILTER_V = None
 	CACHE = []
+	CACHE_HEAD = 0 						# rows at the start of Tree.CACHE already inserted by db_insert_cached_one
 	temp_html_path = '.temp.html'
 	PAGE_TITLE = None
 	ARTICLE_DIVS = ''
+	FEED_TITLES = set() 				# feed titles already headed in html document being built by to_html_string
 	TODAY = date.today()
+	# network limits
+	TIMEOUT = 10 						# connect/read timeout in seconds, a stalled socket raises after this long
+	TRANSFER_TIMEOUT = 120 				# maximum seconds for downloading whole body
+	MAX_BYTES = 16 * 1024 * 1024 		# maximum size of response body
+	CHUNK_SIZE = 64 * 1024 				# size of chunks read from response and fed into parser
+	SPOOL_SIZE = 1024 * 1024 			# body hashed before parsing is kept in memory up to this size, then on disk
+	# fetch policy
+	RETRIES = 2 						# retries of transient connection failures
+	BACKOFF = 0.5 						# first retry waits up to BACKOFF seconds, every next one up to twice as long
+	BACKOFF_MAX = 8
+	DEADLINE_AT = None 					# time.monotonic() after which nothing is fetched anymore, None for no deadline
+	transient_http_codes = {408, 425, 429, 500, 502, 503, 504}
+	BREAKER_THRESHOLD = 3 				# consecutive failed fetches of a host which open its circuit breaker
+	BREAKER_COOLDOWN = 300 				# seconds host is skipped after circuit opens, doubles with every further failure
+	BREAKER_COOLDOWN_MAX = 24 * 3600
+	BREAKERS = {} 						# host: [consecutive failures, open until (time.time())], loaded from and saved to host_breakers table
+	BREAKERS_CHANGED = set()
+	BREAKERS_LOCK = threading.Lock() 	# guards BREAKERS and BREAKERS_CHANGED, fetched and read by pipe_many threads
+	# politeness
+	USER_AGENT = 'RSSFeedParser/0.1.0' 				# User-Agent header of requests, --user-agent overrides it
+	FETCH_WORKERS = 8 					# feeds fetched at the same time when several urls are provided
+	SCHEDULER = None 					# <class 'HostScheduler'> of current run, None fetches without limits
+	# xml parsing
+	xml_backends = 'etree', 'lxml'
+	BACKEND = 'etree'
+	HUGE_TREE = False 					# lxml refuses very deep trees and very long text nodes unless set
+	# description extraction
+	extract_levels = 'none', 'text', 'full'
+	EXTRACT = 'full'
+	LAZY = False 						# raw description is stored with extraction level in news_extract and extracted on output
+	# offline ingestion
+	WORKERS = os.cpu_count()
+	STDIN_SOURCE = '-'
+	feed_file_suffixes = '.xml', '.rss', '.atom', '.gz', '.xz'
+	# bulk export/import
+	subcommands = 'export', 'import', 'serve', 'compress', 'merge'
+	BATCH_SIZE = 10000
+	GZIP_LEVEL = 1 						# export favours throughput over compression ratio
+	db_columns = ('date', 'news_feed_title', 'news_src', 'news_title', 'news_date', 'news_description', 'news_url', 'news_extract', 
+					'news_guid', 'news_author')
+	db_optional_columns = 'news_extract', 'news_guid', 'news_author' 	# left out of article dictionaries when NULL
+	# paginated html export, images are loaded lazily and have explicit size, so pages do not reflow while they load
+	PAGE_SIZE = None 					# articles per page, None exports single page
+	IMG_WIDTH = 640
+	IMG_HEIGHT = 360
+	# daily digests
+	digest_date_pattern = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+	# pipeline stages
+	QUEUE_SIZE = 64 					# parsed articles waiting for store/render stages, parsing blocks when queue is full
+	STORE_BATCH_SIZE = 100 				# stored articles are committed every STORE_BATCH_SIZE articles
+	# incremental ingestion, parsing of a feed stops after HWM_MARGIN consecutive articles at or below high-water mark of last ingest
+	HWM_MARGIN = 3
+	# url canonicalization
+	tracking_param_prefixes = 'utm_', 'ga_', 'mc_', 'soc_', 'guce_'
+	tracking_params = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'ncid', 'guccounter', 'cmpid', 'ref', 'ref_src', '_ga', '_gl'}
+	default_ports = {'http': 80, 'https': 443}
+	# near-duplicate clustering, 64 bit simhash split in SIMHASH_BANDS bands, 
+	# hashes within SIMHASH_DISTANCE bits always share at least one band when SIMHASH_DISTANCE < SIMHASH_BANDS
+	SIMHASH_BITS = 64
+	SIMHASH_BANDS = 4
+	SIMHASH_DISTANCE = 3
+	SIMHASH_CANDIDATES = 32 			# newest rows sharing a band compared with every new row, bounds clustering of many similar rows
+	word_pattern = re.compile(r'\w+')
+	simhash_fields = {ord('0'): '\0\0\0\0', ord('1'): '\1\0\0\0'} 	# translates simhash digit to its 32 bit counter
+	simhash_digits = bytes(ord('0') + (byte >> 7) for byte in range(256)) 	# translates top byte of a bit counter to its simhash digit
+	# description compression, descriptions shorter than COMPRESS_MIN_SIZE bytes are stored as text
+	compression_codecs = 'none', 'zlib', 'zstd'
+	COMPRESS_MIN_SIZE = 256
+	ZLIB_LEVEL = 6
+	ZSTD_LEVEL = 3
+	ZSTD_DICT_SIZE = 64 * 1024 		# size of dictionary trained on stored descriptions
+	ZSTD_DICT_SAMPLES = 10000 			# maximum number of descriptions used for training
+	ZSTD_DICTS = {} 					# dict_id: trained dictionary loaded from compression_dicts table
+	ZSTD_CODERS = threading.local() 	# zstd (de)compressors are not thread-safe, each thread keeps its own
+	# columns added after first release, added to existing tables by db_migrate before db_schema is executed
+	db_added_columns = {'cached_news': (('news_link', 'TEXT'), ('news_ts', 'INTEGER'), ('news_extract', 'TEXT'), 
+										('news_guid', 'TEXT'), ('news_author', 'TEXT')), 
+						'feed_state': (('last_key', 'TEXT'), ('last_ts', 'INTEGER'), ('body_size', 'INTEGER'))}
+	# database schema, every statement is executed on connecting, so existing databases are migrated
+	db_schema = (
+		"""CREATE TABLE IF NOT EXISTS cached_news
+				(date TEXT, 
+				news_feed_title TEXT,
+				news_src TEXT, 
+				news_title TEXT, 
+				news_date TEXT, 
+				news_description TEXT, 
+				news_url TEXT, 
+				news_link TEXT, 
+				news_ts INTEGER, 
+				news_extract TEXT, 
+				news_guid TEXT, 
+				news_author TEXT)""",
+		"""CREATE INDEX IF NOT EXISTS cached_news_title ON cached_news (news_title COLLATE NOCASE)""",
+		"""CREATE UNIQUE INDEX IF NOT EXISTS cached_news_link ON cached_news (news_link)""",
+		"""CREATE INDEX IF NOT EXISTS cached_news_date ON cached_news (news_date)""",
+		"""CREATE INDEX IF NOT EXISTS cached_news_ts ON cached_news (news_ts)""",
+		"""CREATE INDEX IF NOT EXISTS cached_news_guid ON cached_news (news_guid)""",
+		"""CREATE TABLE IF NOT EXISTS news_simhash
+				(news_id INTEGER PRIMARY KEY, 
+				simhash INTEGER, 
+				cluster INTEGER)""",
+		"""CREATE TABLE IF NOT EXISTS simhash_bands
+				(band INTEGER, 
+				value INTEGER, 
+				news_id INTEGER)""",
+		"""CREATE INDEX IF NOT EXISTS simhash_bands_value ON simhash_bands (band, value)""",
+		"""CREATE INDEX IF NOT EXISTS news_simhash_cluster ON news_simhash (cluster)""",
+		"""CREATE TABLE IF NOT EXISTS db_settings
+				(key TEXT PRIMARY KEY, 
+				value TEXT)""",
+		"""CREATE TABLE IF NOT EXISTS compression_dicts
+				(dict_id INTEGER PRIMARY KEY, 
+				data BLOB)""",
+		"""CREATE TABLE IF NOT EXISTS host_breakers
+				(host TEXT PRIMARY KEY, 
+				failures INTEGER, 
+				open_until REAL)""",
+		"""CREATE TABLE IF NOT EXISTS ingest_checkpoint
+				(filepath TEXT PRIMARY KEY, 
+				mtime REAL, 
+				size INTEGER, 
+				articles INTEGER)""",
+		"""CREATE TABLE IF NOT EXISTS feed_profiles
+				(news_src TEXT PRIMARY KEY, 
+				article_tag TEXT, 
+				description_tag TEXT, 
+				date_tag TEXT, 
+				namespaces TEXT, 
+				date_format TEXT)""",
+		# fragment cache of earlier versions, rendering an article is cheaper than looking its fragment up
+		"DROP TABLE IF EXISTS rendered_fragments",
+		"""CREATE TABLE IF NOT EXISTS daily_digests
+				(date TEXT PRIMARY KEY, 
+				articles INTEGER, 
+				feed_titles TEXT)""",
+		"""CREATE TABLE IF NOT EXISTS digest_entries
+				(date TEXT, 
+				news_id INTEGER, 
+				json TEXT, 
+				html TEXT, 
+				PRIMARY KEY (date, news_id)) WITHOUT ROWID""",
+		"""CREATE TABLE IF NOT EXISTS feed_state
+				(news_src TEXT PRIMARY KEY, 
+				body_sha256 TEXT, 
+				ingested REAL, 
+				last_key TEXT, 
+				last_ts INTEGER, 
+				body_size INTEGER)""",
+	)
 
 	# working tags
 	ARTICLE = None
 	DESCRIPTION = None
 	DATE = None
+	DATE_FORMAT = None
 	LINK = 'link'
 	TITLE = 'title'
+	dispatch = None 					# tag: bound handler of article sub-elements for working tags, see build_dispatch
+	full_content = None 				# content:encoded or Atom content element of article being parsed
+	digest = None 						# sha256 of feed body being read, updated by read_chunks
 	### different tag variants for parsing different sources
 	article_tags = 'item', 'article', 'entry'	
 	description_tags = 'description', 'summary'
 	date_tags = 'pubdate', 'pubDate', 'published', 'updated', 'date'
+	feed_tags = 'channel', 'feed' 		# parents of feed title (RSS 0.9x-2.0, RSS 1.0/RDF and Atom)
+	### handlers of article sub-elements other than working tags, by local tag name: RSS 2.0 guid/author/enclosure, Atom id/author/content, 
+	### Dublin Core identifier/creator (dc:date is a date tag), Media RSS content/thumbnail/group and content:encoded
+	element_handlers = {'guid': 'parse_guid', 'id': 'parse_guid', 'identifier': 'parse_guid', 
+						'author': 'parse_author', 'creator': 'parse_author', 
+						'enclosure': 'parse_media', 'content': 'parse_media', 'thumbnail': 'parse_media', 'group': 'parse_media_group', 
+						'encoded': 'parse_media'}
+	rdf_about = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about' 	# identifier of RSS 1.0 item
+	### date formats tried on first date of a feed, matching format is used instead of dateutil for the rest of the feed
+	date_formats = ('%a, %d %b %Y %H:%M:%S %z', '%a, %d %b %Y %H:%M:%S %Z', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S%z', 
+					'%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
 
 	# RegEx pattern for removing tag prefix
 	pattern_prefix = "{.*}"
@@ -150,27 +481,66 @@ class Tree:
 
 
 	def __init__(self, url, json_, html_filepath, pdf_filepath, limit, filter_src, filter_date, 
-					db_filepath='cached_news.db', ):
+					db_filepath='cached_news.db', timeout=10, max_bytes=16 * 1024 * 1024, workers=None, format_=None, latest=None, collapse=False, timeline=False, backend='etree', huge_tree=False, extract='full', lazy=False, retries=2, deadline=None, user_agent=None, fetch_workers=None, per_host=None, host_rate=None, page_size=None, ):
 		"""		Initiates class <Tree> object, connects to provided url, 
+		the run is a pipeline of stages: fetch -> parse -> dedup -> store -> render, parsing runs in background thread and passes articles 
+		through bounded queue (see Tree.pipe), so every article is stored and printed as soon as it is parsed.
+		if feed profile of the source is saved, articles are parsed while streaming (see stream_articles), otherwise
 		after fetching response from RSS feed website, calls get_xml_tree method and xml.etree.ElementTree(.Element) object is created,
 		calls collect_descendant_elements and collects all child, grandchild and any depth child elements, calls remove_tag_prefixes method 
 		(to cover situations where, while fetching, prefixes are concatenated in front of element tags by server, also collects all tags in a set and returns it)
 		set_working_tags method iterates through collected tags and sets self.ARTICLE, self.DESCRIPTION, self.DATE, self.TITLE, self.LINK variables for parsing article elements later,
 		collect_articles method is called, which iterates through list of child elements and collects only article elements,
-		after that parse_article method is called for every article in collected articles, organizes articles and their sub-elements in dictionaries and appends them to Tree.CACHE.
-		then prints (if --limit is specified limits number of articles) formatted collected news (or if --json specified converts to json) to stdout 
-		or if --html or --pdf is specified converts cached news to corresponding format, after that inserts cached news in SQLite3 database.
-		if URL was not provided fetches news from database (if --date or --source is specified filters before fetching)
-		according to provided arguments prints to stdout or converts to specified format.
+		after that parse_article method is called for every article in collected articles, organizes articles and their sub-elements in dictionaries.
+		every article is inserted in SQLite3 database and printed formatted (or if --json specified converts to json) to stdout 
+		or if --html or --pdf is specified appended to Tree.CACHE and cached news are converted to corresponding format,
+		with --page-size html is exported as pages of Tree.PAGE_SIZE articles and index page (see create_html_pages), 
+		from database articles are streamed into pages without collecting them in Tree.CACHE.
+		if --limit is specified parsing stops after Tree.LIMIT articles, if --latest is specified whole feed is stored and only Tree.LATEST most recent articles are output.
+		every stored article gets simhash of its title and description and is assigned to cluster of near-duplicate stories, 
+		if --collapse is specified only first article of every cluster is output.
+		if several urls are provided, with --timeline their articles are collected from the same Tree.FETCH_WORKERS threads 
+		and sorted by publication time, so articles of all sources come out oldest first (see timeline_stage).
+		feed XML is parsed with Tree.BACKEND parser (see xml_parser).
+		descriptions are extracted according to Tree.EXTRACT, with --lazy raw descriptions are stored and extracted only 
+		right before articles are printed or exported (see extract_stage).
+		urls are fetched with retries, within --deadline and skipped while circuit breaker of their host is open (see fetch), 
+		with several urls a failing source is reported and skipped instead of ending the run.
+		several urls are fetched on Tree.FETCH_WORKERS threads in order interleaving their hosts, Tree.SCHEDULER keeps 
+		connections and request rate of every host within limits (see HostScheduler).
+		if URL is a directory, feed files in it are parsed on Tree.WORKERS worker processes and stored in database without printing.
+		if URL was not provided fetches news from database (if --date or --source is specified filters before fetching, 
+		--limit, --latest and --timeline are applied in SQL query) according to provided arguments prints to stdout or converts to specified format.
 		"""
-		logging.debug("Tree.__init__(%s, %s, %s, %s, %s, %s, %s, %s)" % 
-					(url, json_, html_filepath, pdf_filepath, limit, filter_src, filter_date, db_filepath))
+		logging.debug("Tree.__init__(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)" % 
+					(url, json_, html_filepath, pdf_filepath, limit, filter_src, filter_date, db_filepath, timeout, max_bytes, workers, format_, latest, 
+					collapse, timeline, backend, huge_tree, extract, lazy, retries, deadline, user_agent, fetch_workers, per_host, host_rate, page_size))
 		Tree.URL = url
+		Tree.TIMEOUT = timeout
+		Tree.MAX_BYTES = max_bytes
+		if workers is not None:
+			Tree.WORKERS = workers
 		Tree.HTML_FILEPATH = html_filepath
 		Tree.PDF_FILEPATH = pdf_filepath
+		Tree.PAGE_SIZE = page_size
 		Tree.DB_FILEPATH = db_filepath
 		Tree.LIMIT = limit
+		Tree.LATEST = latest
+		Tree.COLLAPSE = collapse
+		Tree.TIMELINE = timeline
+		Tree.BACKEND = backend
+		Tree.HUGE_TREE = huge_tree
+		Tree.EXTRACT = extract
+		Tree.LAZY = lazy
+		Tree.RETRIES = retries
+		Tree.DEADLINE_AT = time.monotonic() + deadline if deadline is not None else None
+		if user_agent is not None:
+			Tree.USER_AGENT = user_agent
+		if fetch_workers is not None:
+			Tree.FETCH_WORKERS = fetch_workers
+		Tree.SCHEDULER = HostScheduler(per_host or HostScheduler.PER_HOST, host_rate or HostScheduler.RATE)
 		Tree.JSON = json_
+		Tree.FORMAT = format_
 		if filter_date is not None:
 			Tree.FILTER_K = 'date'
 			Tree.FILTER_V = filter_date
@@ -179,59 +549,76 @@ class Tree:
 			Tree.FILTER_V = filter_src
 		try:
 			Tree.DB = Tree.db_connection(Tree.DB_FILEPATH)
-			if Tree.URL is not None:
+			Tree.BREAKERS, Tree.BREAKERS_CHANGED = Tree.db_fetch_breakers(Tree.DB), set()
+			Tree.open_output()
+			if isinstance(Tree.URL, (list, tuple)) and len(Tree.URL) == 1:
+				Tree.URL = Tree.URL[0]
+			elif isinstance(Tree.URL, (list, tuple)) and len(Tree.URL) == 0:
+				Tree.URL = None
+			if isinstance(Tree.URL, str) and os.path.isdir(os.path.join(CWD, Tree.URL)):
+				logging.info(f"Ingesting feed files from directory: {url}")
+				Tree.ingest_directory(Tree.DB, os.path.join(CWD, Tree.URL), Tree.WORKERS)
+			elif Tree.URL is not None:
 				logging.info(f"Tree object created. url: {url}")
-				self.request = self.create_request(Tree.URL)
-				self.response = self.establish_connection(self.request)
-				logging.info(f"Connected to source. self.response: {self.response}")
-				self.tree = self.get_xml_tree()
-				logging.info(f"Element object created. self.tree = {self.tree}")
-				self.elements = self.collect_descendant_elements()
-				logging.info("All sub-elements in xml tree collected.")
-				self.__tags = self.remove_tag_prefixes() 	#returns a set of tags found in xml tree
-				self.set_working_tags()
-				logging.info(f"Working tags set. \n\tself.ARTICLE = {self.ARTICLE}\n\tself.DESCRIPTION = {self.DESCRIPTION}\n\tself.TITLE = {self.TITLE}\n\tself.LINK = {self.LINK}")
-				self.articles = self.collect_articles()
-				logging.info("Article elements collected.")
-				for article in self.articles:
-					self.dict_ = {}
-					logging.info("Parsing article.")
-					self.parse_article(article)
-					logging.info("Adding parsed article to cache.")
-					Tree.cache_news(self.dict_) # appends to Tree.CACHE
+				readers = [self]
+				sources = Tree.interleave_hosts(Tree.URL) if isinstance(Tree.URL, (list, tuple)) else [Tree.URL]
+				readers += [object.__new__(Tree) for _ in sources[1:]]
+				# profiles are fetched here, parsing threads do not touch database
+				streams = [reader.feed_stream(source, Tree.db_fetch_profile(Tree.DB, source), skip_failed=len(sources) > 1, 
+												state=Tree.db_fetch_state(Tree.DB, source)) 
+							for reader, source in zip(readers, sources)]
+				if Tree.TIMELINE:
+					articles = Tree.timeline_stage(Tree.pipe_many(streams, Tree.FETCH_WORKERS, Tree.QUEUE_SIZE), sources)
+				elif len(streams) > 1:
+					articles = Tree.pipe_many(streams, Tree.FETCH_WORKERS, Tree.QUEUE_SIZE)
+				else:
+					articles = Tree.pipe(streams[0], Tree.QUEUE_SIZE)
+				handled = Counter()
+				articles = Tree.count_stage(articles, handled)
+				articles = Tree.dedup_stage(articles)
+				if Tree.COLLAPSE:
+					articles = Tree.collapse_stage(articles)
+				articles = Tree.limit_stage(articles, Tree.LIMIT)
+				articles = Tree.store_stage(Tree.DB, articles)
+				if Tree.LATEST is not None:
+					articles = heapq.nlargest(Tree.LATEST, articles, key=lambda article: str(article['news_date']))
+				articles = Tree.extract_stage(articles)
 				if Tree.HTML_FILEPATH is None and Tree.PDF_FILEPATH is None:
-					# loops through and prints cached articles
-					logging.info("Printing news articles from Tree.CACHE. Tree.LIMIT = %s" % Tree.LIMIT)
-					for article in Tree.CACHE:
-						if Tree.LIMIT > 0:
-							Tree.print_news(article)
-							Tree.LIMIT -= 1
-						elif Tree.LIMIT == 0:
-							pass
-						else:
-							Tree.print_news(article)
+					# prints articles as they come out of store stage
+					logging.info("Printing news articles. Tree.LIMIT = %s" % Tree.LIMIT)
+					for article in articles:
+						Tree.print_news(article)
 				else:
+					for article in articles:
+						Tree.cache_news(article)
 					logging.info("Checking if --html or --pdf flags were set")
 					if Tree.HTML_FILEPATH is not None:
 						Tree.create_html(filepath=Tree.HTML_FILEPATH)
 					if Tree.PDF_FILEPATH is not None:
 						Tree.create_pdf()
+				produced = Counter()
+				for reader in readers:
+					produced[reader.source] += getattr(reader, 'produced', 0)
+				for reader in readers:
+					reader.store_profile()
+					# feed cut short by --limit keeps state of last ingest, so its articles left out are ingested next run
+					if handled[reader.source] == produced[reader.source]:
+						reader.store_state()
 			else: # if self.URL is None
 				logging.info("URL not provided, fetching news from database")
-				Tree.db_fetch_news(Tree.DB, Tree.FILTER_K, Tree.FILTER_V)
-				if Tree.HTML_FILEPATH is None and Tree.PDF_FILEPATH is None:
-					logging.info("Printing news articles from Tree.CACHE. Tree.LIMIT = %s" % Tree.LIMIT)
-					for article in Tree.CACHE:
-						if Tree.LIMIT > 0:
-							Tree.print_news(article)
-							Tree.LIMIT -= 1
-						elif Tree.LIMIT == 0:
-							pass
-						else:
-							Tree.print_news(article)
-						if len(Tree.CACHE) < 1:
-							break
+				if Tree.serve_digest():
+					pass
+				elif Tree.PAGE_SIZE is not None and Tree.HTML_FILEPATH is not None and Tree.PDF_FILEPATH is None:
+					logging.info("Writing html pages of articles streamed from database. Tree.LIMIT = %s" % Tree.LIMIT)
+					Tree.create_html_pages(Tree.HTML_FILEPATH, Tree.extract_stage(Tree.db_iter_news(Tree.DB, Tree.FILTER_K, Tree.FILTER_V, 
+											Tree.LIMIT, Tree.LATEST, Tree.COLLAPSE, Tree.TIMELINE)), Tree.PAGE_SIZE, Tree.WORKERS)
+				elif Tree.HTML_FILEPATH is None and Tree.PDF_FILEPATH is None:
+					logging.info("Printing news articles streamed from database. Tree.LIMIT = %s" % Tree.LIMIT)
+					for article in Tree.extract_stage(Tree.db_iter_news(Tree.DB, Tree.FILTER_K, Tree.FILTER_V, Tree.LIMIT, Tree.LATEST, 
+																			Tree.COLLAPSE, Tree.TIMELINE)):
+						Tree.print_news(article)
 				else:
+					Tree.db_fetch_news(Tree.DB, Tree.FILTER_K, Tree.FILTER_V, Tree.LIMIT, Tree.LATEST, Tree.COLLAPSE, Tree.TIMELINE)
 					logging.info("Checking if --html or --pdf flags were set")
 					if Tree.HTML_FILEPATH is not None:
 						Tree.create_html(filepath=Tree.HTML_FILEPATH)
@@ -248,19 +635,676 @@ class Tree:
 			logging.exception(e)
 			sys.exit(1)
 		finally:
-			if Tree.URL is not None:
-				while len(Tree.CACHE) > 0:
-					Tree.db_insert_cached_one(Tree.DB)
+			Tree.close_output()
 			if Tree.DB is not None:
+				Tree.db_store_breakers(Tree.DB)
 				logging.info("Database connection closed")
 				Tree.DB.close()
 
+	def feed_stream(self, source: str, profile: dict, skip_failed: bool = False, state: dict = None):
+		"""Generator opening source and yielding its parsed articles (see iter_feed), 
+		source is opened on first iteration, so in parsing thread when run through Tree.pipe.
+		Body is hashed with sha256 while it is read and parsed. If state of last ingest (see db_fetch_state) has a hash and 
+		Content-Length of response is the one of last ingest or unknown, body is hashed before parsing, spooled to a temporary file 
+		above Tree.SPOOL_SIZE bytes, and if hash is the same the feed is reported unchanged on stderr and nothing is parsed. 
+		Body of another length has changed and is parsed while it streams in.
+		Articles at or below newest article of last ingest (high-water mark, see item_key), the mark itself and dated ones 
+		not newer than it, were ingested then and are not yielded again. Once the mark is found, parsing stops after Tree.HWM_MARGIN 
+		consecutive articles not newer than it, counting the mark itself; margin only decides where to stop, so feeds which reorder 
+		articles do not lose any, and feeds listing oldest articles first are never cut short. Rest of body is only read for its hash. Once the feed is done, new state is kept in self.state (see store_state).
+		Number of yielded articles is kept in self.produced, state is only saved if all of them were handled downstream (see count_stage).
+		If skip_failed is True, failure of source is reported on stderr and ends only this stream"""
+		self.source = source
+		self.state = None
+		self.produced = 0
+		state = state or {}
+		spool = None
+		try:
+			with Tree.host_slot(source):
+				self.response = self.open_source(source)
+				logging.info(f"Connected to source. self.response: {self.response}")
+				self.digest = hashlib.sha256()
+				headers = getattr(self.response, 'headers', None)
+				length = headers.get('Content-Length') if headers is not None else None
+				length = int(length) if isinstance(length, str) and length.isdigit() else None
+				if state.get('body_sha256') is not None and (length is None or length == state.get('body_size')):
+					spool = tempfile.SpooledTemporaryFile(max_size=Tree.SPOOL_SIZE)
+					for chunk in Tree.read_chunks(self.response, self.digest):
+						spool.write(chunk)
+					if self.digest.hexdigest() == state['body_sha256']:
+						logging.info("Source %s unchanged since last ingest" % source)
+						print(f"Unchanged {source}: same body as last ingest", file=sys.stderr)
+						return
+					spool.seek(0)
+					spool.headers = headers
+					self.response, body_sha256, self.digest = spool, self.digest.hexdigest(), None
+				last_key, last_ts = state.get('last_key'), state.get('last_ts')
+				newest = (last_ts, last_key) if last_ts is not None else None
+				anchored, known = False, 0
+				articles = self.iter_feed(profile)
+				for article in articles:
+					key, ts = Tree.item_key(article), Tree.timestamp(article['news_date'])
+					if newest is None or ts > newest[0]:
+						newest = (ts, key)
+					if last_ts is None or (key != last_key and not 0 < ts <= last_ts): # undated articles can not be placed below the mark
+						self.produced += 1
+						yield article
+					anchored = anchored or key == last_key
+					known = known + 1 if anchored and (key == last_key or ts <= last_ts) else 0
+					if anchored and known >= Tree.HWM_MARGIN:
+						logging.info("High-water mark of %s reached, skipping rest of feed" % source)
+						articles.close()
+						for _ in Tree.read_chunks(self.response, self.digest):
+							pass
+						break
+				self.state = {'body_sha256': self.digest.hexdigest() if self.digest is not None else body_sha256, 
+							'last_key': newest[1] if newest is not None else None, 
+							'last_ts': newest[0] if newest is not None else None, 
+							'body_size': length}
+		except FeedParserException as e:
+			if not skip_failed:
+				raise
+			logging.error("Skipping source %s: %s" % (source, e))
+			print(f"Skipping {source}: {e}", file=sys.stderr)
+		finally:
+			if spool is not None:
+				spool.close()
+
+	def parse_feed(self) -> None:
+		"""Parses feed from self.response with iter_feed, appends every article to Tree.CACHE and saves feed profile if it changed"""
+		for dict_ in self.iter_feed(Tree.db_fetch_profile(Tree.DB, Tree.URL)):
+			logging.info("Adding parsed article to cache.")
+			Tree.cache_news(dict_) # appends to Tree.CACHE
+		self.store_profile()
+
+	def iter_feed(self, profile: dict):
+		"""Generator parsing feed from self.response and yielding article dictionaries.
+		With saved feed profile articles are parsed while streaming, 
+		otherwise (or if profile stopped matching the feed) working tags are detected on whole xml tree.
+		Does not touch database, so it can run in parsing thread, changed profile is saved by store_profile"""
+		self.profile_changed = False
+		if profile is not None:
+			yield from self.stream_articles(profile)
+			if self.articles is not None:
+				return
+			logging.info("Feed profile does not match, no %s elements found" % profile['article_tag'])
+			self.ARTICLE = self.DESCRIPTION = self.DATE = None
+			self.dispatch = None
+		else:
+			self.tree = self.get_xml_tree()
+			logging.info(f"Element object created. self.tree = {self.tree}")
+		logging.info("Detecting working tags of feed.")
+		self.elements = self.collect_descendant_elements()
+		logging.info("All sub-elements in xml tree collected.")
+		self.__tags = self.remove_tag_prefixes() 	#returns a set of tags found in xml tree
+		self.set_working_tags()
+		logging.info(f"Working tags set. \n\tself.ARTICLE = {self.ARTICLE}\n\tself.DESCRIPTION = {self.DESCRIPTION}\n\tself.TITLE = {self.TITLE}\n\tself.LINK = {self.LINK}")
+		self.articles = self.collect_articles()
+		logging.info("Article elements collected.")
+		self.DATE_FORMAT = self.detect_date_format()
+		self.profile_changed = True
+		for article in self.articles:
+			self.dict_ = {}
+			logging.info("Parsing article.")
+			self.parse_article(article)
+			yield self.dict_
+
+	def stream_articles(self, profile: dict):
+		"""Generator feeding chunks of self.response into XMLPullParser and yielding article dictionaries as soon as article element is closed,
+		parsed article elements are cleared, so memory does not grow with number of articles.
+		Working tags are taken from profile, if date tag of profile is missing in first article, working tags are detected from its sub-elements.
+		If no article element was found, sets self.articles to None and self.tree to the whole xml tree for detecting working tags"""
+		try:
+			article_tag = profile['article_tag']
+			if article_tag in profile['namespaces']:
+				article_tag = f"{{{profile['namespaces'][article_tag]}}}{article_tag}"
+			self.ARTICLE, self.DESCRIPTION, self.DATE = profile['article_tag'], profile['description_tag'], profile['date_tag']
+			self.DATE_FORMAT = profile['date_format']
+			self.dispatch = None
+			self.feed_title = str(Tree.TODAY)
+			self.namespaces = {}
+			self.articles = None
+			self.tree = None
+			parser = Tree.xml_parser(self.response, pull=True)
+			path = [] # tags of currently open elements
+
+			def read_events():
+				for chunk in Tree.read_chunks(self.response, self.digest):
+					parser.feed(chunk)
+					yield from parser.read_events()
+				parser.close()
+				yield from parser.read_events()
+
+			for event, element in read_events():
+				if event == 'start':
+					if self.tree is None:
+						self.tree = element
+					path.append(element.tag)
+					continue
+				path.pop()
+				if element.tag == article_tag:
+					element.tag = self.ARTICLE
+					for child in element:
+						if child.tag[:1] == '{':
+							child.tag = self.strip_prefix(child.tag)
+					if self.articles is None:
+						self.articles = []
+						self.__tags = {child.tag for child in element}
+						if self.DATE is not None and self.DATE not in self.__tags:
+							logging.info("Date tag %s missing in article, detecting working tags from article sub-elements" % self.DATE)
+							self.DESCRIPTION = self.DATE = None
+							self.set_working_tags()
+							self.articles = [element]
+							self.DATE_FORMAT = self.detect_date_format()
+							self.profile_changed = True
+					self.dict_ = {}
+					logging.info("Parsing article.")
+					self.parse_article(element)
+					element.clear()
+					yield self.dict_
+				elif Tree.local_name(element.tag) == 'title' and path and Tree.local_name(path[-1]) in Tree.feed_tags:
+					logging.debug("Channel title found: %s" % element.text)
+					self.feed_title = element.text
+		except FeedParserException:
+			raise
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	def store_profile(self) -> None:
+		"""Saves feed profile in database if it was detected during last parse"""
+		if getattr(self, 'profile_changed', False):
+			Tree.db_store_profile(Tree.DB, self.source if self.source is not None else Tree.URL, self.profile())
+
+	def store_state(self) -> None:
+		"""Saves hash of feed body and high-water mark in database if feed was ingested during this run (see feed_stream).
+		Called only for feeds all of which parsed articles reached store stage, high-water mark is taken from newest parsed article, 
+		so it must not move past articles a cut run did not store"""
+		if getattr(self, 'state', None) is not None:
+			Tree.db_store_state(Tree.DB, self.source, self.state)
+
+	@staticmethod
+	def pipe(iterable, maxsize: int):
+		"""Generator running iterable in background thread and yielding its items through queue of maxsize items,
+		producer blocks while queue is full. Exception raised by iterable is re-raised in consumer"""
+		items = queue.Queue(maxsize)
+		stop = threading.Event()
+		done = object()
+
+		def produce():
+			try:
+				for item in iterable:
+					while not stop.is_set():
+						try:
+							items.put((item, None), timeout=0.1)
+							break
+						except queue.Full:
+							continue
+					if stop.is_set():
+						return
+				items.put((done, None))
+			except BaseException as e:
+				items.put((done, e))
+
+		producer = threading.Thread(target=produce, daemon=True)
+		producer.start()
+		try:
+			while True:
+				item, error = items.get()
+				if item is done:
+					if error is not None:
+						raise error
+					return
+				yield item
+		finally:
+			stop.set()
+
+	@staticmethod
+	def pipe_many(iterables: list, workers: int, maxsize: int):
+		"""Generator running iterables on workers background threads, each thread takes next iterable when previous is exhausted, 
+		and yielding their items through one queue of maxsize items as they come. Exception raised by iterable is re-raised in consumer"""
+		items = queue.Queue(maxsize)
+		stop = threading.Event()
+		done = object()
+		pending = iter(iterables)
+		lock = threading.Lock()
+
+		def produce():
+			try:
+				while not stop.is_set():
+					with lock:
+						iterable = next(pending, None)
+					if iterable is None:
+						break
+					for item in iterable:
+						while not stop.is_set():
+							try:
+								items.put((item, None), timeout=0.1)
+								break
+							except queue.Full:
+								continue
+						if stop.is_set():
+							return
+				items.put((done, None))
+			except BaseException as e:
+				items.put((done, e))
+
+		producers = [threading.Thread(target=produce, daemon=True) for _ in range(max(1, min(workers, len(iterables))))]
+		for producer in producers:
+			producer.start()
+		try:
+			running = len(producers)
+			while running:
+				item, error = items.get()
+				if item is done:
+					if error is not None:
+						raise error
+					running -= 1
+					continue
+				yield item
+		finally:
+			stop.set()
+
+	@staticmethod
+	def interleave_hosts(sources: list) -> list:
+		"""Returns sources reordered round-robin over their hosts (a1, b1, c1, a2, b2, ...), order within one host is kept"""
+		hosts = OrderedDict()
+		for source in sources:
+			hosts.setdefault(urlsplit(source).hostname or source, []).append(source)
+		return [source for group in itertools.zip_longest(*hosts.values()) for source in group if source is not None]
+
+	@staticmethod
+	def host_slot(source: str):
+		"""Returns context manager holding connection slot of source host in Tree.SCHEDULER, 
+		local sources and runs without scheduler get one which does nothing"""
+		if Tree.SCHEDULER is None or urlsplit(source).scheme not in ('http', 'https'):
+			return contextlib.nullcontext()
+		return Tree.SCHEDULER.slot(urlsplit(source).hostname)
+
+	@staticmethod
+	def timestamp(news_date) -> int:
+		"""Returns publication date (datetime, date or their string) as seconds since epoch, naive dates are taken as UTC, 0 if unparsable"""
+		try:
+			value = datetime.fromisoformat(str(news_date))
+		except ValueError:
+			try:
+				value = dateutil.parser.parse(str(news_date), ignoretz=True)
+			except (ValueError, OverflowError):
+				return 0
+		return int((value.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds())
+
+	@staticmethod
+	def timeline_stage(articles, sources: list):
+		"""Generator yielding articles of sources, fetched together by pipe_many, ordered by publication time, oldest first. 
+		Articles published at the same time keep order of their sources and their order within the feed. 
+		All feeds have to be read whole, each is bounded by Tree.MAX_BYTES"""
+		order = {source: index for index, source in enumerate(sources)}
+		yield from sorted(articles, key=lambda article: (Tree.timestamp(article['news_date']), order.get(article['news_src'], len(order))))
+
+	@staticmethod
+	def count_stage(articles, counts: Counter):
+		"""Generator passing articles on and counting them by news_src in counts. Every article taken from it is either dropped 
+		as duplicate or reaches store stage, only limit_stage stops taking them early, so feed whose count equals number of 
+		articles it produced was ingested whole"""
+		for article in articles:
+			counts[article['news_src']] += 1
+			yield article
+
+	@staticmethod
+	def limit_stage(articles, limit: int):
+		"""Generator passing on first limit articles. Upstream stages are closed as soon as the last one is taken, before it is 
+		passed on, so pipe sets its stop event and its thread stops parsing instead of filling the queue ahead of stages 
+		which are still storing and printing. Negative limit passes everything"""
+		if limit is None or limit < 0:
+			return articles
+		close = getattr(articles, 'close', lambda: None)
+
+		def take():
+			try:
+				left = limit
+				for article in (articles if left else ()):
+					left -= 1
+					if not left:
+						close()
+					yield article
+					if not left:
+						return
+			finally:
+				close()
+
+		return take()
+
+	@staticmethod
+	def dedup_stage(articles):
+		"""Generator skipping articles which title or canonical link was already seen in this run"""
+		seen = set()
+		seen_links = set()
+		for article in articles:
+			title = article['news_title'].lower()
+			link = Tree.news_link(article)
+			if title in seen or link in seen_links:
+				logging.info("Skipping duplicate article: %s" % article['news_title'])
+				continue
+			seen.add(title)
+			if link is not None:
+				seen_links.add(link)
+			yield article
+
+	@staticmethod
+	def collapse_stage(articles):
+		"""Generator skipping articles which are near-duplicates of article already passed in this run, 
+		candidates are looked up by simhash bands, so every article is compared only with Tree.SIMHASH_CANDIDATES newest articles 
+		sharing each band"""
+		bands = {}
+		for article in articles:
+			simhash = Tree.article_simhash(article['news_title'], article.get('news_description', ''), article.get('news_extract'))
+			keys = Tree.simhash_bands(simhash)
+			if any(Tree.hamming(simhash, other) <= Tree.SIMHASH_DISTANCE for key in keys for other in bands.get(key, ())[-Tree.SIMHASH_CANDIDATES:]):
+				logging.info("Skipping near-duplicate article: %s" % article['news_title'])
+				continue
+			for key in keys:
+				bands.setdefault(key, []).append(simhash)
+			yield article
+
+	@staticmethod
+	def article_simhash(title: str, description: str, extract: str = None) -> int:
+		"""Returns simhash of article title and description, raw description of article stored with Tree.LAZY 
+		(extract is its news_extract) is reduced to text content first, so markup does not count and signatures match eager ones"""
+		if extract is not None:
+			description = Tree.html_text(description)
+		return Tree.simhash(f"{title}\n{description or ''}")
+
+	@staticmethod
+	@functools.lru_cache(maxsize=65536)
+	def spread_token(token: str) -> int:
+		"""Returns 64 bit hash of token with every bit moved to its own 32 bit field, 
+		so summing spread hashes counts set bits of all positions at once"""
+		value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=Tree.SIMHASH_BITS // 8).digest(), 'big')
+		# binary digits of value, lowest first, become little-endian 32 bit fields of 0 or 1
+		fields = format(value, f'0{Tree.SIMHASH_BITS}b')[::-1].translate(Tree.simhash_fields)
+		return int.from_bytes(fields.encode('latin-1'), 'little')
+
+	@staticmethod
+	def simhash(text: str) -> int:
+		"""Returns 64 bit simhash of words of text: bit is set if it is set in hashes of more than half of the words"""
+		words = Tree.word_pattern.findall(text.lower())
+		total = sum(map(Tree.spread_token, words))
+		# adding 2**31 - (len(words) // 2 + 1) to every 32 bit counter sets its top bit exactly when the bit is set in more than 
+		# half of the words, so all 64 bits are read from top bytes of the counters at once instead of one by one
+		counters = int.from_bytes(b'\1\0\0\0' * Tree.SIMHASH_BITS, 'little')
+		top = (total + counters * ((1 << 31) - len(words) // 2 - 1)).to_bytes(4 * Tree.SIMHASH_BITS, 'little')[3::4]
+		return int(top.translate(Tree.simhash_digits)[::-1], 2)
+
+	@staticmethod
+	def simhash_bands(simhash: int) -> list[tuple[int, int]]:
+		"""Returns (band, value) pairs of simhash split in Tree.SIMHASH_BANDS bands"""
+		width = Tree.SIMHASH_BITS // Tree.SIMHASH_BANDS
+		return [(band, simhash >> (band * width) & ((1 << width) - 1)) for band in range(Tree.SIMHASH_BANDS)]
+
+	@staticmethod
+	def hamming(a: int, b: int) -> int:
+		"""Returns number of differing bits"""
+		return bin(a ^ b).count('1')
+
+	@staticmethod
+	def canonical_url(url: str) -> str:
+		"""Returns canonical form of url: lowercase scheme and host, no default port, no fragment, 
+		no tracking parameters (Tree.tracking_params, Tree.tracking_param_prefixes) and query parameters sorted"""
+		try:
+			parts = urlsplit(url.strip())
+		except ValueError:
+			return url.strip()
+		scheme = parts.scheme.lower()
+		netloc = (parts.hostname or '').rstrip('.')
+		try:
+			port = parts.port
+		except ValueError:
+			port = None
+		if port is not None and port != Tree.default_ports.get(scheme):
+			netloc = f"{netloc}:{port}"
+		if parts.username is not None:
+			netloc = f"{parts.username}{':' + parts.password if parts.password is not None else ''}@{netloc}"
+		query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) 
+						if key.lower() not in Tree.tracking_params and not key.lower().startswith(Tree.tracking_param_prefixes))
+		return urlunsplit((scheme, netloc, parts.path or '/', urlencode(query), ''))
+
+	@staticmethod
+	def news_link(dict_: dict) -> str:
+		"""Returns canonical url of first (link) url of article, None if article has no http(s) link"""
+		for line in dict_.get('news_url', '').split('\n'):
+			if line.endswith(' (link)'):
+				url = line[:-len(' (link)')]
+				if url.lower().startswith(('http://', 'https://')):
+					return Tree.canonical_url(url)
+		return None
+
+	@staticmethod
+	def item_key(dict_: dict) -> str:
+		"""Returns key identifying article across polls: its guid, canonical link (see news_link) or source and lowercase title"""
+		if dict_.get('news_guid'):
+			return dict_['news_guid']
+		link = Tree.news_link(dict_)
+		if link is not None:
+			return link
+		return f"{dict_['news_src']}\n{dict_['news_title'].lower()}"
+
+	@staticmethod
+	def store_stage(database: sqlite3.Connection, articles):
+		"""Generator inserting every article in database before passing it on, 
+		clusters and adds to digests inserted articles (see db_update_derived) and commits every Tree.STORE_BATCH_SIZE articles 
+		and when stream ends"""
+		try:
+			stored = 0
+			for article in articles:
+				Tree.db_insert_many(database, (article, ), update_derived=False)
+				stored += 1
+				if stored % Tree.STORE_BATCH_SIZE == 0:
+					Tree.db_update_derived(database)
+					database.commit()
+				yield article
+		finally:
+			Tree.db_update_derived(database)
+			database.commit()
+
+	def profile(self) -> dict:
+		"""Returns feed profile: working tags, namespaces of prefixed working tags and date format"""
+		tags = (self.ARTICLE, self.DESCRIPTION, self.DATE)
+		return {'article_tag': self.ARTICLE, 
+				'description_tag': self.DESCRIPTION, 
+				'date_tag': self.DATE, 
+				'namespaces': {tag: uri for tag, uri in getattr(self, 'namespaces', {}).items() if tag in tags}, 
+				'date_format': self.DATE_FORMAT}
+
+	def detect_date_format(self) -> str:
+		"""Returns first of Tree.date_formats which parses date of first article to the same value as dateutil, None if none does"""
+		for article in self.articles:
+			for element in article:
+				if element.tag == self.DATE and element.text is not None:
+					expected = dateutil.parser.parse(element.text, ignoretz=True)
+					for date_format in Tree.date_formats:
+						try:
+							if datetime.strptime(element.text.strip(), date_format).replace(tzinfo=None) == expected:
+								logging.info("Date format detected: %s" % date_format)
+								return date_format
+						except ValueError:
+							continue
+					return None
+		return None
+
+	@staticmethod
+	def db_fetch_profile(database: sqlite3.Connection, news_src: str) -> dict:
+		"""Returns feed profile saved for news_src or None"""
+		if database is None or news_src is None:
+			return None
+		try:
+			cursor = database.cursor()
+			cursor.execute("""SELECT article_tag, description_tag, date_tag, namespaces, date_format 
+							FROM feed_profiles WHERE news_src = ?""", (news_src, ))
+			row = cursor.fetchone()
+			if row is None:
+				return None
+			return {'article_tag': row[0], 
+					'description_tag': row[1], 
+					'date_tag': row[2], 
+					'namespaces': json.loads(row[3]), 
+					'date_format': row[4]}
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_store_profile(database: sqlite3.Connection, news_src: str, profile: dict) -> None:
+		"""Saves feed profile for news_src, replacing previous one"""
+		if database is None or news_src is None or profile['article_tag'] is None:
+			return
+		try:
+			with database:
+				database.execute("INSERT OR REPLACE INTO feed_profiles VALUES (?, ?, ?, ?, ?, ?)", 
+								(news_src, 
+								profile['article_tag'], 
+								profile['description_tag'], 
+								profile['date_tag'], 
+								json.dumps(profile['namespaces']), 
+								profile['date_format']))
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_fetch_state(database: sqlite3.Connection, news_src: str) -> dict:
+		"""Returns state of last ingest of news_src as dictionary: body_sha256 (hash of feed body), body_size (its Content-Length, 
+		None if unknown), last_key and last_ts (item key and publication timestamp of newest ingested article, see item_key), 
+		None if there is none.
+		stdin has no state"""
+		if database is None or news_src is None or news_src == Tree.STDIN_SOURCE:
+			return None
+		try:
+			row = database.execute("SELECT body_sha256, last_key, last_ts, body_size FROM feed_state WHERE news_src = ?", 
+									(news_src, )).fetchone()
+			if row is None:
+				return None
+			return {'body_sha256': row[0], 'last_key': row[1], 'last_ts': row[2], 'body_size': row[3]}
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_store_state(database: sqlite3.Connection, news_src: str, state: dict) -> None:
+		"""Saves state of ingest of news_src (see db_fetch_state), replacing previous one"""
+		if database is None or news_src is None or news_src == Tree.STDIN_SOURCE:
+			return
+		try:
+			with database:
+				database.execute("""INSERT OR REPLACE INTO feed_state (news_src, body_sha256, ingested, last_key, last_ts, body_size) 
+								VALUES (?, ?, ?, ?, ?, ?)""", (news_src, state['body_sha256'], time.time(), state['last_key'], state['last_ts'], 
+																state.get('body_size')))
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def open_source(source: str):
+		"""Returns readable binary stream for provided source: 
+		'-' reads stdin, .gz and .xz files are decompressed while streaming, other local files are memory mapped, 
+		anything else is treated as url and fetched over HTTP"""
+		try:
+			if source == Tree.STDIN_SOURCE:
+				logging.info("Reading feed from stdin")
+				return sys.stdin.buffer
+			filepath = os.path.join(CWD, source)
+			if not os.path.isfile(filepath):
+				return Tree.fetch(source)
+			logging.info("Reading feed from local file: %s" % filepath)
+			if filepath.endswith('.gz'):
+				return gzip.open(filepath, 'rb')
+			if filepath.endswith('.xz'):
+				return lzma.open(filepath, 'rb')
+			with open(filepath, 'rb') as file:
+				if os.fstat(file.fileno()).st_size == 0:
+					return open(filepath, 'rb')
+				return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		except FeedParserException:
+			raise
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def collect_feed_files(dirpath: str) -> list[str]:
+		"""Walks directory and returns sorted list of paths to feed files (see Tree.feed_file_suffixes)"""
+		filepaths = []
+		for root, dirs, files in os.walk(dirpath):
+			dirs.sort()
+			for filename in sorted(files):
+				if filename.endswith(Tree.feed_file_suffixes):
+					filepaths.append(os.path.join(root, filename))
+		return filepaths
+
+	@staticmethod
+	def ingest_directory(database: sqlite3.Connection, dirpath: str, workers: int) -> tuple[int, int]:
+		"""Parses feed files found in directory on worker processes and inserts articles in database.
+		Every ingested file is recorded in ingest_checkpoint table in the same transaction as its articles, 
+		so interrupted ingestion resumes where it stopped and unchanged files are skipped on later runs.
+		Prints progress to stderr, returns tuple (number of ingested files, number of ingested articles)"""
+		try:
+			with database:
+				cursor = database.cursor()
+				cursor.execute("SELECT filepath, mtime, size FROM ingest_checkpoint")
+				done = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+			pending = []
+			for filepath in Tree.collect_feed_files(dirpath):
+				stat = os.stat(filepath)
+				if done.get(filepath) != (stat.st_mtime, stat.st_size):
+					pending.append((filepath, stat.st_mtime, stat.st_size))
+			total = len(pending)
+			logging.info("%s feed files to ingest, %s already ingested" % (total, len(done)))
+			files, articles, failed = 0, 0, 0
+
+			def store(item, result):
+				nonlocal files, articles, failed
+				filepath, mtime, size = item
+				if isinstance(result, Exception):
+					failed += 1
+					logging.error("Failed to ingest %s: %s" % (filepath, result))
+				else:
+					with database:
+						Tree.db_insert_many(database, result)
+						database.execute("INSERT OR REPLACE INTO ingest_checkpoint VALUES (?, ?, ?, ?)", 
+										(filepath, mtime, size, len(result)))
+					files += 1
+					articles += len(result)
+				print(f"\r[{files + failed}/{total}] files, {articles} articles ingested, {failed} failed", end='', file=sys.stderr)
+
+			if workers is None or workers <= 1:
+				for item in pending:
+					store(item, ingest_file(item[0]))
+			else:
+				with ProcessPoolExecutor(max_workers=workers) as executor:
+					pending_iter = iter(pending)
+					running = {}
+					while True:
+						for item in pending_iter: # keeps a bounded number of files in flight
+							running[executor.submit(ingest_file, item[0])] = item
+							if len(running) >= workers * 2:
+								break
+						if not running:
+							break
+						finished, _ = wait(running, return_when=FIRST_COMPLETED)
+						for future in finished:
+							store(running.pop(future), future.result())
+			if total:
+				print(file=sys.stderr)
+			return files, articles
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
 	@staticmethod
 	def create_request(url: str) -> Request:
 		"""Creates an HTTP request with provided url"""
 		try:			
 			logging.debug("Method create_request called.")
-			headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'} #overriding user-agent prevents server from blocking request
+			headers = {'User-Agent': Tree.USER_AGENT} #some servers block requests without user-agent
 			request = Request(url, headers=headers)  # 	<urllib.request.Request>
 			logging.info("Request created: %s" % request)
 			return request        
@@ -269,11 +1313,12 @@ class Tree:
 			raise FeedParserException(e)
 
 	@staticmethod
-	def establish_connection(request: Request) -> HTTPResponse:
-		"""Sends request to Tree.URL and returns <http.client.HTTPResponse> object"""
+	def establish_connection(request: Request, timeout: float = None) -> HTTPResponse:
+		"""Sends request to Tree.URL and returns <http.client.HTTPResponse> object, 
+		connecting and every following read on the socket times out after timeout (default Tree.TIMEOUT) seconds"""
 		try:			
 			logging.debug("Method establish_connection called.")
-			response = urlopen(request)
+			response = urlopen(request, timeout=Tree.TIMEOUT if timeout is None else timeout)
 			logging.debug("Response received: %s" %response)
 			
 			return response
@@ -281,15 +1326,212 @@ class Tree:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	@staticmethod
+	def is_transient(error: Exception) -> bool:
+		"""Returns True if error (or error wrapped in FeedParserException) is worth retrying: 
+		timeouts, refused or reset connections and HTTP codes in Tree.transient_http_codes"""
+		if isinstance(error, FeedParserException) and error.args and isinstance(error.args[0], Exception):
+			error = error.args[0]
+		if isinstance(error, HTTPError):
+			return error.code in Tree.transient_http_codes
+		if isinstance(error, URLError):
+			return isinstance(error.reason, (OSError, socket.timeout)) and not isinstance(error.reason, socket.gaierror)
+		return isinstance(error, (socket.timeout, TimeoutError, ConnectionError, http.client.RemoteDisconnected, http.client.IncompleteRead))
+
+	@staticmethod
+	def retry_after(error: Exception) -> float:
+		"""Returns seconds from Retry-After header of HTTP error (or HTTP error wrapped in FeedParserException), None if there is none"""
+		if isinstance(error, FeedParserException) and error.args and isinstance(error.args[0], Exception):
+			error = error.args[0]
+		headers = getattr(error, 'headers', None) if isinstance(error, HTTPError) else None
+		value = headers.get('Retry-After') if headers is not None else None
+		if value is None:
+			return None
+		value = value.strip()
+		if value.isdigit():
+			return float(value)
+		try:
+			return max(0.0, (parsedate_to_datetime(value) - datetime.now(parsedate_to_datetime(value).tzinfo)).total_seconds())
+		except (TypeError, ValueError):
+			return None
+
+	@staticmethod
+	def remaining_time() -> float:
+		"""Returns seconds left until Tree.DEADLINE_AT, None if there is no deadline"""
+		if Tree.DEADLINE_AT is None:
+			return None
+		return Tree.DEADLINE_AT - time.monotonic()
+
+	@staticmethod
+	def fetch(url: str) -> HTTPResponse:
+		"""Connects to url with up to Tree.RETRIES retries of transient failures, waiting random time up to 
+		Tree.BACKOFF * 2 ** attempt (at most Tree.BACKOFF_MAX) seconds between attempts, and never past Tree.DEADLINE_AT.
+		Host is not contacted while its circuit breaker is open, failed fetch is recorded in Tree.BREAKERS. Response is tagged 
+		with its host (breaker_host), success is recorded once read_chunks read the whole body and failure if reading it fails, 
+		so host which accepts connections but breaks off bodies opens its breaker too.
+		Every attempt waits for request token of host in Tree.SCHEDULER, Retry-After of 429 and 503 responses postpones 
+		all requests to host and retry waits at least that long, Retry-After longer than Tree.BACKOFF_MAX is cut to it"""
+		host = urlsplit(url).hostname or url
+		with Tree.BREAKERS_LOCK:
+			failures, open_until = Tree.BREAKERS.get(host, (0, 0))
+		if open_until > time.time():
+			raise FeedParserException(f"Circuit breaker of {host} is open after {failures} failures, skipping until {datetime.fromtimestamp(open_until)}")
+		attempt = 0
+		while True:
+			remaining = Tree.remaining_time()
+			if remaining is not None and remaining <= 0:
+				raise FeedParserException(f"Deadline exceeded before fetching {url}")
+			if Tree.SCHEDULER is not None and not Tree.SCHEDULER.throttle(host, remaining):
+				raise FeedParserException(f"Deadline exceeded while waiting to fetch {url}")
+			remaining = Tree.remaining_time()
+			try:
+				response = Tree.establish_connection(Tree.create_request(url), 
+													Tree.TIMEOUT if remaining is None else min(Tree.TIMEOUT, remaining))
+				response.breaker_host = host
+				return response
+			except FeedParserException as e:
+				delay = random.uniform(0, min(Tree.BACKOFF_MAX, Tree.BACKOFF * 2 ** attempt))
+				retry_after = Tree.retry_after(e)
+				if retry_after is not None:
+					retry_after = min(retry_after, Tree.BACKOFF_MAX)
+					if Tree.SCHEDULER is not None:
+						Tree.SCHEDULER.defer(host, retry_after)
+					delay = max(delay, retry_after)
+				remaining = Tree.remaining_time()
+				if attempt >= Tree.RETRIES or not Tree.is_transient(e) or (remaining is not None and delay >= remaining):
+					Tree.record_fetch(host, False)
+					raise
+				logging.info("Fetching %s failed (%s), retrying in %.2f seconds" % (url, e, delay))
+				time.sleep(delay)
+				attempt += 1
+
+	@staticmethod
+	def record_fetch(host: str, success: bool) -> None:
+		"""Updates circuit breaker of host: success closes it, 
+		Tree.BREAKER_THRESHOLD consecutive failures open it for Tree.BREAKER_COOLDOWN seconds, doubled with every further failure"""
+		with Tree.BREAKERS_LOCK:
+			failures, open_until = Tree.BREAKERS.get(host, (0, 0))
+			if success:
+				if failures == 0:
+					return
+				failures, open_until = 0, 0
+			else:
+				failures += 1
+				if failures >= Tree.BREAKER_THRESHOLD:
+					cooldown = min(Tree.BREAKER_COOLDOWN_MAX, Tree.BREAKER_COOLDOWN * 2 ** (failures - Tree.BREAKER_THRESHOLD))
+					open_until = time.time() + cooldown
+					logging.error("Circuit breaker of %s opened for %s seconds" % (host, cooldown))
+			Tree.BREAKERS[host] = (failures, open_until)
+			Tree.BREAKERS_CHANGED.add(host)
+
+	@staticmethod
+	def db_fetch_breakers(database: sqlite3.Connection) -> dict:
+		"""Returns circuit breakers saved in host_breakers table as dictionary host: (failures, open until)"""
+		return {host: (failures, open_until) for host, failures, open_until in database.execute("SELECT host, failures, open_until FROM host_breakers")}
+
+	@staticmethod
+	def db_store_breakers(database: sqlite3.Connection) -> None:
+		"""Saves circuit breakers changed during this run in host_breakers table"""
+		with Tree.BREAKERS_LOCK:
+			changed = [(host, *Tree.BREAKERS[host]) for host in Tree.BREAKERS_CHANGED]
+			Tree.BREAKERS_CHANGED = set()
+		with database:
+			database.executemany("INSERT OR REPLACE INTO host_breakers (host, failures, open_until) VALUES (?, ?, ?)", changed)
+
+	@staticmethod
+	def read_chunks(response: HTTPResponse, digest=None):
+		"""Generator reading response body in chunks of up to Tree.CHUNK_SIZE bytes, every chunk also updates hashlib digest if provided,
+		raises FeedParserException as soon as body exceeds Tree.MAX_BYTES or download takes longer than Tree.TRANSFER_TIMEOUT seconds
+		or runs past Tree.DEADLINE_AT. Buffered streams are read with read1, which returns what one recv got instead of waiting 
+		for a full chunk, and socket timeout of HTTP response is shrunk to time left before every read, 
+		so a body trickling in or stalled is aborted on time.
+		For response of fetch, failed read (timeout, reset connection, incomplete body) and too slow download are recorded 
+		as failure of its host and whole body read as success (see record_fetch)"""
+		host = getattr(response, 'breaker_host', None)
+		headers = getattr(response, 'headers', None)
+		length = headers.get('Content-Length') if headers is not None else None
+		if isinstance(length, str) and length.isdigit() and int(length) > Tree.MAX_BYTES:
+			raise FeedParserException(f"Feed is too large: Content-Length {length} exceeds {Tree.MAX_BYTES} bytes")
+		read = response.read1 if isinstance(response, io.BufferedIOBase) else response.read
+		sock = None
+		if isinstance(response, http.client.HTTPResponse):
+			sock = getattr(getattr(response.fp, 'raw', None), '_sock', None)
+		received = 0
+		started = time.monotonic()
+
+		def check_time() -> float:
+			"""Raises if transfer timeout or deadline passed, otherwise returns seconds left"""
+			left = Tree.TRANSFER_TIMEOUT - (time.monotonic() - started)
+			if left <= 0:
+				if host is not None:
+					Tree.record_fetch(host, False)
+				raise FeedParserException(f"Feed download took longer than {Tree.TRANSFER_TIMEOUT} seconds")
+			remaining = Tree.remaining_time()
+			if remaining is not None and remaining <= 0:
+				raise FeedParserException("Deadline exceeded while downloading feed")
+			return left if remaining is None else min(left, remaining)
+
+		while True:
+			left = check_time()
+			if sock is not None:
+				sock.settimeout(min(Tree.TIMEOUT, left))
+			try:
+				chunk = read(Tree.CHUNK_SIZE)
+			except Exception as e:
+				check_time() # socket timeout shrunk to time left
+				if host is not None:
+					Tree.record_fetch(host, False)
+				logging.exception(e)
+				raise FeedParserException(e)
+			if not chunk:
+				break
+			received += len(chunk)
+			logging.debug("Chunk received from response, %s bytes in total" % received)
+			if received > Tree.MAX_BYTES:
+				raise FeedParserException(f"Feed is too large: body exceeds {Tree.MAX_BYTES} bytes")
+			check_time()
+			if digest is not None:
+				digest.update(chunk)
+			yield chunk
+		if host is not None:
+			Tree.record_fetch(host, True)
+
+	@staticmethod
+	def response_encoding(response) -> str:
+		"""Returns charset of Content-Type header of response, None for local sources or if header has no charset"""
+		headers = getattr(response, 'headers', None)
+		if headers is None or not hasattr(headers, 'get_content_charset'):
+			return None
+		return headers.get_content_charset()
+
+	@staticmethod
+	def xml_parser(response, pull: bool = False):
+		"""Returns incremental XML parser of Tree.BACKEND for response, pull parser reporting start and end events if pull is True.
+		lxml parser recovers from malformed XML (unescaped &, invalid bytes, unclosed tags) instead of failing on first error, 
+		takes encoding from Content-Type header of response if it has one and drops comments and processing instructions"""
+		if Tree.BACKEND == 'lxml':
+			options = {'recover': True, 'huge_tree': Tree.HUGE_TREE, 'remove_comments': True, 'remove_pis': True, 
+						'encoding': Tree.response_encoding(response)}
+			if pull:
+				return lxml_etree.XMLPullParser(events=('start', 'end'), **options)
+			return lxml_etree.XMLParser(**options)
+		if pull:
+			return ET.XMLPullParser(events=('start', 'end'))
+		return ET.XMLParser()
+
 	def get_xml_tree(self) -> ET.Element:
-		"""Parses xml from <HTTPResponse>.content and returns <ElementTree.Element> object"""
+		"""Feeds chunks of <HTTPResponse> body into incremental XML parser (see xml_parser) as they arrive, 
+		so parsing overlaps with download, and returns <ElementTree.Element> object"""
 		try:
 			logging.debug("Method get_xml_tree called.")
-			content = self.response.read()
-			logging.debug("Content fetched from response: %s" % content)
-			tree = ET.fromstring(content)
+			parser = Tree.xml_parser(self.response)
+			for chunk in Tree.read_chunks(self.response, self.digest):
+				parser.feed(chunk)
+			tree = parser.close()
 			logging.debug("XML Element created: %s" % tree)
 			return tree
+		except FeedParserException:
+			raise
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -302,11 +1544,14 @@ class Tree:
 			self.feed_title = str(Tree.TODAY)
 			for element in self.tree:        #(tree ~> *child* ~>...
 				logging.debug("Traversing XML tree, collecting child elements")
-				if element.tag == 'channel':
+				if Tree.local_name(element.tag) == 'channel': # RSS 1.0/RDF channel is namespaced
 					for child in element:
-						if child.tag == 'title':
+						if Tree.local_name(child.tag) == 'title':
 							logging.debug("Channel title found: %s" % child.text)
 							self.feed_title = child.text
+				elif Tree.local_name(element.tag) == 'title' and Tree.local_name(self.tree.tag) == 'feed': # Atom feed title
+					logging.debug("Feed title found: %s" % element.text)
+					self.feed_title = element.text
 				elements.append(element) 
 				for elemnt in element: #( tree ~> child ~> *grandchild* ~> ... )
 					if elemnt.tag == 'channel':
@@ -338,60 +1583,69 @@ class Tree:
 		try:
 			logging.debug("Method remove_tag_prefixes called.")
 			logging.info("Checking if xml tree tags contain prefixes")
+			self.namespaces = {} #namespace of every prefixed tag, saved in feed profile
 			tags = set() #for collecting tags while iterating
 			if hasattr(self.tree, 'tag'):    #checks if element has tag
 				if re.search(Tree.prefix_pattern, self.tree.tag) is not None: # if tag has prefix, removes it
 					logging.info('Removing tag prefix: %s' % self.tree.tag)
-					self.tree.tag = re.sub(Tree.prefix_pattern, '', self.tree.tag) 
+					self.tree.tag = self.strip_prefix(self.tree.tag) 
 				tags.add(self.tree.tag) # adds tag to set
 				for element in self.tree:
 					if hasattr(element, 'tag'):
 						if re.search(Tree.prefix_pattern, element.tag) is not None:
 							logging.info('Removing tag prefix: %s' % element.tag)
-							element.tag = re.sub(Tree.prefix_pattern, '', element.tag)
+							element.tag = self.strip_prefix(element.tag)
 						tags.add(element.tag)
 						for elmnt in element:
 							if hasattr(elmnt, 'tag'):
 								if re.search(Tree.prefix_pattern, elmnt.tag) is not None:
 									logging.info('Removing tag prefix: %s' % element.tag)
-									elmnt.tag = re.sub(Tree.prefix_pattern, '', elmnt.tag)
+									elmnt.tag = self.strip_prefix(elmnt.tag)
 								tags.add(elmnt.tag)
 								for elmt in elmnt:
 									if hasattr(elmt, 'tag'):
 										if re.search(Tree.prefix_pattern, elmt.tag) is not None:
 											logging.info('Removing tag prefix: %s' % element.tag)
-											elmt.tag = re.sub(Tree.prefix_pattern, '', elmt.tag)
+											elmt.tag = self.strip_prefix(elmt.tag)
 										tags.add(elmt.tag)
 										for emt in elmt:
 											if hasattr(emt, 'tag'):
 												if re.search(Tree.prefix_pattern, emt.tag) is not None:
 													logging.info('Removing tag prefix: %s' % element.tag)
-													emt.tag = re.sub(Tree.prefix_pattern, '', emt.tag)
+													emt.tag = self.strip_prefix(emt.tag)
 												tags.add(emt.tag)
 			return tags
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	def strip_prefix(self, tag: str) -> str:
+		"""Cuts namespace prefix out of tag and remembers namespace in self.namespaces"""
+		match = Tree.prefix_pattern.match(tag)
+		local = tag[match.end():]
+		self.namespaces.setdefault(local, match.group()[1:-1])
+		return local
+
+	@staticmethod
+	def local_name(tag: str) -> str:
+		"""Returns tag without namespace prefix, tag is not changed and namespace is not remembered (see strip_prefix)"""
+		return tag.rpartition('}')[2]
+
 	def set_working_tags(self) -> None:
-		"""Iterates through collected tags and sets self.ARTICLE, self.DESCRIPTION, self.DATE variables for parsing article elements to later use them while parsing article element's sub-elements."""
+		"""Checks collected tags against tag variants in order of preference and sets self.ARTICLE, self.DESCRIPTION, self.DATE variables 
+		for parsing article elements to later use them while parsing article element's sub-elements.
+		(e.g. if feed contains both 'published' and 'updated', 'published' is always chosen)"""
 		try:
 			logging.info("Setting working tags")
-			for tag in self.__tags:
-				if self.ARTICLE != None and self.DESCRIPTION != None and self.DATE != None:
-					break
-				if self.ARTICLE == None and tag in Tree.article_tags:
-					self.ARTICLE = tag
-					logging.info("Article tag set: %s" % tag)
-					continue
-				elif self.DESCRIPTION == None and tag in Tree.description_tags:
-					self.DESCRIPTION = tag
-					logging.info("Description tag set: %s" % tag)
-					continue
-				elif self.DATE == None and tag in Tree.date_tags:
-					self.DATE = tag
-					logging.info("Date tag set: %s" % tag)
+			for name, variants in (('ARTICLE', Tree.article_tags), ('DESCRIPTION', Tree.description_tags), ('DATE', Tree.date_tags)):
+				if getattr(self, name) is not None:
 					continue
+				for tag in variants:
+					if tag in self.__tags:
+						setattr(self, name, tag)
+						logging.info("%s tag set: %s" % (name.capitalize(), tag))
+						break
+			self.dispatch = None
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -425,37 +1679,43 @@ class Tree:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	def build_dispatch(self) -> dict:
+		"""Returns dispatch table of current working tags: local tag of article sub-element mapped to bound handler,
+		Tree.element_handlers overridden by handlers of working tags (e.g. dc:date is parsed as date only if it is the date tag).
+		Built once per feed profile (see parse_article) and rebuilt when working tags change"""
+		dispatch = {tag: getattr(self, name) for tag, name in Tree.element_handlers.items()}
+		dispatch[self.TITLE] = self.parse_title
+		dispatch[self.LINK] = self.parse_link
+		if self.DATE is not None:
+			dispatch[self.DATE] = self.parse_date
+		if self.DESCRIPTION is not None:
+			dispatch[self.DESCRIPTION] = self.parse_working_description
+		return dispatch
+
 	def parse_article(self, article: ET.Element) -> dict:
 		"""Parses article sub-elements and organizes them in a dictionary
 		(e.g. dict({'title': title_element_contents, 'link': link_element_contents, ...})
+		Every sub-element is passed to its handler found with single lookup in self.dispatch, sub-elements without handler are skipped.
+		Full content (content:encoded, Atom content) is used as description only if article has no description.
 		returns dictionary"""
 		try:
+			if self.dispatch is None:
+				self.dispatch = self.build_dispatch()
+			self.full_content = None
 			for element in article:
 				logging.info("Parsing article sub-element: %s" % element.tag)
 				if element.text is not None:
 					element.text = element.text.replace(u'\xa0', u' ') 
-				if element.tag == self.TITLE:
-					self.parse_title(element, self.dict_)
-				elif element.tag == self.DATE:
-					self.parse_date(element, self.dict_)
-				elif element.tag == self.LINK:
-					self.parse_link(element, self.dict_)
-				elif element.tag == self.DESCRIPTION:
-					if element.text is None:
-						if self.DESCRIPTION == 'description' and 'summary' in self.__tags:
-							self.DESCRIPTION = 'summary'
-						elif self.DESCRIPTION == 'summary' and 'description' in self.__tags:
-							self.DESCRIPTION = 'description'
-						continue
-					self.parse_description(element, self.dict_)
-				elif element.tag == 'content' and 'url' in element.attrib:
-					if 'news_url' in self.dict_:
-						self.dict_['news_url'] = f"{self.dict_['news_url']}\n{element.attrib['url']} (content)"
-					else:
-						self.dict_['news_url'] = f"{element.attrib['url']} (content)"
+				handler = self.dispatch.get(element.tag)
+				if handler is not None:
+					handler(element, self.dict_)
+			if 'news_description' not in self.dict_ and self.full_content is not None:
+				self.parse_description(self.full_content, self.dict_)
+			if 'news_guid' not in self.dict_ and Tree.rdf_about in article.attrib:
+				self.dict_['news_guid'] = article.attrib[Tree.rdf_about]
 			self.dict_['news_title'] = self.dict_['news_title'].strip()
 			self.dict_['news_url'] = self.dict_['news_url'].strip()
-			self.dict_['news_src'] = Tree.URL
+			self.dict_['news_src'] = self.source if self.source is not None else Tree.URL
 			if 'news_description' in self.dict_:
 				self.dict_['news_description'] = self.dict_['news_description'].strip()
 			else:
@@ -468,12 +1728,58 @@ class Tree:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	def parse_working_description(self, element: ET.Element, dict_: dict) -> None:
+		"""Parses description element with parse_description, 
+		empty description switches description tag between 'description' and 'summary' if feed has both"""
+		if element.text is None:
+			if self.DESCRIPTION == 'description' and 'summary' in self.__tags:
+				self.DESCRIPTION = 'summary'
+			elif self.DESCRIPTION == 'summary' and 'description' in self.__tags:
+				self.DESCRIPTION = 'description'
+			self.dispatch = self.build_dispatch()
+			return
+		self.parse_description(element, dict_)
+
+	def parse_guid(self, element: ET.Element, dict_: dict) -> None:
+		"""Parses guid (RSS 2.0), id (Atom) or dc:identifier element and sets dict_[news_guid], first one found is kept"""
+		if element.text is not None and element.text.strip() and 'news_guid' not in dict_:
+			dict_['news_guid'] = element.text.strip()
+
+	def parse_author(self, element: ET.Element, dict_: dict) -> None:
+		"""Parses author (RSS 2.0 text, Atom name sub-element) or dc:creator element and appends author to dict_[news_author]"""
+		names = [child.text.strip() for child in element if Tree.local_name(child.tag) == 'name' and child.text]
+		author = ', '.join(names) if names else (element.text or '').strip()
+		if author:
+			dict_['news_author'] = f"{dict_['news_author']}, {author}" if 'news_author' in dict_ else author
+
+	def parse_media(self, element: ET.Element, dict_: dict) -> None:
+		"""Parses enclosure, media:content, media:thumbnail or Atom content with src and appends url to dict_[news_url] as (content),
+		content:encoded and Atom content without url are kept in self.full_content for description of article without one"""
+		url = element.attrib.get('url') or element.attrib.get('src')
+		if url:
+			self.add_url(dict_, url.strip(), 'content')
+		elif element.text is not None and element.text.strip() and self.full_content is None:
+			self.full_content = element
+
+	def parse_media_group(self, element: ET.Element, dict_: dict) -> None:
+		"""Parses media:content and media:thumbnail elements of media:group"""
+		for child in element:
+			if Tree.local_name(child.tag) in ('content', 'thumbnail'):
+				self.parse_media(child, dict_)
+
 	def parse_title(self, element: ET.Element, dict_: dict) -> None:
 		"""Parses title element of xml and appends text to dict_[news_title]"""
 		dict_['news_title'] = element.text
 		
 	def parse_date(self, element: ET.Element, dict_: dict) -> None:
-		"""Parses date element of xml tree and appends datetime object to dict_[news_date]"""
+		"""Parses date element of xml tree and appends datetime object to dict_[news_date],
+		uses self.DATE_FORMAT if it is known and falls back to dateutil"""
+		if self.DATE_FORMAT is not None:
+			try:
+				dict_['news_date'] = str(datetime.strptime(element.text.strip(), self.DATE_FORMAT).replace(tzinfo=None))
+				return
+			except ValueError:
+				pass
 		dict_['news_date'] = str(dateutil.parser.parse(element.text, ignoretz=True))
 
 	def parse_link(self, element: ET.Element, dict_: dict) -> None:
@@ -491,7 +1797,61 @@ class Tree:
 					dict_['news_url'] = f"{element.text} (link)"
 
 	def parse_description(self, element: ET.Element, dict_: dict) -> None:
-		"""Parses description element of xml tree, checks if element.text contains html fragments, accordingly parses and append text content to dict_[news_description]"""
+		"""Parses description element of xml tree according to Tree.EXTRACT: 'none' skips it, 'text' keeps text content only,
+		'full' parses html fragments (see extract_description). With Tree.LAZY raw text is stored in dict_[news_description] 
+		and extraction level in dict_[news_extract] (with ':html' appended if element is of type html) for extract_article"""
+		if Tree.EXTRACT == 'none':
+			return
+		if Tree.LAZY:
+			dict_['news_description'] = element.text or ''
+			dict_['news_extract'] = Tree.EXTRACT + (':html' if element.attrib.get('type') == 'html' else '')
+			return
+		if Tree.EXTRACT == 'text':
+			dict_['news_description'] = Tree.html_text(element.text)
+			return
+		self.extract_description(element, dict_)
+
+	@staticmethod
+	def html_text(text: str) -> str:
+		"""Returns text content of html fragment (text level extraction), text without tags is returned as is"""
+		if text is None:
+			return ''
+		if re.search(Tree.CDATA_pattern, text) is not None:
+			text = text[9:-3]
+		if re.search(Tree.tag_pattern, text) is None:
+			return text.strip()
+		return html.fragment_fromstring(text, create_parent='div').text_content().strip()
+
+	@staticmethod
+	def extract_article(dict_: dict) -> dict:
+		"""Returns copy of article stored with Tree.LAZY with description extracted at level of dict_[news_extract], 
+		article without news_extract is returned as is"""
+		if 'news_extract' not in dict_:
+			return dict_
+		article = dict(dict_)
+		level, _, type_ = article.pop('news_extract').partition(':')
+		raw = article['news_description']
+		if level == 'text':
+			article['news_description'] = Tree.html_text(raw)
+		elif level == 'full':
+			element = ET.Element('description', {'type': type_} if type_ else {})
+			element.text = raw
+			del article['news_description']
+			object.__new__(Tree).extract_description(element, article)
+			article['news_description'] = article.get('news_description', '').strip()
+			article['news_url'] = article['news_url'].strip()
+		return article
+
+	@staticmethod
+	def extract_stage(articles):
+		"""Generator extracting descriptions of lazily stored articles right before they are printed or exported"""
+		for article in articles:
+			yield Tree.extract_article(article)
+
+	def extract_description(self, element: ET.Element, dict_: dict) -> None:
+		"""Checks if element.text contains html fragments, accordingly parses and append text content to dict_[news_description],
+		text and urls found in fragments are collected in self.extract_buffer and appended to dict_ at once (see add_text, add_url)"""
+		self.extract_buffer = (dict_, self.seen_urls(dict_), [], [])
 		try:
 			if 'type' in element.attrib and element.attrib['type'] == 'html':
 				nodes = html.fragments_fromstring(element.text)
@@ -511,10 +1871,7 @@ class Tree:
 						nodes = html.fragments_fromstring(text)
 						self.parse_html(nodes, dict_)
 					else:
-						if 'news_description' in dict_:
-							dict_['news_description'] = f"{dict_['news_description']}\n{text}"
-						else:
-							dict_['news_description'] = f"{text}"
+						self.add_text(dict_, text)
 					nodes = html.fragments_fromstring(element.text[s:e])
 					self.parse_html(nodes, dict_)
 				else: 
@@ -522,6 +1879,8 @@ class Tree:
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
+		finally:
+			self.flush_buffer()
 
 	@staticmethod
 	def cache_news(dict_: dict) -> None:
@@ -533,49 +1892,85 @@ class Tree:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	@staticmethod
+	def open_output() -> None:
+		"""Opens buffered writer on stdout for --format output and prints header row for tsv/csv,
+		colors are enabled only for default format when stdout is a terminal"""
+		Tree.COLOR = Tree.FORMAT is None and sys.stdout.isatty()
+		if Tree.FORMAT is None:
+			return
+		try:
+			Tree.OUTPUT = open(sys.stdout.fileno(), 'w', buffering=Tree.OUTPUT_BUFFER_SIZE, encoding='utf-8', newline='', closefd=False)
+		except (AttributeError, OSError, io.UnsupportedOperation): # stdout is not a real file (e.g. captured)
+			Tree.OUTPUT = sys.stdout
+		if Tree.FORMAT == 'csv':
+			Tree.CSV_WRITER = csv.writer(Tree.OUTPUT)
+			Tree.CSV_WRITER.writerow(Tree.output_columns)
+		elif Tree.FORMAT == 'tsv':
+			Tree.OUTPUT.write('\t'.join(Tree.output_columns) + '\n')
+
+	@staticmethod
+	def close_output() -> None:
+		"""Flushes buffered --format output"""
+		if Tree.OUTPUT is not None:
+			Tree.OUTPUT.flush()
+			if Tree.OUTPUT is not sys.stdout:
+				Tree.OUTPUT.close()
+		Tree.OUTPUT = None
+		Tree.CSV_WRITER = None
+
+	@staticmethod
+	def tsv_field(value) -> str:
+		"""Escapes backslashes, tabs and newlines so value fits in one TSV field"""
+		return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
 	@staticmethod
 	def print_news(article: dict) -> None:
-		"""Prints formatted news item, if --json specified, prints JSON representation"""
+		"""Prints formatted news item, if --json specified, prints JSON representation,
+		if --format specified writes tsv/csv row or plain text to buffered Tree.OUTPUT"""
 		try:
 			if Tree.JSON:
 				logging.info("Printing JSON representation of article to stdout")
 				json_str = Tree.convert_to_json(article)
-				print(f"\n{json_str}\n")
-			else:
+				print(f"\n{json_str}\n", file=Tree.OUTPUT or sys.stdout)
+			elif Tree.FORMAT == 'tsv':
+				Tree.OUTPUT.write('\t'.join([Tree.tsv_field(article[column]) for column in Tree.output_columns]) + '\n')
+			elif Tree.FORMAT == 'csv':
+				Tree.CSV_WRITER.writerow([article[column] for column in Tree.output_columns])
+			elif Tree.COLOR:
 				logging.info("Printing formatted article to stdout")
-				for key, value in article.items():
-					if key == 'news_feed_title':
-						feed_title = value
-					elif key == 'news_src':
-						src = value
-					elif key == 'news_title':
-						title = value
-					elif key == 'news_date':
-						date = value
-					elif key == 'news_description':
-						description = value
-					elif key == 'news_url':
-						url = value
-				print(f"Feed:{Fore.RED} {feed_title} ")
-				print(f"Source:{Fore.RED}{Style.DIM} {src} ")
-				print(f"Title:{Back.BLACK}{Fore.GREEN}{Style.BRIGHT} {title} ")
-				print(f"Date:{Fore.GREEN}{Style.DIM} {date} ")
-				print(f"{Style.BRIGHT}{Fore.YELLOW}{Back.BLACK}{description}")
-				print(f"Links:{Style.DIM} {url}\n\n")
+				print(f"Feed:{Fore.RED} {article['news_feed_title']} {Style.RESET_ALL}\n"
+					f"Source:{Fore.RED}{Style.DIM} {article['news_src']} {Style.RESET_ALL}\n"
+					f"Title:{Back.BLACK}{Fore.GREEN}{Style.BRIGHT} {article['news_title']} {Style.RESET_ALL}\n"
+					f"Date:{Fore.GREEN}{Style.DIM} {article['news_date']} {Style.RESET_ALL}\n"
+					f"{Style.BRIGHT}{Fore.YELLOW}{Back.BLACK}{article['news_description']}{Style.RESET_ALL}\n"
+					f"Links:{Style.DIM} {article['news_url']}{Style.RESET_ALL}\n\n")
+			else:
+				(Tree.OUTPUT or sys.stdout).write(f"Feed: {article['news_feed_title']} \n"
+					f"Source: {article['news_src']} \n"
+					f"Title: {article['news_title']} \n"
+					f"Date: {article['news_date']} \n"
+					f"{article['news_description']}\n"
+					f"Links: {article['news_url']}\n\n\n")
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
 
 	@staticmethod
-	def create_html(filepath: str) -> None:
-		"""Method for creating .html document from Tree.articles_html"""
+	def create_html(filepath: str, article_divs: str = None) -> None:
+		"""Method for creating .html document from Tree.articles_html, 
+		article_divs rendered beforehand (daily digest) are used instead of rendering Tree.CACHE.
+		With Tree.PAGE_SIZE Tree.CACHE is exported as pages with create_html_pages (not for PDF)"""
+		if Tree.PAGE_SIZE is not None and article_divs is None and filepath != Tree.temp_html_path:
+			Tree.create_html_pages(filepath, Tree.CACHE, Tree.PAGE_SIZE, Tree.WORKERS)
+			return
 		try:
 			os.chdir(CWD)
 			if filepath == Tree.temp_html_path:
 				logging.info("Creating html document from Tree.CACHE for converting to PDF >> %s" % Tree.temp_html_path)
 			else:
 				logging.info("Creating html document from Tree.CACHE >> %s" % Tree.HTML_FILEPATH)
-			articles_html = Tree.to_html_string(Tree.CACHE)
+			articles_html = Tree.to_html_string(Tree.CACHE, article_divs)
 			os.chdir(CWD)
 			with open(filepath, 'w') as file:
 				file.write(articles_html)
@@ -586,29 +1981,35 @@ class Tree:
 			os.chdir(os.path.join(os.path.dirname(__file__), 'data/'))
 
 	@staticmethod
-	def to_html_string(list_of_articles: list[dict]) -> str:
+	def to_html_string(list_of_articles: list[dict], article_divs: str = None) -> str:
 		"""	Method for processing list of articles and creating Tree.articles_html,
-			also, sets Tree.PAGE_TITLE"""
+			also, sets Tree.PAGE_TITLE. If article_divs are provided they are used as rendered list_of_articles"""
 		logging.debug("Converting list of articles to html string")
 		try:
 			feed_titles = []
+			if Tree.LIMIT is not None and Tree.LIMIT >= 0:
+				list_of_articles = list_of_articles[:Tree.LIMIT]
+			# every call renders list_of_articles anew, so html and pdf of one run get the same articles
+			Tree.ARTICLE_DIVS = article_divs if article_divs is not None else ''
+			# divs are joined once, appending to Tree.ARTICLE_DIVS and searching it for every article is quadratic
+			divs = [Tree.ARTICLE_DIVS]
+			Tree.FEED_TITLES = set()
 			for dict_ in list_of_articles:
 				feed_titles.append(dict_['news_feed_title'])
-				logging.debug("Appending article div string to Tree.ARTICLE_DIVS")
-				if Tree.LIMIT > 0:
-					Tree.ARTICLE_DIVS += Tree.article_to_html(dict_)
-					Tree.LIMIT -= 1
-				elif Tree.LIMIT == 0:
-					pass
-				else:
-					Tree.ARTICLE_DIVS += Tree.article_to_html(dict_)
+				if article_divs is None:
+					logging.debug("Appending article div string to Tree.ARTICLE_DIVS")
+					divs.append(Tree.article_to_html(dict_))
+					Tree.FEED_TITLES.add(dict_['news_feed_title'])
+			Tree.ARTICLE_DIVS = ''.join(divs)
+			Tree.FEED_TITLES = set()
 			logging.debug("Setting html page title")
-			for title in tuple(set(feed_titles)):
-				if feed_titles.count(title) == len(feed_titles):
+			title_counts = Counter(feed_titles)
+			for title in title_counts:
+				if title_counts[title] == len(feed_titles):
 					Tree.PAGE_TITLE = title
 					break
 				else:
-					if feed_titles.count(title)/len(feed_titles) >= 0.75:
+					if title_counts[title]/len(feed_titles) >= 0.75:
 						Tree.PAGE_TITLE += ', ' + title
 
 			articles_html = f'''
@@ -637,9 +2038,125 @@ class Tree:
 			raise FeedParserException(e)
 
 	@staticmethod
-	def article_to_html(dict_: dict) -> str:
-		"""Method for converting dict_ to html fragment - article_div"""
+	def create_html_pages(filepath: str, articles, page_size: int, workers: int = None) -> int:
+		"""Exports articles (any iterable, Tree.LIMIT applies) as html pages of page_size articles written next to filepath 
+		(e.g. news-1.html, news-2.html, ... for news.html) with links to previous and next page, and index page listing them to filepath.
+		Pages are rendered and written on worker processes (see write_html_page)
+		with at most workers * 2 pages in flight, so memory does not depend on number of articles. 
+		Index entries are appended in page order as pages are done. Returns number of pages"""
+		logging.info("Exporting html pages of %s articles >> %s" % (page_size, filepath))
+		try:
+			filepath = os.path.join(CWD, filepath)
+			stem, extension = os.path.splitext(os.path.basename(filepath))
+			page_name = f"{stem}-{{}}{extension or '.html'}"
+			if Tree.LIMIT is not None and Tree.LIMIT >= 0:
+				articles = itertools.islice(articles, Tree.LIMIT)
+			articles = iter(articles)
+			executor = ProcessPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+			running = deque()
+			pages = 0
+			head, tail = Tree.html_page_parts(Tree.PAGE_TITLE or str(Tree.TODAY))
+
+			def finish(index, job, result) -> None:
+				_, number, page = job[:3]
+				if isinstance(result, Exception):
+					raise result
+				index.write(f'''<li><a href="{page_name.format(number)}">Page {number}</a> {len(page)} articles, 
+						{page[0]['news_date']} - {page[-1]['news_date']}</li>\n\t\t\t\t\t''')
+
+			try:
+				with open(filepath, 'w') as index:
+					index.write(f"{head}<ol>\n\t\t\t\t\t")
+					page = list(itertools.islice(articles, page_size))
+					while page:
+						following = list(itertools.islice(articles, page_size)) # one page ahead, so last page has no next link
+						pages += 1
+						job = (os.path.join(os.path.dirname(filepath), page_name.format(pages)), pages, page, 
+								bool(following), os.path.basename(filepath), page_name)
+						if executor is None:
+							finish(index, job, write_html_page(*job))
+						else:
+							running.append((job, executor.submit(write_html_page, *job)))
+							while len(running) >= workers * 2:
+								job, future = running.popleft()
+								finish(index, job, future.result())
+						page = following
+					while running:
+						job, future = running.popleft()
+						finish(index, job, future.result())
+					index.write(f"</ol>{tail}")
+			finally:
+				if executor is not None:
+					executor.shutdown(cancel_futures=True)
+			return pages
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def html_page_parts(title: str) -> tuple[str, str]:
+		"""Returns tuple (head, tail) of page of paginated html export, everything before and after its articles"""
+		head = f'''
+			<!DOCTYPE html>
+				<html>
+					<head>
+						<title>{title}</title>
+						<style>
+							div{{box-sizing: border-box;
+								width: 100%;
+								border: dotted black 7px;
+								padding: 10px;
+								text-align: center;}}
+							img{{max-width: 100%;
+								height: auto;}}
+						</style>
+					</head>
+					<body>
+					'''
+		tail = '''
+					</body>
+				</html>
+			'''
+		return head, tail
+
+	@staticmethod
+	def html_page_nav(number: int, has_next: bool, index_name: str, page_name: str) -> str:
+		"""Returns links of page number of paginated html export to previous page, index page and next page"""
+		links = []
+		if number > 1:
+			links.append(f'<a href="{page_name.format(number - 1)}">&larr; Previous</a>')
+		links.append(f'<a href="{index_name}">Index</a>')
+		if has_next:
+			links.append(f'<a href="{page_name.format(number + 1)}">Next &rarr;</a>')
+		return f'''
+					<nav>{' | '.join(links)}</nav>
+					'''
+
+	@staticmethod
+	def article_to_html(dict_: dict, article_body: str = None) -> str:
+		"""Method for converting dict_ to html fragment - article_div, 
+		feed title is added only to the first article of every feed (see Tree.FEED_TITLES).
+		article_body rendered beforehand is used if provided, otherwise it is rendered here (see render_article_body)"""
 		logging.debug("Generating html fragment for article item")
+		try:
+			if article_body is None:
+				article_body = Tree.render_article_body(dict_)
+			if dict_['news_feed_title'] in Tree.FEED_TITLES or dict_['news_feed_title'] in Tree.ARTICLE_DIVS:
+				feed_title = ''
+			else:
+				feed_title = f'''<h2>{dict_['news_feed_title']}</h2>
+						'''
+			article_div = f'''
+					<div>
+						{feed_title}{article_body}'''
+			return article_div
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def render_article_body(dict_: dict) -> str:
+		"""Renders article dict_ as html, everything inside article div after feed title"""
 		try:
 			urls_ = dict_['news_url'].split('\n')
 			img_urls = []
@@ -657,37 +2174,27 @@ class Tree:
 
 			logging.info('Parsing image links for constructing HTML')
 			for img in img_urls:
-				imgs_html += f'''<img src="{img}" alt="" width="60% of window">\n\t\t\t\t\t\t'''
-			div_with_feed_title = f'''
-					<div>
-						<h2>{dict_['news_feed_title']}</h2>
-						{imgs_html}
+				imgs_html += f'''<img src="{img}" alt="" width="{Tree.IMG_WIDTH}" height="{Tree.IMG_HEIGHT}" loading="lazy">\n\t\t\t\t\t\t'''
+			article_body = f'''{imgs_html}
 						<p>{dict_['news_src']}</p>
 						<h3>{dict_['news_title']}</h3>
 						<p>{dict_['news_date']}</p>
 						<p>{dict_['news_description']}</p>
 						{links_html}
 					</div>'''
-			div_without_feed_title = f'''
-					<div>
-						{imgs_html}
-						<p>{dict_['news_src']}</p>
-						<h3>{dict_['news_title']}</h3>
-						<p>{dict_['news_date']}</p>
-						<p>{dict_['news_description']}</p>
-						{links_html}
-					</div>'''
-			article_div = div_without_feed_title if dict_['news_feed_title'] in Tree.ARTICLE_DIVS else div_with_feed_title
-			return article_div
+			return article_body
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
 
 	@staticmethod
-	def create_pdf() -> None:
+	def create_pdf(article_divs: str = None) -> None:
 		"""Created HTML document and converts it into PDF using wkhtmltopdf, embedding images may take long time."""
 		try:
-			Tree.create_html(Tree.temp_html_path) # .temp.html not found
+			if article_divs is None:
+				Tree.create_html(Tree.temp_html_path) # .temp.html not found
+			else:
+				Tree.create_html(Tree.temp_html_path, article_divs)
 			logging.info("Created html string for converting to pdf")
 			os.chdir(CWD)
 			if 'win' in sys.platform:
@@ -739,27 +2246,104 @@ class Tree:
 				os.remove(os.path.join(os.path.dirname(__file__), 'wkhtmltox.7z'))
 
 	@staticmethod
-	def db_fetch_news(database: sqlite3.Connection, filter_key: str, filter_value: str) -> None:
-		"""Selects rows from db according to provided column and value and fetches them
-		Returns list of dictionaries containing fetched values"""
+	def serve_digest() -> bool:
+		"""Outputs articles of one day (--date YYYY-MM-DD without --latest, --collapse and --timeline) from daily_digests 
+		of Tree.DB instead of querying cached_news, JSON lines are printed and HTML is exported as they were rendered on insert.
+		Returns False if request can not be served from digest (also for paginated html export)"""
+		if (Tree.FILTER_K != 'date' or not Tree.digest_date_pattern.match(str(Tree.FILTER_V)) 
+				or Tree.LATEST is not None or Tree.COLLAPSE or Tree.TIMELINE 
+				or (Tree.PAGE_SIZE is not None and Tree.HTML_FILEPATH is not None)):
+			return False
+		with Tree.DB:
+			Tree.db_update_digests(Tree.DB)
+		digest = Tree.db_fetch_digest(Tree.DB, Tree.FILTER_V, Tree.LIMIT)
+		if digest is None:
+			return False
+		json_lines, article_divs = digest
+		logging.info("Serving articles of %s from daily digest" % Tree.FILTER_V)
+		if Tree.HTML_FILEPATH is None and Tree.PDF_FILEPATH is None:
+			for line in json_lines:
+				if Tree.JSON:
+					print(f"\n{line}\n", file=Tree.OUTPUT or sys.stdout)
+				else:
+					Tree.print_news(json.loads(line))
+			return True
+		for line in json_lines:
+			Tree.cache_news(json.loads(line))
+		if Tree.HTML_FILEPATH is not None:
+			Tree.create_html(filepath=Tree.HTML_FILEPATH, article_divs=article_divs)
+		if Tree.PDF_FILEPATH is not None:
+			Tree.create_pdf(article_divs=article_divs)
+		return True
+
+	@staticmethod
+	def db_fetch_news(database: sqlite3.Connection, filter_key: str, filter_value: str, limit: int = -1, latest: int = None, 
+						collapse: bool = False, timeline: bool = False) -> None:
+		"""Selects rows from db according to provided column and value and appends them to Tree.CACHE as dictionaries"""
+		for dict_ in Tree.extract_stage(Tree.db_iter_news(database, filter_key, filter_value, limit, latest, collapse, timeline)):
+			Tree.cache_news(dict_)
+
+	@staticmethod
+	def db_iter_news(database: sqlite3.Connection, filter_key: str, filter_value: str, limit: int = -1, latest: int = None, 
+						collapse: bool = False, timeline: bool = False):
+		"""Generator selecting rows from db according to provided column and value,
+		fetching Tree.BATCH_SIZE rows at a time and yielding them as dictionaries.
+		limit is applied in query (negative means no limit), if latest is specified only latest most recent rows are selected, 
+		newest first, using cached_news_date index. If collapse is True only first row of every near-duplicate cluster is selected.
+		If timeline is True rows are ordered by publication time, oldest first, using cached_news_ts index"""
 		try:
 			logging.info("Fetching news articles from database")
-			if filter_key is None and filter_value is None:
-				sql = f"""SELECT * FROM cached_news"""
-			else:
-				sql = f"""SELECT * FROM cached_news WHERE {filter_key} LIKE '%{filter_value}%'"""
+			columns = ', '.join(Tree.db_columns)
+			conditions, parameters = [], ()
+			if filter_key is not None or filter_value is not None:
+				conditions.append(f"{filter_key} LIKE '%' || ? || '%'")
+				parameters += (filter_value, )
+			if collapse:
+				# correlated on news_simhash primary key, so only rows being selected are looked up
+				conditions.append("NOT EXISTS (SELECT 1 FROM news_simhash WHERE news_id = cached_news.rowid AND cluster != news_id)")
+			sql = f"""SELECT {columns} FROM cached_news"""
+			if conditions:
+				sql += " WHERE " + " AND ".join(conditions)
+			if latest is not None:
+				sql += " ORDER BY news_date DESC"
+				limit = latest if limit is None or limit < 0 else min(limit, latest)
+			elif timeline:
+				sql += " ORDER BY news_ts, rowid"
+			sql += " LIMIT ?"
+			parameters += (-1 if limit is None else limit, )
 
 			logging.info(sql)
 
-			with database:
-				cursor = database.cursor()
-				cursor.execute(sql)
-				data = cursor.fetchall()
-			for item in data:
-				dict_ = {}
-				dict_['date'], dict_['news_feed_title'],dict_['news_src'], dict_['news_title'], dict_['news_date'], dict_['news_description'], dict_['news_url'] = item
-				Tree.cache_news(dict_)
-			
+			cursor = database.cursor()
+			cursor.execute(sql, parameters)
+			while True:
+				data = cursor.fetchmany(Tree.BATCH_SIZE)
+				if not data:
+					break
+				for item in data:
+					yield Tree.db_row(database, item)
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_query_news(database: sqlite3.Connection, filter_date: str = None, filter_src: str = None, 
+						limit: int = -1, offset: int = 0) -> list[dict]:
+		"""Selects one page of rows from db, optionally filtered by date and source the same way as db_fetch_news,
+		in insertion order, and returns list of dictionaries"""
+		try:
+			conditions, parameters = [], []
+			if filter_date is not None:
+				conditions.append("date LIKE '%' || ? || '%'")
+				parameters.append(filter_date)
+			if filter_src is not None:
+				conditions.append("news_src LIKE '%' || ? || '%'")
+				parameters.append(filter_src)
+			where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+			sql = f"SELECT {', '.join(Tree.db_columns)} FROM cached_news {where} ORDER BY rowid LIMIT ? OFFSET ?"
+			cursor = database.cursor()
+			cursor.execute(sql, (*parameters, limit, offset))
+			return list(Tree.extract_stage(Tree.db_row(database, row) for row in cursor.fetchall()))
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -769,16 +2353,6 @@ class Tree:
 		"""Connects to or creates the database specified by filepath
 		Creates table cached_news if it does not exist
 		Returns database connection object"""
-		sql = """
-		CREATE TABLE IF NOT EXISTS cached_news
-				(date TEXT, 
-				news_feed_title TEXT,
-				news_src TEXT, 
-				news_title TEXT, 
-				news_date TEXT, 
-				news_description TEXT, 
-				news_url TEXT)
-		"""
 		logging.info("Connecting to SQLite database")
 		try:
 			os.chdir(os.path.join(os.path.dirname(__file__), 'data'))
@@ -797,11 +2371,8 @@ class Tree:
 				except sqlite3.OperationalError as e:
 					print("Error connecting to cached_news.db")
 					sys.exit(1)
-				with database:
-					cursor = database.cursor()
-					cursor.execute(sql)
 				logging.info("Creating cached_news table in database: %s" % filepath)
-			
+			Tree.db_migrate(database)
 			return database
 		except Exception as e:
 			logging.exception(e)
@@ -810,38 +2381,494 @@ class Tree:
 			os.chdir(CWD)
 
 	@staticmethod
-	def db_insert_cached_one(database: sqlite3.Connection) -> None:
-		"""Inserts first row from Tree.CACHE and pops it from the list"""
+	def db_migrate(database: sqlite3.Connection) -> None:
+		"""Creates tables and indexes listed in Tree.db_schema which do not exist yet, 
+		before that adds Tree.db_added_columns missing in existing tables and fills news_link of existing rows 
+		(rows which link is already taken keep NULL, so unique index can be created)"""
+		with database:
+			cursor = database.cursor()
+			for table, columns in Tree.db_added_columns.items():
+				existing = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+				if not existing:
+					continue
+				for column, type_ in columns:
+					if column not in existing:
+						logging.info("Adding column %s to table %s" % (column, table))
+						cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_}")
+						if column == 'news_link':
+							Tree.db_fill_news_link(database)
+						elif column == 'news_ts':
+							cursor.executemany("UPDATE cached_news SET news_ts = ? WHERE rowid = ?", 
+												[(Tree.timestamp(news_date), rowid) for rowid, news_date in 
+												database.execute("SELECT rowid, news_date FROM cached_news")])
+			for sql in Tree.db_schema:
+				cursor.execute(sql)
+
+	@staticmethod
+	def db_cluster_new(database: sqlite3.Connection) -> None:
+		"""Computes simhash of cached_news rows which do not have one yet (rowid above last clustered one) 
+		and assigns each to cluster of earlier row within Tree.SIMHASH_DISTANCE bits, or to a new cluster identified by its own rowid. 
+		Rows are clustered Tree.BATCH_SIZE at a time: simhashes of the batch are computed first, then candidates stored before 
+		the batch are read for all its bands with a single join of temporary simhash_keys table against simhash_bands index, 
+		and earlier rows of the batch are looked up in memory. Only Tree.SIMHASH_CANDIDATES newest rows sharing each band are compared 
+		(read backwards from simhash_bands_value index), so feeds of many similar articles do not make clustering quadratic. 
+		Caller is responsible for the transaction"""
+		last = database.execute("SELECT COALESCE(MAX(news_id), 0) FROM news_simhash").fetchone()[0]
+		database.execute("CREATE TEMP TABLE IF NOT EXISTS simhash_keys (band INTEGER, value INTEGER, PRIMARY KEY (band, value))")
+		lookup = """SELECT simhash_keys.band, simhash_keys.value, news_simhash.simhash, news_simhash.cluster FROM simhash_keys 
+					JOIN simhash_bands ON simhash_bands.rowid IN (SELECT rowid FROM simhash_bands 
+						WHERE band = simhash_keys.band AND value = simhash_keys.value ORDER BY rowid DESC LIMIT ?) 
+					JOIN news_simhash ON news_simhash.news_id = simhash_bands.news_id 
+					ORDER BY simhash_bands.rowid DESC"""
+		mask = (1 << Tree.SIMHASH_BITS) - 1
+		rows = database.cursor()
+		rows.execute("SELECT rowid, news_title, news_description, news_extract FROM cached_news WHERE rowid > ? ORDER BY rowid", (last, ))
+		while True:
+			batch = rows.fetchmany(Tree.BATCH_SIZE)
+			if not batch:
+				break
+			hashed = [(rowid, Tree.article_simhash(title, Tree.unpack_description(database, description), extract)) 
+					for rowid, title, description, extract in batch]
+			database.execute("DELETE FROM simhash_keys")
+			database.executemany("INSERT OR IGNORE INTO simhash_keys (band, value) VALUES (?, ?)", 
+								[key for _, simhash in hashed for key in Tree.simhash_bands(simhash)])
+			stored = {} 	# band key -> [(simhash, cluster)] stored before the batch, newest first
+			for band, value, other, other_cluster in database.execute(lookup, (Tree.SIMHASH_CANDIDATES, )):
+				stored.setdefault((band, value), []).append((other & mask, other_cluster))
+			batched = {} 	# band key -> [(simhash, cluster)] of the batch, oldest first
+			clustered, bands_rows = [], []
+			for rowid, simhash in hashed:
+				bands = Tree.simhash_bands(simhash)
+				cluster = None
+				for key in bands:
+					candidates = itertools.islice(itertools.chain(reversed(batched.get(key, ())), stored.get(key, ())), 
+												Tree.SIMHASH_CANDIDATES)
+					cluster = next((other_cluster for other, other_cluster in candidates 
+									if bin(simhash ^ other).count('1') <= Tree.SIMHASH_DISTANCE), None)
+					if cluster is not None:
+						break
+				cluster = rowid if cluster is None else cluster
+				for key in bands:
+					batched.setdefault(key, []).append((simhash, cluster))
+				# sqlite integers are signed 64 bit
+				clustered.append((rowid, simhash - (1 << Tree.SIMHASH_BITS) if simhash >> (Tree.SIMHASH_BITS - 1) else simhash, cluster))
+				bands_rows.extend((band, value, rowid) for band, value in bands)
+			database.executemany("INSERT INTO news_simhash (news_id, simhash, cluster) VALUES (?, ?, ?)", clustered)
+			database.executemany("INSERT INTO simhash_bands (band, value, news_id) VALUES (?, ?, ?)", bands_rows)
+
+	@staticmethod
+	def db_update_digests(database: sqlite3.Connection) -> None:
+		"""Adds cached_news rows inserted since last call (rowid above digest_last_id setting) to digests of their date:
+		digest_entries row with article as JSON line in the form printed by --json and its html div as exported by --html, 
+		clustered by date, and count and feed titles of the day in daily_digests. A day is then served by one range scan 
+		without querying and rendering its articles again. Caller is responsible for the transaction"""
+		last = database.execute("SELECT value FROM db_settings WHERE key = 'digest_last_id'").fetchone()
+		last = int(last[0]) if last is not None else 0
+		rows = database.cursor()
+		rows.execute(f"SELECT rowid, {', '.join(Tree.db_columns)} FROM cached_news WHERE rowid > ? ORDER BY rowid", (last, ))
+		while True:
+			batch = rows.fetchmany(Tree.BATCH_SIZE)
+			if not batch:
+				break
+			digests = OrderedDict()
+			entries = []
+			for row in batch:
+				article = Tree.extract_article(Tree.db_row(database, row[1:]))
+				if article['date'] not in digests:
+					stored = database.execute("SELECT feed_titles FROM daily_digests WHERE date = ?", (article['date'], )).fetchone()
+					digests[article['date']] = [0, json.loads(stored[0]) if stored is not None else []]
+				digest = digests[article['date']]
+				if article['news_feed_title'] in digest[1]:
+					feed_title = ''
+				else:
+					digest[1].append(article['news_feed_title'])
+					feed_title = f'''<h2>{article['news_feed_title']}</h2>
+						'''
+				digest[0] += 1
+				entries.append((article['date'], row[0], Tree.convert_to_json(article), f'''
+					<div>
+						{feed_title}{Tree.render_article_body(article)}'''))
+			database.executemany("INSERT OR REPLACE INTO digest_entries (date, news_id, json, html) VALUES (?, ?, ?, ?)", entries)
+			database.executemany("""INSERT INTO daily_digests (date, articles, feed_titles) VALUES (?, ?, ?)
+									ON CONFLICT (date) DO UPDATE SET articles = articles + excluded.articles, 
+									feed_titles = excluded.feed_titles""", 
+								[(day, count, json.dumps(feed_titles)) for day, (count, feed_titles) in digests.items()])
+			last = batch[-1][0]
+		database.execute("INSERT OR REPLACE INTO db_settings (key, value) VALUES ('digest_last_id', ?)", (str(last), ))
+
+	@staticmethod
+	def db_fetch_digest(database: sqlite3.Connection, day: str, limit: int = -1) -> tuple[list[str], str]:
+		"""Returns tuple (JSON lines of first limit articles in insertion order, their rendered html divs) of daily digest of day, 
+		None if there is none"""
+		rows = database.execute("SELECT json, html FROM digest_entries WHERE date = ? ORDER BY news_id LIMIT ?", 
+								(day, -1 if limit is None else limit)).fetchall()
+		if not rows:
+			return None
+		return [row[0] for row in rows], ''.join([row[1] for row in rows])
+
+	@staticmethod
+	def db_row(database: sqlite3.Connection, row: tuple) -> dict:
+		"""Returns row selected with Tree.db_columns as dictionary with description decompressed"""
+		dict_ = dict(zip(Tree.db_columns, row))
+		if isinstance(dict_['news_description'], bytes):
+			dict_['news_description'] = Tree.unpack_description(database, dict_['news_description'])
+		for column in Tree.db_optional_columns:
+			if dict_[column] is None:
+				del dict_[column]
+		return dict_
+
+	@staticmethod
+	def db_compression(database: sqlite3.Connection) -> tuple[str, int]:
+		"""Returns compression codec of descriptions and id of zstd dictionary (0 if none) set for database"""
+		settings = dict(database.execute("SELECT key, value FROM db_settings WHERE key IN ('compression', 'compression_dict')"))
+		return settings.get('compression', 'none'), int(settings.get('compression_dict', 0))
+
+	@staticmethod
+	def zstd_coder(database: sqlite3.Connection, dict_id: int, compress: bool):
+		"""Returns zstd compressor or decompressor of current thread using dictionary dict_id (0 for no dictionary),
+		dictionary is loaded from compression_dicts table once"""
+		if zstandard is None:
+			raise FeedParserException("zstandard module is required for zstd compressed descriptions")
+		coders = Tree.ZSTD_CODERS.__dict__.setdefault('coders', {})
+		key = (dict_id, compress)
+		if key not in coders:
+			dict_data = None
+			if dict_id:
+				if dict_id not in Tree.ZSTD_DICTS:
+					data = database.execute("SELECT data FROM compression_dicts WHERE dict_id = ?", (dict_id, )).fetchone()[0]
+					Tree.ZSTD_DICTS[dict_id] = zstandard.ZstdCompressionDict(data)
+				dict_data = Tree.ZSTD_DICTS[dict_id]
+			if compress:
+				coders[key] = zstandard.ZstdCompressor(level=Tree.ZSTD_LEVEL, dict_data=dict_data)
+			else:
+				coders[key] = zstandard.ZstdDecompressor(dict_data=dict_data)
+		return coders[key]
+
+	@staticmethod
+	def pack_description(database: sqlite3.Connection, text: str, codec: str, dict_id: int = 0):
+		"""Returns text compressed with codec as blob: b'z' + zlib stream or b's' + 4 byte dictionary id + zstd frame.
+		Text shorter than Tree.COMPRESS_MIN_SIZE bytes, or which does not get smaller, is returned as is"""
+		if codec == 'none' or text is None:
+			return text
+		data = text.encode('utf-8')
+		if len(data) < Tree.COMPRESS_MIN_SIZE:
+			return text
+		if codec == 'zlib':
+			packed = b'z' + zlib.compress(data, Tree.ZLIB_LEVEL)
+		else:
+			packed = b's' + dict_id.to_bytes(4, 'big') + Tree.zstd_coder(database, dict_id, True).compress(data)
+		return packed if len(packed) < len(data) else text
+
+	@staticmethod
+	def unpack_description(database: sqlite3.Connection, value):
+		"""Reverses pack_description, text values are returned as is"""
+		if not isinstance(value, bytes):
+			return value
+		if value[:1] == b'z':
+			return zlib.decompress(value[1:]).decode('utf-8')
+		if value[:1] == b's':
+			return Tree.zstd_coder(database, int.from_bytes(value[1:5], 'big'), False).decompress(value[5:]).decode('utf-8')
+		raise FeedParserException(f"Unknown description compression: {value[:1]}")
+
+	@staticmethod
+	def db_train_dict(database: sqlite3.Connection) -> int:
+		"""Trains zstd dictionary on up to Tree.ZSTD_DICT_SAMPLES stored descriptions and saves it in compression_dicts table.
+		Returns dictionary id, 0 if there are too few descriptions for training"""
+		if zstandard is None:
+			raise FeedParserException("zstandard module is required for zstd compression, install rss_parser[zstd]")
+		samples = [Tree.unpack_description(database, value).encode('utf-8') for value, in database.execute(
+					"SELECT news_description FROM cached_news WHERE length(news_description) >= ? ORDER BY rowid DESC LIMIT ?", 
+					(Tree.COMPRESS_MIN_SIZE, Tree.ZSTD_DICT_SAMPLES))]
+		try:
+			dict_data = zstandard.train_dictionary(Tree.ZSTD_DICT_SIZE, samples)
+		except zstandard.ZstdError as e:
+			logging.info("Descriptions are compressed without dictionary: %s" % e)
+			return 0
+		dict_id = dict_data.dict_id()
+		database.execute("INSERT OR REPLACE INTO compression_dicts (dict_id, data) VALUES (?, ?)", (dict_id, dict_data.as_bytes()))
+		Tree.ZSTD_DICTS[dict_id] = dict_data
+		return dict_id
+
+	@staticmethod
+	def db_compress(database: sqlite3.Connection, codec: str, batch_size: int) -> tuple[int, int]:
+		"""Sets compression codec of database (for zstd trains dictionary first) and rewrites stored descriptions with it, 
+		batch_size rows at a time, in a single transaction. Returns tuple (uncompressed bytes, stored bytes) of all descriptions"""
+		logging.info("Compressing stored descriptions with %s" % codec)
+		if codec == 'zstd' and zstandard is None:
+			raise FeedParserException("zstandard module is required for zstd compression, install rss_parser[zstd]")
+		try:
+			raw = stored = 0
+			with database:
+				dict_id = Tree.db_train_dict(database) if codec == 'zstd' else 0
+				database.executemany("INSERT OR REPLACE INTO db_settings (key, value) VALUES (?, ?)", 
+									(('compression', codec), ('compression_dict', str(dict_id))))
+				last = 0
+				while True:
+					batch = database.execute("SELECT rowid, news_description FROM cached_news WHERE rowid > ? ORDER BY rowid LIMIT ?", 
+											(last, batch_size)).fetchall()
+					if not batch:
+						break
+					updates = []
+					for rowid, value in batch:
+						text = Tree.unpack_description(database, value)
+						packed = Tree.pack_description(database, text, codec, dict_id)
+						raw += len(text.encode('utf-8')) if text is not None else 0
+						stored += len(packed) if isinstance(packed, bytes) else len(packed.encode('utf-8')) if packed is not None else 0
+						if packed != value:
+							updates.append((packed, rowid))
+					database.executemany("UPDATE cached_news SET news_description = ? WHERE rowid = ?", updates)
+					last = batch[-1][0]
+					logging.info("%s rows compressed" % last)
+			return raw, stored
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_fill_news_link(database: sqlite3.Connection) -> None:
+		"""Sets news_link of existing rows, oldest row keeps the link, newer duplicates keep NULL"""
+		seen = set()
+		updates = []
+		for rowid, news_url in database.execute("SELECT rowid, news_url FROM cached_news ORDER BY rowid"):
+			link = Tree.news_link({'news_url': news_url or ''})
+			if link is not None and link not in seen:
+				seen.add(link)
+				updates.append((link, rowid))
+		database.executemany("UPDATE cached_news SET news_link = ? WHERE rowid = ?", updates)
+
+	@staticmethod
+	def db_insert_many(database: sqlite3.Connection, articles: list[dict], update_derived: bool = True) -> int:
+		"""Inserts articles in database with single executemany, skips articles which title already exists in database
+		(case-insensitive, served by cached_news_title index) or which canonical link already exists from any source
+		(unique cached_news_link index, INSERT OR IGNORE), then clusters inserted rows and adds them to digests 
+		(see db_update_derived), unless update_derived is False and caller does it once for several inserts.
+		Descriptions are compressed with codec set by compress subcommand (see pack_description).
+		Caller is responsible for the transaction. Returns number of inserted articles"""
+		before = database.total_changes
+		codec, dict_id = Tree.db_compression(database)
 		sql = """
-		INSERT INTO cached_news 
+		INSERT OR IGNORE INTO cached_news 
 				(date, 
 				news_feed_title,
 				news_src, 
 				news_title, 
 				news_date, 
 				news_description, 
-				news_url)
-		VALUES (?, ?, ?, ?, ?, ?, ?)
+				news_url, 
+				news_link, 
+				news_ts, 
+				news_extract, 
+				news_guid, 
+				news_author)
+		SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+		WHERE NOT EXISTS (SELECT 1 FROM cached_news WHERE news_title = ? COLLATE NOCASE)
 		"""
+		database.executemany(sql, ((temp['date'], 
+									temp['news_feed_title'],
+									temp['news_src'], 
+									temp['news_title'], 
+									temp['news_date'], 
+									Tree.pack_description(database, temp['news_description'], codec, dict_id), 
+									temp['news_url'],
+									Tree.news_link(temp),
+									Tree.timestamp(temp['news_date']),
+									temp.get('news_extract'),
+									temp.get('news_guid'),
+									temp.get('news_author'),
+									temp['news_title']) for temp in articles))
+		inserted = database.total_changes - before
+		if update_derived:
+			Tree.db_update_derived(database)
+		return inserted
+
+	@staticmethod
+	def db_update_derived(database: sqlite3.Connection) -> None:
+		"""Clusters rows inserted since last call (see db_cluster_new) and adds them to digests (see db_update_digests). 
+		Caller is responsible for the transaction"""
+		Tree.db_cluster_new(database)
+		if not Tree.LAZY: # lazily stored articles are added to digests when a digest is read
+			Tree.db_update_digests(database)
+
+	@staticmethod
+	def open_ndjson(filepath: str, mode: str):
+		"""Opens gzip-compressed NDJSON file relative to CWD for reading ('rt') or writing ('wt'), '-' stands for stdin/stdout"""
+		if filepath == Tree.STDIN_SOURCE:
+			stream = sys.stdin.buffer if mode.startswith('r') else sys.stdout.buffer
+			return gzip.open(stream, mode, compresslevel=Tree.GZIP_LEVEL, encoding='utf-8')
+		return gzip.open(os.path.join(CWD, filepath), mode, compresslevel=Tree.GZIP_LEVEL, encoding='utf-8')
+
+	@staticmethod
+	def db_export(database: sqlite3.Connection, filepath: str, batch_size: int) -> int:
+		"""Streams cached_news rows to gzip-compressed NDJSON file, one JSON object per line, 
+		fetching batch_size rows at a time so memory use does not depend on table size. Returns number of exported rows"""
+		logging.info("Exporting cached news to %s" % filepath)
+		try:
+			rows = 0
+			dumps = json.JSONEncoder(ensure_ascii=False).encode
+			with Tree.open_ndjson(filepath, 'wt') as file:
+				cursor = database.cursor()
+				cursor.execute(f"SELECT {', '.join(Tree.db_columns)} FROM cached_news")
+				while True:
+					batch = cursor.fetchmany(batch_size)
+					if not batch:
+						break
+					file.write(''.join([dumps(Tree.db_row(database, row)) + '\n' for row in batch]))
+					rows += len(batch)
+					logging.info("%s rows exported" % rows)
+			return rows
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_import(database: sqlite3.Connection, filepath: str, batch_size: int) -> tuple[int, int]:
+		"""Loads gzip-compressed NDJSON file produced by db_export into cached_news, batch_size rows per executemany, 
+		in a single transaction, skipping articles already in database. Returns tuple (rows read, rows inserted)"""
+		logging.info("Importing cached news from %s" % filepath)
+		try:
+			read = 0
+			inserted = 0
+			with Tree.open_ndjson(filepath, 'rt') as file, database:
+				while True:
+					lines = list(itertools.islice(file, batch_size))
+					if not lines:
+						break
+					batch = [json.loads(line) for line in lines if line.strip()]
+					inserted += Tree.db_insert_many(database, batch)
+					read += len(batch)
+					logging.info("%s rows imported" % read)
+			return read, inserted
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_delete_rows(database: sqlite3.Connection, rowids: list[int]) -> None:
+		"""Deletes cached_news rows with their simhash, bands and digest entries, every one found through an index.
+		Rows clustered under a deleted row move to cluster of its earliest remaining member, feed title heading carried 
+		by a deleted digest entry goes to the next stored article of the feed, and digest_last_id is lowered to the last 
+		remaining rowid, since sqlite gives rowid of deleted last row to next inserted one. Caller is responsible for the transaction"""
+		for rowid in rowids:
+			row = database.execute("SELECT date, news_feed_title FROM cached_news WHERE rowid = ?", (rowid, )).fetchone()
+			if row is None:
+				continue
+			day, feed_title = row
+			entry = database.execute("SELECT html FROM digest_entries WHERE date = ? AND news_id = ?", (day, rowid)).fetchone()
+			if entry is not None:
+				database.execute("DELETE FROM digest_entries WHERE date = ? AND news_id = ?", (day, rowid))
+				feed_titles = json.loads(database.execute("SELECT feed_titles FROM daily_digests WHERE date = ?", (day, )).fetchone()[0])
+				if f'<h2>{feed_title}</h2>' in entry[0] and feed_title in feed_titles:
+					feed_titles.remove(feed_title)
+				database.execute("UPDATE daily_digests SET articles = articles - 1, feed_titles = ? WHERE date = ?", 
+								(json.dumps(feed_titles), day))
+			stored = database.execute("SELECT simhash, cluster FROM news_simhash WHERE news_id = ?", (rowid, )).fetchone()
+			if stored is not None:
+				simhash, cluster = stored
+				database.executemany("DELETE FROM simhash_bands WHERE band = ? AND value = ? AND news_id = ?", 
+									[(band, value, rowid) for band, value in Tree.simhash_bands(simhash & (1 << Tree.SIMHASH_BITS) - 1)])
+				database.execute("DELETE FROM news_simhash WHERE news_id = ?", (rowid, ))
+				if cluster == rowid:
+					database.execute("UPDATE news_simhash SET cluster = (SELECT MIN(news_id) FROM news_simhash WHERE cluster = ?) WHERE cluster = ?", 
+									(rowid, rowid))
+			database.execute("DELETE FROM cached_news WHERE rowid = ?", (rowid, ))
+		database.execute("""UPDATE db_settings SET value = (SELECT COALESCE(MAX(rowid), 0) FROM cached_news) 
+							WHERE key = 'digest_last_id' AND CAST(value AS INTEGER) > (SELECT COALESCE(MAX(rowid), 0) FROM cached_news)""")
+
+	@staticmethod
+	def merge_keys(article: dict, link: str) -> list[tuple]:
+		"""Returns keys under which articles are duplicates while merging: case-folded title, canonical link (see news_link) 
+		and guid within source"""
+		keys = [('title', (article['news_title'] or '').lower())]
+		if link is not None:
+			keys.append(('link', link))
+		if article.get('news_guid'):
+			keys.append(('guid', article['news_src'], article['news_guid']))
+		return keys
+
+	@staticmethod
+	def db_merge(database: sqlite3.Connection, filepaths: list[str], batch_size: int) -> tuple[int, int, int]:
+		"""Merges cached_news of other cache files (paths relative to CWD) into database. Every file is ATTACHed and read 
+		batch_size rows at a time by rowid, each batch in its own transaction, so memory use and transaction size do not depend 
+		on table sizes. Articles are duplicates when they share guid within source, canonical link or title (case-insensitive, 
+		as db_insert_many skips them, which covers normalized title + source), each looked up through an index. The newest copy 
+		by publication time is kept: older copies in database are deleted (see db_delete_rows) before the newer one is inserted, 
+		older or equally old incoming copies are skipped without decompressing them. 
+		Returns tuple (rows read, rows inserted, older rows replaced)"""
+		logging.info("Merging cached news from %s" % ', '.join(filepaths))
+		try:
+			read = inserted = replaced = 0
+			main = database.execute("PRAGMA database_list").fetchone()[2]
+			lookup = """SELECT rowid, COALESCE(news_ts, 0) FROM main.cached_news WHERE news_guid = ? AND news_src = ?
+						UNION SELECT rowid, COALESCE(news_ts, 0) FROM main.cached_news WHERE news_link = ?
+						UNION SELECT rowid, COALESCE(news_ts, 0) FROM main.cached_news WHERE news_title = ? COLLATE NOCASE"""
+			for filepath in filepaths:
+				path = os.path.join(CWD, filepath)
+				if not os.path.isfile(path): # ATTACH would create an empty database
+					raise FeedParserException(f"No such cache file: {filepath}")
+				if main and os.path.samefile(path, main):
+					raise FeedParserException(f"Cannot merge {filepath} into itself")
+				database.execute("ATTACH DATABASE ? AS merged", (path, ))
+				try:
+					tables = {name for name, in database.execute("SELECT name FROM merged.sqlite_master WHERE type = 'table'")}
+					if 'cached_news' not in tables:
+						raise FeedParserException(f"No cached news in {filepath}")
+					existing = {row[1] for row in database.execute("PRAGMA merged.table_info(cached_news)")}
+					columns = ', '.join(column if column in existing else f'NULL AS {column}' for column in Tree.db_columns)
+					if 'compression_dicts' in tables: # zstd descriptions of merged file are decompressed with its dictionaries
+						with database:
+							database.execute("INSERT OR IGNORE INTO main.compression_dicts (dict_id, data) SELECT dict_id, data FROM merged.compression_dicts")
+					last = 0
+					while True:
+						batch = database.execute(f"SELECT rowid, {columns} FROM merged.cached_news WHERE rowid > ? ORDER BY rowid LIMIT ?", 
+												(last, batch_size)).fetchall()
+						if not batch:
+							break
+						pending = [] 	# (timestamp, row) of kept rows of batch, None once replaced by a newer copy in the same batch
+						keys = {} 		# merge key: index in pending
+						with database:
+							for row in batch:
+								article = dict(zip(Tree.db_columns, row[1:]))
+								ts = Tree.timestamp(article['news_date'])
+								link = Tree.news_link(article)
+								article_keys = Tree.merge_keys(article, link)
+								twins = {keys[key] for key in article_keys if key in keys and pending[keys[key]] is not None}
+								stored = database.execute(lookup, (article['news_guid'], article['news_src'], link, article['news_title'])).fetchall()
+								if any(pending[i][0] >= ts for i in twins) or any(other >= ts for _, other in stored):
+									continue
+								for i in twins:
+									pending[i] = None
+								if stored:
+									Tree.db_delete_rows(database, [rowid for rowid, _ in stored])
+									replaced += len(stored)
+								keys.update((key, len(pending)) for key in article_keys)
+								pending.append((ts, row[1:]))
+							inserted += Tree.db_insert_many(database, [Tree.db_row(database, row) for _, row in filter(None, pending)])
+						read += len(batch)
+						last = batch[-1][0]
+						logging.info("%s rows of %s merged" % (read, filepath))
+				finally:
+					database.execute("DETACH DATABASE merged")
+			return read, inserted, replaced
+		except Exception as e:
+			logging.exception(e)
+			raise FeedParserException(e)
+
+	@staticmethod
+	def db_insert_cached_one(database: sqlite3.Connection) -> None:
+		"""Inserts first row from Tree.CACHE not inserted yet, skips duplicates like db_insert_many.
+		Inserted rows are removed from the list once they are half of it, so draining Tree.CACHE row by row stays linear"""
 		logging.info("Inserting row from Tree.CACHE into database")
 		try:
-			if len(Tree.CACHE) > 0:
-				temp = Tree.CACHE.pop(0)
+			if Tree.CACHE_HEAD >= len(Tree.CACHE): # Tree.CACHE was replaced
+				Tree.CACHE_HEAD = 0
+			if len(Tree.CACHE) > Tree.CACHE_HEAD:
+				temp = Tree.CACHE[Tree.CACHE_HEAD]
+				Tree.CACHE_HEAD += 1
+				if Tree.CACHE_HEAD * 2 >= len(Tree.CACHE):
+					del Tree.CACHE[:Tree.CACHE_HEAD]
+					Tree.CACHE_HEAD = 0
 				with database:
-					cursor = database.cursor()
-					check_if_exists = f"SELECT date FROM cached_news WHERE news_title LIKE ?"
-					cursor.execute(check_if_exists, (temp['news_title'],))
-					flag = cursor.fetchone()
-					if flag is None:
-						cursor.execute(sql, 
-							(temp['date'], 
-							temp['news_feed_title'],
-							temp['news_src'], 
-							temp['news_title'], 
-							temp['news_date'], 
-							temp['news_description'], 
-							temp['news_url']),
-						)
+					Tree.db_insert_many(database, (temp, ))
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -877,10 +2904,7 @@ class Tree:
 						self.parse_a(child, dict_)
 					elif child.tag == 'ul':
 						for c in child.getchildren():
-							if 'news_description' in dict_:
-								dict_['news_description'] = f"{dict_['news_description']}\n{c.text}"
-							else:
-								dict_['news_description'] = f"{c.text}"
+							self.add_text(dict_, c.text)
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -890,28 +2914,76 @@ class Tree:
 		try:
 			if node.getchildren() == []:
 				if len(node.text_content()) > 0:
-					if 'news_description' in dict_:
-						dict_['news_description'] = f"{dict_['news_description']}\n{node.text_content()}"
-					else: 
-						dict_['news_description'] = f"{node.text_content()}"
+					self.add_text(dict_, node.text_content())
 			else:
-				if 'news_description' in dict_:
-					dict_['news_description'] = f"{dict_['news_description']}\n{node.text_content()}"
-				else: 
-					dict_['news_description'] = f"{node.text_content()}"
+				self.add_text(dict_, node.text_content())
 				self.parse_html(node.getchildren(), dict_)
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
 
+	def seen_urls(self, dict_: dict) -> set:
+		"""Returns set of canonical urls already in dict_[news_url]. 
+		Set is kept while dict_[news_url] is the string last written by add_url, otherwise it is rebuilt from dict_[news_url]"""
+		news_url = dict_.get('news_url')
+		last_url, seen = getattr(self, 'url_index', (None, None))
+		if news_url is None or news_url is not last_url:
+			seen = set()
+			for line in (news_url or '').split('\n'):
+				if line:
+					seen.add(Tree.canonical_url(line.rsplit(' (', 1)[0]))
+		return seen
+
+	def add_url(self, dict_: dict, url: str, kind: str) -> None:
+		"""Appends url with kind to dict_[news_url] unless its canonical form is already there.
+		While self.extract_buffer of dict_ is open url is added to the buffer instead, rewriting growing dict_[news_url] 
+		for every url of a description is quadratic in number of urls"""
+		buffer = getattr(self, 'extract_buffer', None)
+		if buffer is not None and buffer[0] is dict_:
+			seen = buffer[1]
+		else:
+			buffer = None
+			seen = self.seen_urls(dict_)
+		canonical = Tree.canonical_url(url)
+		if canonical in seen:
+			return
+		seen.add(canonical)
+		if buffer is not None:
+			buffer[2].append(f"{url} ({kind})")
+			return
+		if 'news_url' in dict_:
+			dict_['news_url'] = f"{dict_['news_url']}\n{url} ({kind})"
+		else:
+			dict_['news_url'] = f"{url} ({kind})"
+		self.url_index = (dict_['news_url'], seen)
+
+	def add_text(self, dict_: dict, text: str) -> None:
+		"""Appends text as new line of dict_[news_description], to self.extract_buffer while one of dict_ is open"""
+		buffer = getattr(self, 'extract_buffer', None)
+		if buffer is not None and buffer[0] is dict_:
+			buffer[3].append(f"{text}")
+		elif 'news_description' in dict_:
+			dict_['news_description'] = f"{dict_['news_description']}\n{text}"
+		else:
+			dict_['news_description'] = f"{text}"
+
+	def flush_buffer(self) -> None:
+		"""Appends text and urls collected in self.extract_buffer to its dict_ and closes the buffer"""
+		buffer, self.extract_buffer = getattr(self, 'extract_buffer', None), None
+		if buffer is None:
+			return
+		dict_, seen, urls, texts = buffer
+		for key, lines in (('news_description', texts), ('news_url', urls)):
+			if lines:
+				joined = '\n'.join(lines)
+				dict_[key] = f"{dict_[key]}\n{joined}" if key in dict_ else joined
+		if urls:
+			self.url_index = (dict_['news_url'], seen)
+
 	def parse_img(self, node: html.HtmlElement, dict_: dict) -> None:		
 		"""Parses img tag of html and appends url to dict_[news_url]"""
 		try:
-			if 'news_url' in dict_:
-				if dict_['news_url'].find(node.attrib['src']) == -1:
-					dict_['news_url'] = f"{dict_['news_url']}\n{node.attrib['src']} (content)"
-			else:
-				dict_['news_url'] = f"{node.attrib['src']} (content)"
+			self.add_url(dict_, node.attrib['src'], 'content')
 		except Exception as e:
 			logging.exception(e)
 			raise FeedParserException(e)
@@ -919,16 +2991,212 @@ class Tree:
 	def parse_a(self, node: html.HtmlElement, dict_: dict) -> None:
 		"""Parses a tag of html and appends url to dict_[news_url]"""
 		try:
-			href = node.attrib['href']
-			if 'news_url' in dict_:
-				if dict_['news_url'].find(href) == -1:
-					dict_['news_url'] = f"{dict_['news_url']}\n{node.attrib['href']} (link)"
-			else:
-				dict_['news_url'] = f"{node.attrib['href']} (link)"
+			self.add_url(dict_, node.attrib['href'], 'link')
 		except Exception as e:
 			raise e
 
 
+class HostScheduler:
+	"""Keeps fetching of several feeds polite: at most per_host connections are open to one host at a time (slot)
+	and requests to one host are spaced by token bucket refilled with rate tokens per second up to burst tokens (throttle).
+	Host can be postponed for given time, e.g. by Retry-After header (defer). Safe to use from several threads"""
+
+	PER_HOST = 2
+	RATE = 1.0
+	BURST = 2
+
+	def __init__(self, per_host: int = PER_HOST, rate: float = RATE, burst: int = BURST):
+		self.per_host = per_host
+		self.rate = rate
+		self.burst = burst
+		self.condition = threading.Condition()
+		self.active = {} 			# host: open connections
+		self.tokens = {} 			# host: (tokens, time.monotonic() of last refill)
+		self.not_before = {} 		# host: time.monotonic() before which host is not contacted
+
+	@contextlib.contextmanager
+	def slot(self, host: str):
+		"""Context manager waiting until fewer than per_host connections are open to host and holding one while active"""
+		with self.condition:
+			while self.active.get(host, 0) >= self.per_host:
+				self.condition.wait()
+			self.active[host] = self.active.get(host, 0) + 1
+		try:
+			yield
+		finally:
+			with self.condition:
+				self.active[host] -= 1
+				self.condition.notify_all()
+
+	def throttle(self, host: str, timeout: float = None) -> bool:
+		"""Waits until host is not postponed and has a request token, takes the token and returns True. 
+		Returns False without waiting if that would take longer than timeout seconds"""
+		with self.condition:
+			while True:
+				now = time.monotonic()
+				tokens, updated = self.tokens.get(host, (self.burst, now))
+				tokens = min(self.burst, tokens + (now - updated) * self.rate)
+				wait = max(self.not_before.get(host, 0) - now, (1 - tokens) / self.rate, 0)
+				if wait <= 0:
+					self.tokens[host] = (tokens - 1, now)
+					return True
+				self.tokens[host] = (tokens, now)
+				if timeout is not None and wait > timeout:
+					return False
+				logging.info("Waiting %.2f seconds before next request to %s" % (wait, host))
+				self.condition.wait(wait)
+				if timeout is not None:
+					timeout -= time.monotonic() - now
+
+	def defer(self, host: str, seconds: float) -> None:
+		"""Postpones requests to host by seconds"""
+		with self.condition:
+			self.not_before[host] = max(self.not_before.get(host, 0), time.monotonic() + seconds)
+			logging.info("Requests to %s postponed by %s seconds" % (host, seconds))
+
+
+class NewsQueryServer(ThreadingHTTPServer):
+	"""	Local HTTP server answering db_query_news queries as JSON:
+		GET /news?date=2022-05-26&source=yahoo&limit=20&offset=40
+
+	Queries run on a pool of read-only connections, results are kept in LRU cache (Tree.db_columns rows serialized to JSON) 
+	tagged with generation of database. Generation goes up whenever PRAGMA data_version of a pool connection changes, 
+	i.e. another connection committed anything (insert, update in place, delete, recompression), so any change invalidates them. 
+	Every response carries an ETag, requests with matching If-None-Match get 304 Not Modified."""
+
+	POOL_SIZE = 4
+	CACHE_SIZE = 1024
+	DEFAULT_LIMIT = 20
+	MAX_LIMIT = 1000
+	daemon_threads = True
+
+	def __init__(self, server_address: tuple, db_filepath: str, pool_size: int = POOL_SIZE, cache_size: int = CACHE_SIZE):
+		super().__init__(server_address, NewsRequestHandler)
+		self.cache_size = cache_size
+		self.cache = OrderedDict()
+		self.cache_lock = threading.Lock()
+		self.generation = 0
+		self.data_versions = {} 	# pool connection: PRAGMA data_version it returned last, values differ between connections
+		self.pool = queue.Queue()
+		for i in range(pool_size):
+			database = sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True, check_same_thread=False)
+			self.data_versions[database] = database.execute("PRAGMA data_version").fetchone()[0]
+			self.pool.put(database)
+
+	def query(self, filter_date: str, filter_src: str, limit: int, offset: int) -> tuple[str, bytes]:
+		"""Returns tuple (etag, json body) for query, from LRU cache if database did not change since it was cached"""
+		key = (filter_date, filter_src, limit, offset)
+		database = self.pool.get()
+		try:
+			data_version = database.execute("PRAGMA data_version").fetchone()[0]
+			with self.cache_lock:
+				if data_version != self.data_versions[database]:
+					self.data_versions[database] = data_version
+					self.generation += 1
+				version = self.generation
+				cached = self.cache.get(key)
+				if cached is not None and cached[0] == version:
+					self.cache.move_to_end(key)
+					return cached[1], cached[2]
+			articles = Tree.db_query_news(database, filter_date, filter_src, limit, offset)
+		finally:
+			self.pool.put(database)
+		body = json.dumps({'offset': offset, 
+							'limit': limit, 
+							'next_offset': offset + limit if len(articles) == limit else None, 
+							'articles': articles}).encode('utf-8')
+		etag = f'"{hashlib.sha1(body).hexdigest()}"'
+		with self.cache_lock:
+			self.cache[key] = (version, etag, body)
+			self.cache.move_to_end(key)
+			while len(self.cache) > self.cache_size:
+				self.cache.popitem(last=False)
+		return etag, body
+
+	def server_close(self) -> None:
+		super().server_close()
+		while not self.pool.empty():
+			self.pool.get().close()
+
+
+class NewsRequestHandler(BaseHTTPRequestHandler):
+	"""Handles GET /news requests of <class 'NewsQueryServer'>"""
+
+	protocol_version = 'HTTP/1.1' # keeps connections of clients alive between requests
+
+	def do_GET(self) -> None:
+		url = urlsplit(self.path)
+		if url.path.rstrip('/') != '/news':
+			self.send_error(404, 'Use /news?date=&source=&limit=&offset=')
+			return
+		params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+		try:
+			limit = min(int(params.get('limit', NewsQueryServer.DEFAULT_LIMIT)), NewsQueryServer.MAX_LIMIT)
+			offset = int(params.get('offset', 0))
+			if limit < 0 or offset < 0:
+				raise ValueError
+		except ValueError:
+			self.send_error(400, 'limit and offset must be non-negative integers')
+			return
+		try:
+			etag, body = self.server.query(params.get('date'), params.get('source'), limit, offset)
+		except FeedParserException as e:
+			self.send_error(500, str(e))
+			return
+		if self.headers.get('If-None-Match') == etag:
+			self.send_response(304)
+			self.send_header('ETag', etag)
+			self.end_headers()
+			return
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.send_header('ETag', etag)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format: str, *args) -> None:
+		logging.info("%s - %s" % (self.address_string(), format % args))
+
+
+def ingest_file(filepath: str) -> list[dict]:
+	"""Parses local feed file and returns list of parsed articles (or exception raised while parsing), runs in worker process of Tree.ingest_directory"""
+	database, Tree.DB = Tree.DB, None # feed profiles are not used for files, connection must not be shared with worker
+	try:
+		tree = object.__new__(Tree)
+		Tree.URL = filepath
+		Tree.CACHE = []
+		tree.response = Tree.open_source(filepath)
+		tree.parse_feed()
+		return Tree.CACHE
+	except Exception as e:
+		return e
+	finally:
+		Tree.CACHE = []
+		Tree.DB = database
+
+def write_html_page(filepath: str, number: int, articles: list[dict], has_next: bool, index_name: str, page_name: str) -> Exception:
+	"""Writes page number of paginated html export article by article.
+	Returns None, or exception raised while writing, runs in worker process of Tree.create_html_pages"""
+	feed_titles, article_divs = Tree.FEED_TITLES, Tree.ARTICLE_DIVS
+	Tree.FEED_TITLES, Tree.ARTICLE_DIVS = set(), ''
+	try:
+		title = Counter(dict_['news_feed_title'] for dict_ in articles).most_common(1)[0][0]
+		head, tail = Tree.html_page_parts(f"{title} - page {number}")
+		nav = Tree.html_page_nav(number, has_next, index_name, page_name)
+		with open(filepath, 'w') as file:
+			file.write(head + nav)
+			for dict_ in articles:
+				file.write(Tree.article_to_html(dict_))
+				Tree.FEED_TITLES.add(dict_['news_feed_title'])
+			file.write(nav + tail)
+		return None
+	except Exception as e:
+		return e
+	finally:
+		Tree.FEED_TITLES, Tree.ARTICLE_DIVS = feed_titles, article_divs
+
+
 def main():
 	global CWD 
 	CWD = os.getcwd()
@@ -941,6 +3209,12 @@ def main():
 	LOGGING_LEVEL = logging.CRITICAL
 	LOG_FILEPATH = None
 
+	if len(sys.argv) > 1 and sys.argv[1] in Tree.subcommands:
+		args = rss_subcommand_parser()
+		logging_basicConfig(logging.INFO if args.verbose else LOGGING_LEVEL, LOG_FILEPATH)
+		run_subcommand(args)
+		sys.exit(0)
+
 	args = rss_arg_parser()
 	if args.version:
 		print(VERSION)
@@ -952,7 +3226,8 @@ def main():
 	else:
 		LOG_FILEPATH = args.log
 	logging_basicConfig(LOGGING_LEVEL, LOG_FILEPATH)
-	colorama.init(autoreset=True)
+	if args.format is None and sys.stdout.isatty():
+		colorama.init(autoreset=True)
 
 	tree = Tree(args.url, 
 				limit=args.limit,
@@ -960,7 +3235,25 @@ def main():
 				html_filepath=args.html, 
 				pdf_filepath=args.pdf, 
 				filter_src=args.source,
-				filter_date=args.date,)
+				filter_date=args.date,
+				timeout=args.timeout,
+				max_bytes=args.max_bytes,
+				workers=args.workers,
+				format_=args.format,
+				latest=args.latest,
+				collapse=args.collapse,
+				timeline=args.timeline,
+				backend=args.backend,
+				huge_tree=args.huge_tree,
+				extract=args.extract,
+				lazy=args.lazy,
+				retries=args.retries,
+				deadline=args.deadline,
+				user_agent=args.user_agent,
+				fetch_workers=args.fetch_workers,
+				per_host=args.per_host,
+				host_rate=args.host_rate,
+				page_size=args.page_size,)
 
 
 if __name__ == '__main__':
@@ -1,12 +1,28 @@
 import pytest
-from rss_parser.rss_parser import Tree, FeedParserException
+from rss_parser.rss_parser import Tree, FeedParserException, HostScheduler
+from feed_server import FeedServer, generate_feed
 from unittest.mock import patch, Mock, MagicMock, mock_open, call
-from http.client import HTTPResponse
+from http.client import HTTPResponse, HTTPMessage
 from urllib.request import Request
 from xml.etree.ElementTree import Element, fromstring
 from io import StringIO
 import sqlite3
 import re
+import gzip
+import lzma
+import json as json_module
+import time
+import io
+import socket
+import threading
+import sys
+import contextlib
+import tracemalloc
+import hashlib
+import itertools
+from xml.etree import ElementTree as ET
+from urllib.error import URLError, HTTPError
+from datetime import date
 
 sample_xml_1 = """
 					<xml>
@@ -126,10 +142,36 @@ def test_establish_connection_failure(input_x, ):
 def test_get_xml_tree(mock_init, input_x, ):
 	tree = Tree()
 	tree.response = Mock()
-	tree.response.read = Mock(return_value=input_x)
+	tree.response.read = Mock(side_effect=[input_x, b''])
 	xml_tree = tree.get_xml_tree()
 	assert type(xml_tree) == Element
 
+@patch('rss_parser.rss_parser.Tree.__init__', return_value=None)
+def test_get_xml_tree_chunked(mock_init, ):
+	tree = Tree()
+	tree.response = Mock()
+	chunks = [sample_xml_3[i:i + 100] for i in range(0, len(sample_xml_3), 100)]
+	tree.response.read = Mock(side_effect=chunks + [b''])
+	xml_tree = tree.get_xml_tree()
+	assert xml_tree.tag == 'rss'
+	assert len(xml_tree.findall('./channel/item')) == 2
+
+@pytest.mark.parametrize(
+	('content_length', 'body', ),
+	(
+		(None, b'x' * 64),
+		('64', b'x' * 64),
+		('1000000', b''),
+	)
+)
+def test_read_chunks_max_bytes(content_length, body, ):
+	response = Mock()
+	response.headers = {'Content-Length': content_length} if content_length is not None else {}
+	response.read = Mock(side_effect=[body[:32], body[32:], b''])
+	with patch('rss_parser.rss_parser.Tree.MAX_BYTES', 50):
+		with pytest.raises(FeedParserException):
+			list(Tree.read_chunks(response))
+
 @patch('rss_parser.rss_parser.Tree.__init__', return_value=None)
 @pytest.mark.parametrize(
 	('input_x', ),
@@ -343,8 +385,8 @@ def test_to_html_string(mock_init, mock_article_to_html, LIMIT, PAGE_TITLE, expe
 		(True, True, '''
 					<div>
 						<h2>Default feed title</h2>
-						<img src="fake-img-link.com" alt="" width="60% of window">
-						<img src="fake-img-link.org" alt="" width="60% of window">\n\t\t\t\t\t\t
+						<img src="fake-img-link.com" alt="" width="640" height="360" loading="lazy">
+						<img src="fake-img-link.org" alt="" width="640" height="360" loading="lazy">\n\t\t\t\t\t\t
 						<p>Default src value</p>
 						<h3>Default title value</h3>
 						<p>Default news_date value</p>
@@ -384,6 +426,21 @@ def test_create_pdf(mock_pdfkit_from_file, mock_create_html, mock_init):
 	assert call(mock_filepath) in mock_create_html.mock_calls
 	assert call(input=mock_filepath, output_path=sample_filepath) in mock_pdfkit_from_file.mock_calls
 
+def test_create_html_and_pdf_same_articles(tmp_path, ):
+	saved = Tree.CACHE, Tree.LIMIT, Tree.ARTICLE_DIVS, Tree.temp_html_path, Tree.PDF_FILEPATH
+	Tree.CACHE = [dict(dummy_dict, news_title=f'Story {i}', news_url=f'https://a.com/{i} (link)') for i in range(4)]
+	Tree.LIMIT, Tree.ARTICLE_DIVS = 2, ''
+	Tree.temp_html_path, Tree.PDF_FILEPATH = str(tmp_path / '.temp.html'), str(tmp_path / 'news.pdf')
+	pdf_html = []
+	try:
+		with patch('pdfkit.from_file', side_effect=lambda input, output_path: pdf_html.append(open(input).read())):
+			Tree.create_html(str(tmp_path / 'news.html'))
+			Tree.create_pdf()
+	finally:
+		Tree.CACHE, Tree.LIMIT, Tree.ARTICLE_DIVS, Tree.temp_html_path, Tree.PDF_FILEPATH = saved
+	assert (tmp_path / 'news.html').read_text().count('<h3>') == pdf_html[0].count('<h3>') == 2
+	assert pdf_html[0].count('<h2>') == 1
+
 @patch('os.path.isfile', return_value=False)
 @patch('rss_parser.rss_parser.Tree.__init__', return_value=None)
 @patch('sqlite3.connect')
@@ -664,3 +721,1339 @@ def test_parse_a(mock_init, dict_, ):
 
 
 
+
+@pytest.mark.parametrize(
+	('filename', 'opener', ),
+	(
+		('feed.xml', open),
+		('feed.xml.gz', gzip.open),
+		('feed.xml.xz', lzma.open),
+	)
+)
+def test_open_source_local_file(tmp_path, filename, opener, ):
+	filepath = str(tmp_path / filename)
+	with opener(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	stream = Tree.open_source(filepath)
+	assert b''.join(Tree.read_chunks(stream)) == sample_xml_3
+
+@pytest.mark.parametrize(
+	('workers', ),
+	(
+		(1, ),
+		(2, ),
+	)
+)
+def test_ingest_directory(tmp_path, workers, ):
+	(tmp_path / 'nested').mkdir()
+	(tmp_path / 'yahoo.xml').write_bytes(sample_xml_3)
+	with gzip.open(tmp_path / 'nested' / 'globalissues.xml.gz', 'wb') as file:
+		file.write(sample_prefix_xml_1)
+	(tmp_path / 'broken.xml').write_bytes(b'<rss><channel>')
+	(tmp_path / 'notes.txt').write_bytes(b'not a feed')
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	files, articles = Tree.ingest_directory(db, str(tmp_path), workers)
+	assert (files, articles) == (2, 3)
+	assert db.execute("SELECT COUNT(*) FROM cached_news").fetchone() == (3, )
+	assert Tree.ingest_directory(db, str(tmp_path), workers) == (0, 0) # resumes from checkpoint
+	db.close()
+
+def test_db_export_import(tmp_path, ):
+	source = sqlite3.connect(':memory:')
+	Tree.db_migrate(source)
+	articles = [dict(dummy_dict, news_title=f'Title {i}') for i in range(25)]
+	with source:
+		Tree.db_insert_many(source, articles)
+	filepath = str(tmp_path / 'cached_news.ndjson.gz')
+	assert Tree.db_export(source, filepath, 10) == 25
+	with gzip.open(filepath, 'rt', encoding='utf-8') as file:
+		lines = file.readlines()
+	assert len(lines) == 25
+	assert json_module.loads(lines[0])['news_title'] == 'Title 0'
+	destination = sqlite3.connect(':memory:')
+	Tree.db_migrate(destination)
+	with destination:
+		Tree.db_insert_many(destination, articles[:5])
+	assert Tree.db_import(destination, filepath, 10) == (25, 20) # rows with known titles are skipped
+	assert destination.execute("SELECT COUNT(*) FROM cached_news").fetchone() == (25, )
+	source.close()
+	destination.close()
+
+def test_db_delete_rows():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	for title in near_duplicate_titles:
+		with db:
+			Tree.db_insert_many(db, [dict(dummy_dict, news_title=title, news_description='', news_url=f'https://{len(title)}.com (link)')])
+	with db:
+		Tree.db_delete_rows(db, [1, 3])
+	assert db.execute("SELECT news_id, cluster FROM news_simhash").fetchall() == [(2, 2)] # cluster moves to remaining member
+	assert db.execute("SELECT DISTINCT news_id FROM simhash_bands").fetchall() == [(2, )]
+	assert db.execute("SELECT news_id FROM digest_entries").fetchall() == [(2, )]
+	assert db.execute("SELECT articles FROM daily_digests").fetchone() == (1, )
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title='Reused rowid', news_url='https://reused.com (link)')])
+	assert db.execute("SELECT news_id FROM digest_entries ORDER BY news_id").fetchall() == [(2, ), (3, )] # rowid 3 is given again
+	db.close()
+
+def test_db_merge(tmp_path, ):
+	def article(title, date, **kwargs):
+		return dict(dummy_dict, news_title=title, news_date=date, date=date[:10], news_url=f'https://{title.lower().replace(" ", "-")}.com (link)',
+					news_description=' '.join(f'{title} word{i}' for i in range(40)), **kwargs)
+	destination = sqlite3.connect(str(tmp_path / 'cached_news.db'))
+	Tree.db_migrate(destination)
+	with destination:
+		Tree.db_insert_many(destination, [article('Title 0', '2022-05-01 10:00:00', news_guid='g0'), 
+										article('Title 1', '2022-05-01 10:00:00'), article('Title 2', '2022-05-01 10:00:00')])
+	source = sqlite3.connect(str(tmp_path / 'other.db'))
+	Tree.db_migrate(source)
+	with source:
+		Tree.db_insert_many(source, [article('Title 0 renamed', '2022-04-30 10:00:00', news_guid='g0'), # older copy of guid g0
+									dict(article('Title 1 updated', '2022-05-02 10:00:00'), news_url='https://title-1.com (link)'), # newer copy of link
+									article('title 3', '2022-05-02 10:00:00')])
+		Tree.db_insert_many(source, [article(f'Title {i}', '2022-05-02 11:00:00') for i in range(10, 15)])
+	Tree.db_compress(source, 'zlib', 10)
+	with source:
+		# newer copy of stored 'title 3' in the last batch, replaced by an even newer copy in the same batch
+		source.execute("UPDATE cached_news SET news_title = 'TITLE 3', news_date = '2022-05-03 10:00:00' WHERE news_title = 'Title 13'")
+		source.execute("UPDATE cached_news SET news_title = 'Title 3', news_date = '2022-05-04 10:00:00' WHERE news_title = 'Title 14'")
+	source.close()
+	assert Tree.db_merge(destination, [str(tmp_path / 'other.db')], 3) == (8, 6, 2)
+	titles = [title for title, in destination.execute("SELECT news_title FROM cached_news ORDER BY news_title")]
+	assert titles == ['Title 0', 'Title 1 updated', 'Title 10', 'Title 11', 'Title 12', 'Title 2', 'Title 3']
+	merged = next(Tree.db_iter_news(destination, 'news_title', 'Title 1 updated'))
+	assert merged['news_description'] == article('Title 1 updated', '')['news_description'] # decompressed from merged file
+	rowids = destination.execute("SELECT rowid FROM cached_news ORDER BY rowid").fetchall()
+	assert destination.execute("SELECT news_id FROM news_simhash ORDER BY news_id").fetchall() == rowids
+	assert destination.execute("SELECT news_id FROM digest_entries ORDER BY news_id").fetchall() == rowids
+	assert destination.execute("SELECT SUM(articles) FROM daily_digests").fetchone() == (7, )
+	assert Tree.db_merge(destination, [str(tmp_path / 'other.db')], 3) == (8, 0, 0) # merging again changes nothing
+	with pytest.raises(FeedParserException):
+		Tree.db_merge(destination, [str(tmp_path / 'missing.db')], 3)
+	assert not (tmp_path / 'missing.db').exists()
+	with pytest.raises(FeedParserException):
+		Tree.db_merge(destination, [str(tmp_path / 'cached_news.db')], 3)
+	destination.close()
+
+def test_db_migrate_drops_fragment_cache():
+	db = sqlite3.connect(':memory:')
+	db.execute("CREATE TABLE rendered_fragments (article_key TEXT PRIMARY KEY, row_hash TEXT, fragment TEXT, last_used REAL)")
+	Tree.db_migrate(db)
+	assert db.execute("SELECT name FROM sqlite_master WHERE name = 'rendered_fragments'").fetchone() is None
+	db.close()
+
+def test_news_query_server(tmp_path, ):
+	from rss_parser.rss_parser import NewsQueryServer
+	from urllib.request import urlopen as urlopen_
+	from urllib.error import HTTPError
+	import threading
+	db_filepath = str(tmp_path / 'cached_news.db')
+	db = sqlite3.connect(db_filepath)
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title=f'Title {i}', date=f'2022-05-2{i % 2}') for i in range(5)])
+	server = NewsQueryServer(('127.0.0.1', 0), db_filepath, pool_size=2, cache_size=8)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	url = f'http://127.0.0.1:{server.server_port}/news?date=2022-05-20&limit=2'
+	try:
+		with urlopen_(url) as response:
+			etag = response.headers['ETag']
+			page = json_module.loads(response.read())
+		assert [a['news_title'] for a in page['articles']] == ['Title 0', 'Title 2']
+		assert page['next_offset'] == 2
+		with pytest.raises(HTTPError) as e:
+			urlopen_(Request(url, headers={'If-None-Match': etag}))
+		assert e.value.code == 304
+		with urlopen_(f'{url}&offset=2') as response:
+			assert [a['news_title'] for a in json_module.loads(response.read())['articles']] == ['Title 4']
+		with db:
+			Tree.db_insert_many(db, [dict(dummy_dict, news_title='Title 5', date='2022-05-20')])
+		with urlopen_(f'{url}&offset=2') as response:
+			assert [a['news_title'] for a in json_module.loads(response.read())['articles']] == ['Title 4', 'Title 5']
+		for _ in range(2): # warm cache of both pool connections
+			with urlopen_(url) as response:
+				etag = response.headers['ETag']
+		with db: # rows changed in place and deleted leave max(rowid) as it was
+			db.execute("UPDATE cached_news SET news_title = 'Title 0 updated' WHERE news_title = 'Title 0'")
+			Tree.db_delete_rows(db, [db.execute("SELECT rowid FROM cached_news WHERE news_title = 'Title 4'").fetchone()[0]])
+		for _ in range(2):
+			with urlopen_(Request(url, headers={'If-None-Match': etag})) as response:
+				assert [a['news_title'] for a in json_module.loads(response.read())['articles']] == ['Title 0 updated', 'Title 2']
+		with urlopen_(f'{url}&offset=2') as response:
+			assert [a['news_title'] for a in json_module.loads(response.read())['articles']] == ['Title 5']
+		with pytest.raises(HTTPError) as e:
+			urlopen_(f'http://127.0.0.1:{server.server_port}/news?limit=-1')
+		assert e.value.code == 400
+	finally:
+		server.shutdown()
+		server.server_close()
+		db.close()
+
+@pytest.mark.parametrize(
+	('input_x', 'expected_profile', ),
+	(
+		(sample_xml_3, {'article_tag': 'item', 'description_tag': 'description', 'date_tag': 'pubDate', 'namespaces': {}, 'date_format': '%Y-%m-%dT%H:%M:%SZ'}),
+		(sample_prefix_xml_1, {'article_tag': 'entry', 'description_tag': 'summary', 'date_tag': 'updated', 
+								'namespaces': {'entry': 'http://www.w3.org/2005/Atom', 'summary': 'http://www.w3.org/2005/Atom', 'updated': 'http://www.w3.org/2005/Atom'}, 
+								'date_format': '%Y-%m-%dT%H:%M:%S%z'}),
+	)
+)
+def test_parse_feed_profile(input_x, expected_profile, ):
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	Tree.DB, Tree.URL, Tree.CACHE = db, 'https://example.com/feed', []
+	results = []
+	for run in range(2):
+		tree = object.__new__(Tree)
+		tree.response = Mock()
+		tree.response.read = Mock(side_effect=[input_x, b''])
+		with patch('rss_parser.rss_parser.Tree.collect_descendant_elements', autospec=True, side_effect=Tree.collect_descendant_elements) as mock_collect:
+			tree.parse_feed()
+		assert mock_collect.called == (run == 0) # second run uses saved profile
+		assert Tree.db_fetch_profile(db, Tree.URL) == expected_profile
+		results.append(Tree.CACHE)
+		Tree.CACHE = []
+	assert results[0] == results[1]
+	with db:
+		db.execute("UPDATE feed_profiles SET article_tag = 'article'") # profile stopped matching the feed
+	tree = object.__new__(Tree)
+	tree.response = Mock()
+	tree.response.read = Mock(side_effect=[input_x, b''])
+	tree.parse_feed()
+	assert Tree.CACHE == results[0]
+	assert Tree.db_fetch_profile(db, Tree.URL) == expected_profile
+	Tree.DB, Tree.URL, Tree.CACHE = None, None, []
+	db.close()
+
+@patch('rss_parser.rss_parser.Tree.__init__', return_value=None)
+def test_set_working_tags_deterministic(mock_init, ):
+	tree = Tree()
+	for tags in ({'entry', 'updated', 'published', 'summary'}, {'published', 'summary', 'updated', 'entry'}):
+		tree.ARTICLE = tree.DESCRIPTION = tree.DATE = None
+		tree._Tree__tags = tags
+		tree.set_working_tags()
+		assert (tree.ARTICLE, tree.DESCRIPTION, tree.DATE) == ('entry', 'summary', 'published')
+
+def test_pipe_bounded_queue():
+	produced = []
+	def produce():
+		for i in range(20):
+			produced.append(i)
+			yield i
+	consumed = []
+	for item in Tree.pipe(produce(), 2):
+		consumed.append(item)
+		time.sleep(0.01)
+		assert len(produced) <= len(consumed) + 4 # producer blocks on full queue
+	assert consumed == list(range(20))
+
+def test_pipe_reraises():
+	def produce():
+		yield 1
+		raise FeedParserException('broken feed')
+	with pytest.raises(FeedParserException):
+		list(Tree.pipe(produce(), 2))
+
+def test_tree_pipeline(tmp_path, capsys, ):
+	filepath = str(tmp_path / 'feed.xml')
+	with open(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	stored = []
+	def store_stage(database, articles):
+		for article in articles:
+			stored.append(article['news_title'])
+			yield article
+	with patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: stored.append('printed')), \
+			patch('rss_parser.rss_parser.Tree.store_stage', side_effect=store_stage):
+		Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, db_filepath=':memory:')
+	assert stored == ['Goodbye NYC: Census shows big city losses, Sunbelt gains', 'printed', 
+					'We may not want to admit it, but there’s truth in what the ESPN crew said about Milwaukee. So what are we going to do about it?', 'printed']
+	Tree.URL, Tree.CACHE = None, []
+
+def test_store_stage_updates_derived_per_batch():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	articles = [dict(dummy_dict, news_title=f'Title {i}', news_url=f'https://a.com/{i} (link)') for i in range(250)]
+	with patch('rss_parser.rss_parser.Tree.db_cluster_new', wraps=Tree.db_cluster_new) as mock_cluster, \
+			patch('rss_parser.rss_parser.Tree.db_update_digests', wraps=Tree.db_update_digests) as mock_digests:
+		assert len(list(Tree.store_stage(db, articles))) == 250
+	assert mock_cluster.call_count == mock_digests.call_count == 3 # after 100 and 200 articles and when stream ends
+	assert db.execute("SELECT COUNT(*) FROM news_simhash").fetchone() == (250, )
+	assert db.execute("SELECT articles FROM daily_digests").fetchone() == (250, )
+	db.close()
+
+@pytest.mark.parametrize(
+	('format_', 'expected', ),
+	(
+		('tsv', 'news_date\tnews_feed_title\tnews_src\tnews_title\tnews_description\tnews_url\n'
+				'Default news_date value\tfeed\tDefault src value\tDefault title value\tline 1\\nline\\t2\tDefault url value\n'),
+		('csv', 'news_date,news_feed_title,news_src,news_title,news_description,news_url\r\n'
+				'Default news_date value,feed,Default src value,Default title value,"line 1\nline\t2",Default url value\r\n'),
+		('plain', 'Feed: feed \nSource: Default src value \nTitle: Default title value \nDate: Default news_date value \n'
+				'line 1\nline\t2\nLinks: Default url value\n\n\n'),
+	)
+)
+def test_print_news_format(capsys, format_, expected, ):
+	Tree.JSON, Tree.FORMAT = False, format_
+	Tree.open_output()
+	assert not Tree.COLOR
+	Tree.print_news({'news_title': 'Default title value', 'news_url': 'Default url value', 'news_src': 'Default src value', 
+					'news_description': 'line 1\nline\t2', 'news_date': 'Default news_date value', 'date': 'Default date value', 'news_feed_title': 'feed'})
+	Tree.close_output()
+	Tree.FORMAT = None
+	out, err = capsys.readouterr()
+	assert out == expected
+	assert '\x1b[' not in out
+
+def test_db_iter_news():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title=f'Title {i}', news_src=f'https://source-{i % 2}.com') for i in range(7)])
+	with patch('rss_parser.rss_parser.Tree.BATCH_SIZE', 2):
+		assert len(list(Tree.db_iter_news(db, None, None))) == 7
+		assert [a['news_title'] for a in Tree.db_iter_news(db, 'news_src', "source-1")] == ['Title 1', 'Title 3', 'Title 5']
+		assert list(Tree.db_iter_news(db, 'news_src', "' OR 1=1 --")) == []
+	db.close()
+
+def test_limit_stage_stops_upstream():
+	parsed = []
+	closed = threading.Event()
+	def produce():
+		try:
+			for i in range(100):
+				parsed.append(i)
+				yield i
+		finally:
+			closed.set()
+	limited = Tree.limit_stage(Tree.pipe(produce(), 1), 2)
+	assert [next(limited), next(limited)] == [0, 1]
+	assert closed.wait(2) # pipe thread stopped and closed its feed once the last article was taken
+	assert len(parsed) <= 3
+	assert list(limited) == []
+	assert list(Tree.limit_stage(Tree.pipe(produce(), 1), 0)) == []
+	assert list(Tree.limit_stage(iter(range(3)), -1)) == [0, 1, 2]
+
+def test_tree_limit_latest(tmp_path, ):
+	filepath = str(tmp_path / 'feed.xml')
+	with open(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	printed = []
+	with patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: printed.append(article['news_date'])):
+		Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=1, filter_src=None, filter_date=None, db_filepath=':memory:')
+		assert len(printed) == 1 and Tree.LIMIT == 1
+		printed.clear()
+		Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, db_filepath=':memory:', latest=1)
+		assert printed == [max(printed)] and Tree.LIMIT == -1
+	Tree.URL, Tree.CACHE, Tree.LATEST = None, [], None
+
+@patch('rss_parser.rss_parser.Tree.article_to_html', return_value='div')
+def test_to_html_string_keeps_limit(mock_article_to_html, ):
+	Tree.ARTICLE_DIVS, Tree.LIMIT = '', 1
+	Tree.to_html_string([dict(dummy_dict), dict(dummy_dict)])
+	Tree.ARTICLE_DIVS = ''
+	Tree.to_html_string([dict(dummy_dict), dict(dummy_dict)])
+	assert Tree.LIMIT == 1 and mock_article_to_html.call_count == 2
+	Tree.ARTICLE_DIVS, Tree.LIMIT = '', -1
+
+def test_db_iter_news_limit_latest():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title=f'Title {i}', news_date=f'2022-05-0{i} 10:00:00') for i in range(1, 8)])
+	assert len(list(Tree.db_iter_news(db, None, None, 3))) == 3
+	assert [a['news_title'] for a in Tree.db_iter_news(db, None, None, -1, 2)] == ['Title 7', 'Title 6']
+	assert [a['news_title'] for a in Tree.db_iter_news(db, None, None, 1, 2)] == ['Title 7']
+	plan = db.execute("EXPLAIN QUERY PLAN SELECT news_title FROM cached_news ORDER BY news_date DESC LIMIT 2").fetchall()
+	assert 'cached_news_date' in str(plan)
+	db.close()
+
+@pytest.mark.parametrize(
+	('url', 'expected', ),
+	(
+		('HTTPS://News.Yahoo.COM/story.html?b=2&utm_source=rss&a=1#comments', 'https://news.yahoo.com/story.html?a=1&b=2'),
+		('http://example.com:80?fbclid=abc&ncid=x', 'http://example.com/'),
+		('https://example.com:8443/a?UTM_Medium=feed', 'https://example.com:8443/a'),
+		('/relative/path', '/relative/path'),
+	)
+)
+def test_canonical_url(url, expected, ):
+	assert Tree.canonical_url(url) == expected
+
+def test_db_insert_cross_source_duplicates():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [
+			dict(dummy_dict, news_title='Story', news_src='https://a.com', news_url='https://wire.com/story?utm_source=a (link)'), 
+			dict(dummy_dict, news_title='Story (updated)', news_src='https://b.com', news_url='https://WIRE.com/story?utm_source=b#top (link)'), 
+			dict(dummy_dict, news_title='Other story', news_src='https://b.com', news_url='https://wire.com/other (link)'), 
+			dict(dummy_dict, news_title='No link', news_url='https://img.com/1.jpg (content)'), 
+			dict(dummy_dict, news_title='No link either', news_url='https://img.com/1.jpg (content)'), 
+		])
+	assert [row[0] for row in db.execute("SELECT news_link FROM cached_news ORDER BY rowid")] == ['https://wire.com/story', 'https://wire.com/other', None, None]
+	plan = db.execute("EXPLAIN QUERY PLAN SELECT 1 FROM cached_news WHERE news_link = ?", ('x', )).fetchall()
+	assert 'cached_news_link' in str(plan)
+	db.close()
+
+def test_db_migrate_adds_news_link():
+	db = sqlite3.connect(':memory:')
+	db.execute("""CREATE TABLE cached_news (date TEXT, news_feed_title TEXT, news_src TEXT, news_title TEXT, 
+				news_date TEXT, news_description TEXT, news_url TEXT)""")
+	db.executemany("INSERT INTO cached_news VALUES (?, ?, ?, ?, ?, ?, ?)", [
+		('2022-05-01', 'feed', 'https://a.com', 'A', '2022-05-01', '', 'https://wire.com/story?utm_campaign=x (link)'), 
+		('2022-05-01', 'feed', 'https://b.com', 'B', '2022-05-01', '', 'https://wire.com/story (link)'), 
+	])
+	db.commit()
+	Tree.db_migrate(db)
+	assert [row[0] for row in db.execute("SELECT news_link FROM cached_news ORDER BY rowid")] == ['https://wire.com/story', None]
+	assert [row[0] for row in db.execute("SELECT news_ts FROM cached_news ORDER BY rowid")] == [1651363200, 1651363200]
+	db.close()
+
+@patch('rss_parser.rss_parser.Tree.__init__', return_value=None)
+def test_parse_a_canonical_dedup(mock_init, ):
+	tree = Tree()
+	dict_ = {'news_url': 'https://example.com/a (link)'}
+	for href in ('https://example.com/a?utm_source=rss', 'https://EXAMPLE.com/a#x', 'https://example.com/b', 'https://example.com/a'):
+		node = MagicMock()
+		node.attrib.__getitem__.return_value = href
+		tree.parse_a(node, dict_)
+	assert dict_['news_url'] == 'https://example.com/a (link)\nhttps://example.com/b (link)'
+
+near_duplicate_titles = (
+	'Goodbye NYC: Census shows big city losses, Sunbelt gains. The census data released Tuesday shows New York lost residents',
+	'Goodbye NYC: Census shows big city losses, Sunbelt gains. The census data released on Tuesday shows New York lost residents',
+	'Stocks rally as inflation cools and the Federal Reserve signals a slower pace of interest rate increases',
+)
+
+def test_simhash():
+	first, edited, other = (Tree.simhash(title) for title in near_duplicate_titles)
+	assert first < 2 ** 64
+	assert Tree.hamming(first, edited) <= Tree.SIMHASH_DISTANCE < Tree.hamming(first, other)
+	assert set(Tree.simhash_bands(first)) & set(Tree.simhash_bands(edited))
+	for text in near_duplicate_titles + ('', 'one', 'one two', 'a b c d e f g h i j k ' * 20):
+		words = Tree.word_pattern.findall(text.lower())
+		hashes = [int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big') for word in words]
+		expected = sum(1 << bit for bit in range(64) if sum(value >> bit & 1 for value in hashes) * 2 > len(words))
+		assert Tree.simhash(text) == expected
+
+def test_collapse_stage():
+	articles = [dict(dummy_dict, news_title=title, news_description='') for title in near_duplicate_titles]
+	assert [a['news_title'] for a in Tree.collapse_stage(articles)] == [near_duplicate_titles[0], near_duplicate_titles[2]]
+
+@pytest.mark.parametrize(
+	('batches', ),
+	(
+		((1, 1, 1), ),
+		((3, ), ),
+		((1, 2), ),
+		((2, 1), ),
+	)
+)
+def test_db_cluster_collapse(batches, ):
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	articles = iter([dict(dummy_dict, news_title=title, news_description='', news_url=f'https://{len(title)}.com (link)') 
+					for title in near_duplicate_titles])
+	for size in batches: # earlier rows of the batch are matched in memory, earlier batches through simhash_bands
+		with db:
+			Tree.db_insert_many(db, list(itertools.islice(articles, size)))
+	assert db.execute("SELECT news_id, cluster FROM news_simhash ORDER BY news_id").fetchall() == [(1, 1), (2, 1), (3, 3)]
+	assert len(list(Tree.db_iter_news(db, None, None))) == 3
+	assert [a['news_title'] for a in Tree.db_iter_news(db, 'news_src', 'Default', collapse=True)] == [near_duplicate_titles[0], near_duplicate_titles[2]]
+	plan = db.execute("EXPLAIN QUERY PLAN SELECT news_id FROM simhash_bands WHERE (band = 0 AND value = 1) OR (band = 1 AND value = 2)").fetchall()
+	assert 'simhash_bands_value' in str(plan)
+	plan = db.execute("EXPLAIN QUERY PLAN SELECT rowid FROM cached_news WHERE NOT EXISTS "
+					"(SELECT 1 FROM news_simhash WHERE news_id = cached_news.rowid AND cluster != news_id)").fetchall()
+	assert 'SCAN news_simhash' not in str(plan) and 'news_simhash USING INTEGER PRIMARY KEY' in str(plan)
+	db.close()
+
+def test_db_cluster_lazy():
+	description = 'Markets rallied on Tuesday as investors welcomed the central bank decision'
+	markup = f'<div class="story" style="margin: 0"><p><a href="https://a.com/x"><b>{description}</b></a></p></div>'
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title='Stocks up', news_description=description, news_url='https://a.com (link)'), 
+								dict(dummy_dict, news_title='Stocks up!', news_description=markup, news_extract='text', news_url='https://b.com (link)')])
+	simhashes = [simhash for simhash, in db.execute("SELECT simhash FROM news_simhash ORDER BY news_id")]
+	assert simhashes[0] == simhashes[1]
+	assert db.execute("SELECT cluster FROM news_simhash ORDER BY news_id").fetchall() == [(1, ), (1, )]
+	db.close()
+	articles = [dict(dummy_dict, news_title='Stocks up', news_description=description), 
+				dict(dummy_dict, news_title='Stocks up', news_description=markup, news_extract='full:html')]
+	assert len(list(Tree.collapse_stage(articles))) == 1
+
+def test_db_compress_zstd_missing():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_description='<p>Paragraph of a syndicated story.</p>' * 20)])
+	with patch('rss_parser.rss_parser.zstandard', None):
+		with pytest.raises(FeedParserException, match=r'rss_parser\[zstd\]'):
+			Tree.db_compress(db, 'zstd', 50)
+		with pytest.raises(FeedParserException, match=r'rss_parser\[zstd\]'):
+			Tree.db_train_dict(db)
+	assert Tree.db_compression(db) == ('none', 0)
+	db.close()
+
+@pytest.mark.parametrize(
+	('codec', ),
+	(
+		('zlib', ),
+		('zstd', ),
+	)
+)
+def test_db_compress(codec, ):
+	if codec == 'zstd':
+		pytest.importorskip('zstandard')
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	articles = [dict(dummy_dict, news_title=f'Title {i}', news_url=f'https://a.com/{i} (link)', 
+					news_description=f'<div class="story"><p>Paragraph {i} of a syndicated story.</p></div>' * (i % 20)) for i in range(300)]
+	with db:
+		Tree.db_insert_many(db, articles[:200])
+	raw, stored = Tree.db_compress(db, codec, 50)
+	assert stored < raw
+	with db:
+		Tree.db_insert_many(db, articles[200:])
+	assert [a['news_description'] for a in Tree.db_iter_news(db, None, None)] == [a['news_description'] for a in articles]
+	assert db.execute("SELECT count(*) FROM cached_news WHERE typeof(news_description) = 'blob'").fetchone()[0] > 200
+	raw, stored = Tree.db_compress(db, 'none', 50)
+	assert stored == raw
+	assert db.execute("SELECT count(*) FROM cached_news WHERE typeof(news_description) = 'blob'").fetchone()[0] == 0
+	db.close()
+
+def test_pack_description():
+	short, long_ = 'short', 'long description ' * 100
+	assert Tree.pack_description(None, short, 'zlib') == short
+	assert Tree.pack_description(None, long_, 'none') == long_
+	packed = Tree.pack_description(None, long_, 'zlib')
+	assert isinstance(packed, bytes) and len(packed) < len(long_)
+	assert Tree.unpack_description(None, packed) == long_
+	assert Tree.unpack_description(None, short) == short
+
+def timeline_feed(name: str, hours: list) -> bytes:
+	items = ''.join(f'<item><title>{name} {hour}</title><link>https://{name}.com/{hour}</link>'
+					f'<pubDate>2022-05-26T{hour:02}:00:00Z</pubDate><description>story</description></item>' for hour in hours)
+	return f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>{name}</title>{items}</channel></rss>'.encode('utf-8')
+
+def test_tree_timeline(tmp_path, ):
+	sources = []
+	for name, hours in (('a', [9, 3, 1]), ('b', [8, 2]), ('c', [2])):
+		sources.append(str(tmp_path / f'{name}.xml'))
+		with open(sources[-1], 'wb') as file:
+			file.write(timeline_feed(name, hours))
+	printed = []
+	with patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: printed.append((article['news_title'], article['news_src']))), \
+			patch('rss_parser.rss_parser.Tree.pipe_many', side_effect=Tree.pipe_many) as mock_pipe_many, \
+			patch('rss_parser.rss_parser.Tree.FETCH_WORKERS', 2):
+		Tree(sources, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, db_filepath=':memory:', timeline=True)
+	assert mock_pipe_many.call_args.args[1] == 2 # feeds are fetched by the bounded pool
+	assert printed == [('a 1', sources[0]), ('b 2', sources[1]), ('c 2', sources[2]), ('a 3', sources[0]), ('b 8', sources[1]), 
+						('a 9', sources[0])]
+	Tree.URL, Tree.CACHE, Tree.TIMELINE = None, [], False
+
+def test_db_iter_news_timeline():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [dict(dummy_dict, news_title=f'Title {day}', news_date=date_) for day, date_ in 
+								((3, '2022-05-03 10:00:00'), (1, '2022-05-01'), (2, '2022-05-02 00:30:00'))])
+	assert [a['news_title'] for a in Tree.db_iter_news(db, None, None, timeline=True)] == ['Title 1', 'Title 2', 'Title 3']
+	plan = db.execute("EXPLAIN QUERY PLAN SELECT news_title FROM cached_news ORDER BY news_ts, rowid").fetchall()
+	assert 'cached_news_ts' in str(plan)
+	db.close()
+
+@pytest.mark.parametrize(
+	('news_date', 'expected', ),
+	(
+		('2022-05-26 04:13:38', 1653538418),
+		('2022-05-26', 1653523200),
+		(date(2022, 5, 26), 1653523200),
+		('Thu, 26 May 2022 04:13:38', 1653538418),
+		('not a date', 0),
+	)
+)
+def test_timestamp(news_date, expected, ):
+	assert Tree.timestamp(news_date) == expected
+
+malformed_xml = (b'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Broken feed</title><!-- comment -->'
+				b'<item><title>Tom & Jerry</title><link>https://a.com/1</link><pubDate>2022-05-26T04:13:38Z</pubDate><description>one</description></item>'
+				b'<item><title>Caf\xe9</title><link>https://a.com/2</link><pubDate>2022-05-26T05:13:38Z</pubDate><description>two</description></item>'
+				b'</channel></rss>')
+
+@pytest.mark.parametrize(
+	('backend', 'profile', ),
+	(
+		('etree', None),
+		('lxml', None),
+		('lxml', {'article_tag': 'item', 'description_tag': 'description', 'date_tag': 'pubDate', 'namespaces': {}, 'date_format': None}),
+	)
+)
+def test_xml_backend(backend, profile, ):
+	Tree.BACKEND = backend
+	try:
+		reference = object.__new__(Tree)
+		reference.response = io.BytesIO(sample_xml_3)
+		tree = object.__new__(Tree)
+		tree.response = io.BytesIO(sample_xml_3)
+		Tree.BACKEND = 'etree'
+		expected = list(reference.iter_feed(None))
+		Tree.BACKEND = backend
+		assert list(tree.iter_feed(profile)) == expected
+	finally:
+		Tree.BACKEND = 'etree'
+
+def test_xml_backend_recover():
+	tree = object.__new__(Tree)
+	tree.response = io.BytesIO(malformed_xml)
+	with pytest.raises(FeedParserException):
+		list(tree.iter_feed(None))
+	Tree.BACKEND = 'lxml'
+	try:
+		tree.response = io.BytesIO(malformed_xml)
+		assert [a['news_title'] for a in tree.iter_feed(None)] == ['Tom  Jerry', 'Caf�']
+		response = MagicMock()
+		response.read.side_effect = [malformed_xml, b'']
+		response.headers = HTTPMessage()
+		response.headers['Content-Type'] = 'application/rss+xml; charset=ISO-8859-1'
+		tree.response = response
+		assert [a['news_title'] for a in tree.iter_feed(None)] == ['Tom  Jerry', 'Caf\xe9']
+	finally:
+		Tree.BACKEND = 'etree'
+
+@pytest.mark.parametrize(
+	('extract', ),
+	(
+		('none', ),
+		('text', ),
+		('full', ),
+	)
+)
+def test_lazy_extraction(extract, ):
+	Tree.EXTRACT = extract
+	try:
+		eager = object.__new__(Tree)
+		eager.response = io.BytesIO(sample_prefix_xml_1)
+		expected = list(eager.iter_feed(None))
+		Tree.LAZY = True
+		lazy = object.__new__(Tree)
+		lazy.response = io.BytesIO(sample_prefix_xml_1)
+		stored = list(lazy.iter_feed(None))
+	finally:
+		Tree.EXTRACT, Tree.LAZY = 'full', False
+	if extract == 'none':
+		assert stored == expected and expected[0]['news_description'] == ''
+	else:
+		assert stored[0]['news_extract'] == f'{extract}:html' and '<p>' in stored[0]['news_description']
+		assert list(Tree.extract_stage(stored)) == expected
+	if extract == 'text':
+		assert expected[0]['news_description'].startswith('UNITED NATIONS, May 30 (IPS)')
+		assert 'Secretary-General-Amina_.jpg (content)' not in expected[0]['news_url']
+
+def test_lazy_extraction_db():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	raw = dict(dummy_dict, news_description='<p>Hello <a href="https://a.com/more">world</a></p>', news_url='https://a.com (link)', news_extract='full')
+	with db:
+		Tree.db_insert_many(db, [raw])
+	stored = list(Tree.db_iter_news(db, None, None))
+	assert stored[0]['news_extract'] == 'full'
+	assert list(Tree.extract_stage(stored)) == [dict(dummy_dict, news_description='Hello world', news_url='https://a.com (link)\nhttps://a.com/more (link)')]
+	db.close()
+
+@pytest.mark.parametrize(
+	('error', 'expected', ),
+	(
+		(URLError(ConnectionRefusedError()), True),
+		(URLError(socket.timeout()), True),
+		(URLError(socket.gaierror()), False),
+		(HTTPError('https://a.com', 503, 'Service Unavailable', None, None), True),
+		(HTTPError('https://a.com', 404, 'Not Found', None, None), False),
+		(FeedParserException(TimeoutError()), True),
+		(FeedParserException(ValueError('unknown url type')), False),
+	)
+)
+def test_is_transient(error, expected, ):
+	assert Tree.is_transient(error) == expected
+
+@patch('rss_parser.rss_parser.time.sleep')
+def test_fetch_retries_and_breaker(mock_sleep, ):
+	Tree.BREAKERS, Tree.BREAKERS_CHANGED, Tree.SCHEDULER = {}, set(), None
+	transient = FeedParserException(URLError(ConnectionResetError()))
+	response = io.BytesIO()
+	with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=[transient, transient, response]) as mock_connection:
+		assert Tree.fetch('https://a.com/rss') is response
+		assert mock_connection.call_count == 3 and mock_sleep.call_count == 2
+	assert all(0 <= c.args[0] <= Tree.BACKOFF * 2 ** i for i, c in enumerate(mock_sleep.call_args_list))
+	with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=transient) as mock_connection:
+		for _ in range(Tree.BREAKER_THRESHOLD):
+			with pytest.raises(FeedParserException):
+				Tree.fetch('https://a.com/rss')
+		assert mock_connection.call_count == Tree.BREAKER_THRESHOLD * (Tree.RETRIES + 1)
+		with pytest.raises(FeedParserException, match='Circuit breaker'):
+			Tree.fetch('https://a.com/other')
+		assert mock_connection.call_count == Tree.BREAKER_THRESHOLD * (Tree.RETRIES + 1)
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	Tree.db_store_breakers(db)
+	failures, open_until = Tree.db_fetch_breakers(db)['a.com']
+	assert failures == Tree.BREAKER_THRESHOLD and open_until > time.time()
+	db.close()
+	Tree.BREAKERS = {}
+
+@pytest.mark.parametrize(
+	('drip', 'transfer_timeout', 'deadline', ),
+	(
+		(0.05, 0.5, None), 	# trickles 1 byte every 50 ms
+		(60.0, 30, 0.5), 	# stalls after first byte
+	)
+)
+def test_read_chunks_slow_drip(drip, transfer_timeout, deadline, ):
+	from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+	stop = threading.Event()
+	class SlowDripHandler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+		def do_GET(self):
+			self.send_response(200)
+			self.send_header('Content-Length', '1000')
+			self.end_headers()
+			try:
+				for _ in range(1000):
+					self.wfile.write(b'x')
+					self.wfile.flush()
+					if stop.wait(drip):
+						return
+			except OSError:
+				pass
+		def log_message(self, format, *args):
+			pass
+	server = ThreadingHTTPServer(('127.0.0.1', 0), SlowDripHandler)
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	Tree.BREAKERS, Tree.BREAKERS_CHANGED, Tree.SCHEDULER = {}, set(), None
+	try:
+		with patch('rss_parser.rss_parser.Tree.TRANSFER_TIMEOUT', transfer_timeout):
+			started = time.monotonic()
+			Tree.DEADLINE_AT = started + deadline if deadline is not None else None
+			with pytest.raises(FeedParserException, match='longer than|Deadline'):
+				list(Tree.read_chunks(Tree.fetch(f'http://127.0.0.1:{server.server_port}/feed.xml')))
+			assert time.monotonic() - started < 1.5 # not when the full chunk arrives or Tree.TIMEOUT passes
+	finally:
+		Tree.DEADLINE_AT, Tree.BREAKERS, Tree.BREAKERS_CHANGED = None, {}, set()
+		stop.set()
+		server.shutdown()
+		server.server_close()
+
+def test_body_read_failure_opens_breaker():
+	import http.client
+	Tree.BREAKERS, Tree.BREAKERS_CHANGED, Tree.SCHEDULER = {}, set(), None
+	def response(body, error=None):
+		stream = io.BytesIO(body)
+		if error is not None: # connection breaks off after first chunk
+			stream.read1 = Mock(side_effect=[body[:10], error])
+		return stream
+	with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=lambda *args: response(sample_xml_3)):
+		assert b''.join(Tree.read_chunks(Tree.fetch('https://a.com/rss'))) == sample_xml_3
+	assert Tree.BREAKERS.get('a.com', (0, 0))[0] == 0
+	broken = http.client.IncompleteRead(b'partial')
+	with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=lambda *args: response(sample_xml_3, broken)) as mock_connection:
+		for failures in range(1, Tree.BREAKER_THRESHOLD + 1):
+			with pytest.raises(FeedParserException):
+				list(Tree.read_chunks(Tree.fetch('https://a.com/rss')))
+			assert Tree.BREAKERS['a.com'][0] == failures
+		with pytest.raises(FeedParserException, match='Circuit breaker'):
+			Tree.fetch('https://a.com/rss')
+		assert mock_connection.call_count == Tree.BREAKER_THRESHOLD
+	Tree.BREAKERS, Tree.BREAKERS_CHANGED = {}, set()
+
+def test_fetch_deadline():
+	Tree.DEADLINE_AT = time.monotonic() - 1
+	try:
+		with patch('rss_parser.rss_parser.Tree.establish_connection') as mock_connection:
+			with pytest.raises(FeedParserException, match='Deadline'):
+				Tree.fetch('https://a.com/rss')
+			assert not mock_connection.called
+	finally:
+		Tree.DEADLINE_AT = None
+
+def test_tree_skips_failing_source(tmp_path, capsys, ):
+	filepath = str(tmp_path / 'feed.xml')
+	with open(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	printed = []
+	with patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: printed.append(article['news_src'])), \
+			patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=FeedParserException(URLError(socket.gaierror()))):
+		Tree(['https://dead.example.com/rss', filepath], json_=True, html_filepath=None, pdf_filepath=None, limit=-1, 
+			filter_src=None, filter_date=None, db_filepath=':memory:')
+	assert printed == [filepath, filepath]
+	assert 'Skipping https://dead.example.com/rss' in capsys.readouterr().err
+	Tree.URL, Tree.CACHE, Tree.BREAKERS, Tree.SCHEDULER = None, [], {}, None
+
+def test_host_scheduler_token_bucket():
+	scheduler = HostScheduler(per_host=1, rate=20.0, burst=2)
+	start = time.monotonic()
+	for _ in range(4):
+		assert scheduler.throttle('a.com')
+	assert scheduler.throttle('b.com')
+	assert 0.09 <= time.monotonic() - start < 0.5
+	assert not scheduler.throttle('a.com', timeout=0.001)
+	scheduler.defer('b.com', 5)
+	assert not scheduler.throttle('b.com', timeout=1)
+
+def test_host_scheduler_slot():
+	scheduler = HostScheduler(per_host=2, rate=100.0)
+	active, peak, lock = [0], [0], threading.Lock()
+
+	def fetch():
+		with scheduler.slot('a.com'):
+			with lock:
+				active[0] += 1
+				peak[0] = max(peak[0], active[0])
+			time.sleep(0.02)
+			with lock:
+				active[0] -= 1
+
+	threads = [threading.Thread(target=fetch) for _ in range(6)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert peak[0] == 2 and scheduler.active['a.com'] == 0
+
+@pytest.mark.parametrize(
+	('headers', 'code', 'expected', ),
+	(
+		({'Retry-After': '120'}, 429, 120.0),
+		({}, 429, None),
+		({'Retry-After': 'soon'}, 503, None),
+	)
+)
+def test_retry_after(headers, code, expected, ):
+	message = HTTPMessage()
+	for key, value in headers.items():
+		message[key] = value
+	error = HTTPError('https://a.com', code, 'Too Many Requests', message, None)
+	assert Tree.retry_after(FeedParserException(error)) == expected
+
+@patch('rss_parser.rss_parser.time.sleep')
+def test_fetch_honors_retry_after(mock_sleep, ):
+	Tree.BREAKERS, Tree.SCHEDULER = {}, HostScheduler()
+	message = HTTPMessage()
+	message['Retry-After'] = '1'
+	throttled = FeedParserException(HTTPError('https://a.com/rss', 429, 'Too Many Requests', message, None))
+	try:
+		response = io.BytesIO()
+		with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=[throttled, response]):
+			assert Tree.fetch('https://a.com/rss') is response
+		assert mock_sleep.call_args.args[0] >= 1 and 'a.com' in Tree.SCHEDULER.not_before
+		message.replace_header('Retry-After', '3600') # cut to Tree.BACKOFF_MAX and retried
+		with patch('rss_parser.rss_parser.Tree.establish_connection', side_effect=throttled) as mock_connection, \
+				patch('rss_parser.rss_parser.Tree.BACKOFF_MAX', 0.01):
+			with pytest.raises(FeedParserException):
+				Tree.fetch('https://b.com/rss')
+			assert mock_connection.call_count == Tree.RETRIES + 1
+			assert all(sleep.args[0] <= 0.01 for sleep in mock_sleep.call_args_list[1:])
+		assert Tree.BREAKERS['b.com'][0] == 1
+	finally:
+		Tree.BREAKERS, Tree.SCHEDULER = {}, None
+
+def test_record_fetch_threads():
+	Tree.BREAKERS, Tree.BREAKERS_CHANGED = {}, set()
+	switch_interval = sys.getswitchinterval()
+	sys.setswitchinterval(1e-6)
+	try:
+		with patch('rss_parser.rss_parser.Tree.BREAKER_THRESHOLD', 10 ** 6):
+			threads = [threading.Thread(target=lambda: [Tree.record_fetch('a.com', False) for _ in range(2000)]) for _ in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		assert Tree.BREAKERS['a.com'][0] == 16000 # no failure lost between reading and writing breaker of host
+	finally:
+		sys.setswitchinterval(switch_interval)
+		Tree.BREAKERS, Tree.BREAKERS_CHANGED = {}, set()
+
+def test_interleave_hosts():
+	sources = ['https://a.com/1', 'https://a.com/2', 'https://a.com/3', 'https://b.com/1', 'feed.xml', 'https://c.com/1', 'https://b.com/2']
+	assert Tree.interleave_hosts(sources) == ['https://a.com/1', 'https://b.com/1', 'feed.xml', 'https://c.com/1', 
+												'https://a.com/2', 'https://b.com/2', 'https://a.com/3']
+
+def test_pipe_many():
+	streams = [iter(range(i * 100, i * 100 + 50)) for i in range(5)]
+	assert sorted(Tree.pipe_many(streams, 3, 4)) == sorted(n for i in range(5) for n in range(i * 100, i * 100 + 50))
+
+	def failing():
+		yield 1
+		raise FeedParserException('broken feed')
+
+	with pytest.raises(FeedParserException, match='broken feed'):
+		list(Tree.pipe_many([failing(), iter(range(10))], 2, 4))
+
+def test_create_request_user_agent():
+	assert Tree.create_request('https://a.com/rss').get_header('User-agent') == Tree.USER_AGENT
+
+def digest_article(i: int, day: str, feed: str) -> dict:
+	return {'date': day, 'news_feed_title': feed, 'news_src': f'https://{feed}.com/rss', 'news_title': f'Story {i} about {feed} {day}', 
+			'news_date': f'{day} 10:00:0{i}', 'news_description': f'Description {i}', 'news_url': f'https://{feed}.com/{i} (link)'}
+
+def test_db_update_digests():
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [digest_article(1, '2022-05-26', 'a'), digest_article(2, '2022-05-27', 'a')])
+		Tree.db_insert_many(db, [digest_article(3, '2022-05-26', 'b'), digest_article(4, '2022-05-26', 'a')])
+	json_lines, article_divs = Tree.db_fetch_digest(db, '2022-05-26')
+	expected = list(Tree.db_iter_news(db, 'date', '2022-05-26'))
+	assert [json_module.loads(line) for line in json_lines] == expected
+	assert json_lines[0] == Tree.convert_to_json(expected[0])
+	assert article_divs.count('<h2>a</h2>') == 1 and article_divs.count('<h2>b</h2>') == 1
+	assert article_divs.index('Story 1') < article_divs.index('Story 3') < article_divs.index('Story 4')
+	assert db.execute("SELECT articles FROM daily_digests WHERE date = '2022-05-26'").fetchone()[0] == 3
+	assert Tree.db_fetch_digest(db, '2022-05-28') is None
+	json_lines, article_divs = Tree.db_fetch_digest(db, '2022-05-26', 1)
+	assert len(json_lines) == 1 and 'Story 3' not in article_divs
+	db.close()
+
+def test_serve_digest(capsys, ):
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	Tree.LAZY = True
+	try:
+		with db:
+			Tree.db_insert_many(db, [digest_article(i, '2022-05-26', 'a') for i in range(3)])
+	finally:
+		Tree.LAZY = False
+	assert Tree.db_fetch_digest(db, '2022-05-26') is None
+	Tree.DB, Tree.FILTER_K, Tree.FILTER_V, Tree.LIMIT, Tree.JSON = db, 'date', '2022-05-26', 2, True
+	try:
+		assert Tree.serve_digest()
+		printed = [json_module.loads(line) for line in capsys.readouterr().out.split('\n') if line]
+		assert printed == list(Tree.db_iter_news(db, 'date', '2022-05-26', 2))
+		Tree.FILTER_V = '2022-05'
+		assert not Tree.serve_digest()
+		Tree.FILTER_V, Tree.LATEST = '2022-05-26', 1
+		assert not Tree.serve_digest()
+	finally:
+		Tree.DB, Tree.FILTER_K, Tree.FILTER_V, Tree.LIMIT, Tree.JSON, Tree.LATEST = None, None, None, None, None, None
+	db.close()
+
+@contextlib.contextmanager
+def running_feed_server(**options):
+	server = FeedServer(('127.0.0.1', 0), **options)
+	server.start()
+	try:
+		yield server
+	finally:
+		server.shutdown()
+		server.server_close()
+
+def wait_for_responses(server, count: int) -> None:
+	# server records response after its last byte is sent, client may be done reading by then
+	deadline = time.monotonic() + 2
+	while sum(server.statuses.values()) < count and time.monotonic() < deadline:
+		time.sleep(0.01)
+
+@pytest.mark.parametrize(
+	('options', 'query', ),
+	(
+		({}, {}),
+		({'chunk': 500}, {}),
+		({'bandwidth': 200000}, {}),
+		({}, {'format': 'atom'}),
+		({'chunk': 1000}, {'items': 5, 'latency': 0.05}),
+	)
+)
+def test_network_get_xml_tree(options, query, ):
+	with running_feed_server(**options) as server:
+		tree = object.__new__(Tree)
+		tree.response = Tree.establish_connection(Tree.create_request(server.feed_url('news', **query)))
+		assert tree.response.status == 200
+		root = tree.get_xml_tree()
+		items = [element for element in root.iter() if element.tag in ('item', '{http://www.w3.org/2005/Atom}entry')]
+		assert len(items) == query.get('items', 20)
+		wait_for_responses(server, 1)
+		assert server.statuses[200] == 1
+		assert server.durations[0] >= query.get('latency', 0)
+
+def test_network_gzip_and_etag():
+	with running_feed_server(gzip_=True) as server:
+		url = server.feed_url('news')
+		plain = Tree.establish_connection(Tree.create_request(url))
+		body, etag = plain.read(), plain.headers['ETag']
+		request = Tree.create_request(url)
+		request.add_header('Accept-Encoding', 'gzip')
+		compressed = Tree.establish_connection(request)
+		assert compressed.headers['Content-Encoding'] == 'gzip' and gzip.decompress(compressed.read()) == body
+		request = Tree.create_request(url)
+		request.add_header('If-None-Match', etag)
+		with pytest.raises(FeedParserException) as e:
+			Tree.establish_connection(request)
+		assert e.value.args[0].code == 304
+		wait_for_responses(server, 3)
+		assert server.statuses == {200: 2, 304: 1}
+
+@patch('rss_parser.rss_parser.time.sleep')
+def test_network_fetch_failures(mock_sleep, ):
+	Tree.BREAKERS, Tree.SCHEDULER = {}, None
+	with running_feed_server(fail=1.0, status=503, retry_after=1) as server:
+		with pytest.raises(FeedParserException):
+			Tree.fetch(server.feed_url('news'))
+		wait_for_responses(server, Tree.RETRIES + 1)
+		assert server.statuses[503] == Tree.RETRIES + 1
+		# time.sleep is patched for every module, wait_for_responses sleeps are counted too
+		assert sum(c.args[0] >= 1 for c in mock_sleep.call_args_list) == Tree.RETRIES
+		with pytest.raises(FeedParserException):
+			Tree.fetch(server.feed_url('news').replace('/feeds/', '/missing/'))
+		wait_for_responses(server, Tree.RETRIES + 2)
+		assert server.statuses[404] == 1
+	Tree.BREAKERS = {}
+
+def test_network_tree_end_to_end():
+	printed = []
+	with running_feed_server(items=5, latency=0.01) as server, \
+			patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: printed.append(article['news_src'])):
+		urls = [server.feed_url(f'feed{i}') for i in range(6)]
+		Tree(urls, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, 
+			db_filepath=':memory:', per_host=3, host_rate=1000)
+		wait_for_responses(server, 6)
+		assert server.statuses == {200: 6}
+	assert sorted(printed) == sorted(url for url in urls for _ in range(5))
+	Tree.URL, Tree.CACHE, Tree.BREAKERS, Tree.SCHEDULER = None, [], {}, None
+
+# scaling regressions: work of size 4n must not take much more than 4 times work of size n, 
+# quadratic paths take 16 times as long. Timings are best of repeated runs, memory is peak traced by tracemalloc
+SCALING_FACTOR = 4
+SCALING_SLACK = 2
+
+def measure(run, size: int, repeat: int, memory: bool) -> tuple[float, int]:
+	"""Returns tuple (best seconds of repeat runs, peak traced bytes or None) of run(size)"""
+	seconds = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		run(size)
+		seconds.append(time.perf_counter() - start)
+	if not memory:
+		return min(seconds), None
+	tracemalloc.start()
+	try:
+		run(size)
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return min(seconds), peak
+
+def assert_linear(run, size: int, repeat: int = 3, memory: bool = True) -> None:
+	small_time, small_peak = measure(run, size, repeat, memory)
+	large_time, large_peak = measure(run, size * SCALING_FACTOR, repeat, memory)
+	assert large_time < small_time * SCALING_FACTOR * SCALING_SLACK, f"{small_time:.3f} s -> {large_time:.3f} s"
+	if memory:
+		assert large_peak < small_peak * SCALING_FACTOR * SCALING_SLACK, f"{small_peak} B -> {large_peak} B"
+
+def test_scaling_pipeline(tmp_path, ):
+	def run(items):
+		filepath = str(tmp_path / f'feed{items}.xml')
+		with open(filepath, 'wb') as file:
+			file.write(generate_feed('scaling', items, 'rss'))
+		printed = io.StringIO()
+		with contextlib.redirect_stdout(printed):
+			Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, db_filepath=':memory:')
+		assert printed.getvalue().count('\n{') == items
+		Tree.URL, Tree.CACHE = None, []
+	assert_linear(run, 100)
+
+def test_scaling_description_links():
+	def run(links):
+		element = ET.Element('description', {'type': 'html'})
+		element.text = ''.join(f'<p>Paragraph {i} <a href="https://a.com/story/{i}">link</a></p><img src="https://a.com/img/{i}.jpg"/>' 
+								for i in range(links))
+		dict_ = {}
+		object.__new__(Tree).extract_description(element, dict_)
+		assert dict_['news_url'].count('\n') == 2 * links - 1 and dict_['news_description'].count('\n') == links - 1
+	assert_linear(run, 4000)
+
+def test_scaling_to_html_string():
+	def run(articles):
+		Tree.ARTICLE_DIVS, Tree.PAGE_TITLE = '', 'title'
+		document = Tree.to_html_string([dict(dummy_dict, news_feed_title=f'Feed {i}', news_title=f'Title {i}', news_url='https://a.com (link)') 
+										for i in range(articles)])
+		assert document.count('<h2>') == articles
+		Tree.ARTICLE_DIVS = ''
+	Tree.LIMIT, Tree.DB = -1, None
+	assert_linear(run, 500)
+	Tree.LIMIT = None
+
+def test_scaling_db_insert_cached_one():
+	def run(rows):
+		db = sqlite3.connect(':memory:')
+		Tree.db_migrate(db)
+		Tree.CACHE = [dict(dummy_dict, news_title=f'Title {i}', news_url=f'https://a.com/{i} (link)') for i in range(rows)]
+		while Tree.CACHE:
+			Tree.db_insert_cached_one(db)
+		assert db.execute("SELECT COUNT(*) FROM cached_news").fetchone() == (rows, )
+		db.close()
+	# clustering of many similar rows and draining Tree.CACHE
+	assert_linear(run, 1000, repeat=1, memory=False)
+
+rdf_xml = (b'<?xml version="1.0"?><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns="http://purl.org/rss/1.0/" '
+			b'xmlns:dc="http://purl.org/dc/elements/1.1/"><channel rdf:about="https://a.com/"><title>RDF news</title><link>https://a.com/</link></channel>'
+			b'<item rdf:about="https://a.com/1"><title>First</title><link>https://a.com/1</link><description>one</description>'
+			b'<dc:date>2022-05-26T04:13:38Z</dc:date><dc:creator>Jane Roe</dc:creator></item></rdf:RDF>')
+atom_xml = (b'<?xml version="1.0"?><feed xmlns="http://www.w3.org/2005/Atom"><title>Atom news</title>'
+			b'<entry><title>First</title><link href="https://a.com/1"/><id>urn:uuid:1</id><updated>2022-05-26T04:13:38Z</updated>'
+			b'<author><name>Jane Roe</name></author><author><name>John Doe</name></author>'
+			b'<content type="html">&lt;p&gt;full text&lt;/p&gt;</content></entry></feed>')
+extensions_xml = (b'<?xml version="1.0"?><rss version="2.0" xmlns:media="http://search.yahoo.com/mrss/" '
+				b'xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:dc="http://purl.org/dc/elements/1.1/"><channel><title>RSS news</title>'
+				b'<item><title>First</title><link>https://a.com/1</link><guid isPermaLink="false">a-1</guid><pubDate>Thu, 26 May 2022 04:13:38 GMT</pubDate>'
+				b'<dc:date>2000-01-01</dc:date><author>jane@a.com (Jane Roe)</author><enclosure url="https://a.com/1.mp3" type="audio/mpeg"/>'
+				b'<media:thumbnail url="https://a.com/1.jpg"/><media:group><media:content url="https://a.com/1.mp4"/></media:group>'
+				b'<content:encoded><![CDATA[<p>full text</p>]]></content:encoded></item></channel></rss>')
+
+@pytest.mark.parametrize(
+	('feed', 'expected', ),
+	(
+		(rdf_xml, {'news_feed_title': 'RDF news', 'news_guid': 'https://a.com/1', 'news_author': 'Jane Roe', 
+					'news_date': '2022-05-26 04:13:38', 'news_description': 'one', 'news_url': 'https://a.com/1 (link)'}),
+		(atom_xml, {'news_feed_title': 'Atom news', 'news_guid': 'urn:uuid:1', 'news_author': 'Jane Roe, John Doe', 
+					'news_date': '2022-05-26 04:13:38', 'news_description': 'full text', 'news_url': 'https://a.com/1 (link)'}),
+		(extensions_xml, {'news_feed_title': 'RSS news', 'news_guid': 'a-1', 'news_author': 'jane@a.com (Jane Roe)', 
+					'news_date': '2022-05-26 04:13:38', 'news_description': 'full text', 
+					'news_url': 'https://a.com/1 (link)\nhttps://a.com/1.mp3 (content)\nhttps://a.com/1.jpg (content)\nhttps://a.com/1.mp4 (content)'}),
+	)
+)
+def test_element_dispatch(feed, expected, ):
+	tree = object.__new__(Tree)
+	tree.response = io.BytesIO(feed)
+	detected = list(tree.iter_feed(None))
+	profile = tree.profile()
+	tree.response = io.BytesIO(feed)
+	streamed = list(tree.iter_feed(profile))
+	assert streamed == detected and len(detected) == 1
+	assert {key: detected[0][key] for key in expected} == expected
+
+def test_element_dispatch_db():
+	tree = object.__new__(Tree)
+	tree.response = io.BytesIO(atom_xml)
+	articles = list(tree.iter_feed(None))
+	database = sqlite3.connect(':memory:')
+	Tree.db_migrate(database)
+	with database:
+		Tree.db_insert_many(database, articles)
+	row, = Tree.db_iter_news(database, None, None)
+	assert row['news_guid'] == 'urn:uuid:1' and row['news_author'] == 'Jane Roe, John Doe'
+	database.execute("UPDATE cached_news SET news_guid = NULL, news_author = NULL")
+	row, = Tree.db_iter_news(database, None, None)
+	assert 'news_guid' not in row and 'news_author' not in row
+	database.close()
+
+def test_feed_stream_unchanged_body(tmp_path, capsys, ):
+	filepath = str(tmp_path / 'feed.xml')
+	with open(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	database = sqlite3.connect(':memory:')
+	Tree.db_migrate(database)
+	assert Tree.db_fetch_state(database, filepath) is None
+	tree = object.__new__(Tree)
+	expected = list(tree.feed_stream(filepath, None))
+	assert expected and tree.state['body_sha256'] == hashlib.sha256(sample_xml_3).hexdigest()
+	Tree.DB = database
+	try:
+		tree.store_state()
+	finally:
+		Tree.DB = None
+	state = Tree.db_fetch_state(database, filepath)
+	assert state == tree.state
+	assert list(tree.feed_stream(filepath, None, state={'body_sha256': state['body_sha256']})) == []
+	assert tree.state is None
+	assert f'Unchanged {filepath}' in capsys.readouterr().err
+	with open(filepath, 'ab') as file:
+		file.write(b'\n')
+	assert list(tree.feed_stream(filepath, tree.profile(), state={'body_sha256': state['body_sha256']})) == expected
+	assert tree.state['body_sha256'] == hashlib.sha256(sample_xml_3 + b'\n').hexdigest()
+	# stream stopped before the end of feed (e.g. by --limit) is not a complete ingest
+	stream = tree.feed_stream(filepath, None)
+	next(stream)
+	stream.close()
+	assert tree.state is None
+	database.close()
+
+def test_feed_stream_content_length(capsys, ):
+	def response(body):
+		stream = io.BytesIO(body)
+		stream.headers = {'Content-Length': str(len(body))}
+		return stream
+	tree = object.__new__(Tree)
+	with patch('rss_parser.rss_parser.Tree.open_source', return_value=response(sample_xml_3)):
+		expected = list(tree.feed_stream('https://example.com/rss', None))
+	state = dict(tree.state, last_key=None, last_ts=None) # no high-water mark, so articles of changed body are all yielded
+	assert state['body_size'] == len(sample_xml_3)
+	changed = sample_xml_3 + b'\n'
+	with patch('rss_parser.rss_parser.Tree.open_source', return_value=response(changed)), \
+			patch('rss_parser.rss_parser.tempfile.SpooledTemporaryFile') as mock_spool:
+		assert list(tree.feed_stream('https://example.com/rss', None, state=state)) == expected
+	assert not mock_spool.called # body of other length is parsed while it streams in
+	assert tree.state['body_sha256'] == hashlib.sha256(changed).hexdigest()
+	with patch('rss_parser.rss_parser.Tree.open_source', return_value=response(sample_xml_3)), \
+			patch('rss_parser.rss_parser.Tree.SPOOL_SIZE', 1024):
+		assert list(tree.feed_stream('https://example.com/rss', None, state=state)) == []
+	assert 'Unchanged https://example.com/rss' in capsys.readouterr().err
+	start = sample_xml_3.index(b'<item>')
+	start = sample_xml_3.index(b'<title>', start) + len(b'<title>')
+	same_length = sample_xml_3[:start] + b'X' + sample_xml_3[start + 1:] # hashed, spooled on disk and replayed
+	with patch('rss_parser.rss_parser.Tree.open_source', return_value=response(same_length)), \
+			patch('rss_parser.rss_parser.Tree.SPOOL_SIZE', 1024):
+		articles = list(tree.feed_stream('https://example.com/rss', None, state=state))
+	assert len(articles) == len(expected) and articles[0]['news_title'].startswith('X')
+	assert tree.state['body_sha256'] == hashlib.sha256(same_length).hexdigest()
+
+def test_tree_skips_unchanged_feed(tmp_path, capsys, ):
+	filepath = str(tmp_path / 'feed.xml')
+	db_filepath = str(tmp_path / 'news.db')
+	with open(filepath, 'wb') as file:
+		file.write(sample_xml_3)
+	printed = []
+	with patch('rss_parser.rss_parser.Tree.print_news', side_effect=lambda article: printed.append(article['news_title'])), \
+			patch('rss_parser.rss_parser.Tree.db_insert_many', wraps=Tree.db_insert_many) as mock_insert:
+		for _ in range(2):
+			Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=-1, filter_src=None, filter_date=None, 
+				db_filepath=db_filepath)
+	assert printed and mock_insert.call_count == len(printed)
+	assert f'Unchanged {filepath}' in capsys.readouterr().err
+	Tree.URL, Tree.CACHE, Tree.BREAKERS, Tree.SCHEDULER = None, [], {}, None
+
+def test_tree_limited_run_keeps_feed_state(tmp_path, capsys, ):
+	filepath = str(tmp_path / 'feed.xml')
+	db_filepath = str(tmp_path / 'news.db')
+	with open(filepath, 'wb') as file:
+		file.write(generate_feed('limited', 10, 'rss'))
+	with patch('rss_parser.rss_parser.Tree.print_news'):
+		for limit in (2, -1):
+			Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=limit, filter_src=None, filter_date=None, 
+				db_filepath=db_filepath)
+	assert 'Unchanged' not in capsys.readouterr().err
+	db = sqlite3.connect(db_filepath)
+	assert db.execute("SELECT COUNT(*) FROM cached_news").fetchone() == (10, )
+	assert db.execute("SELECT body_sha256 FROM feed_state").fetchone() == (hashlib.sha256(generate_feed('limited', 10, 'rss')).hexdigest(), )
+	db.close()
+	Tree.URL, Tree.CACHE, Tree.BREAKERS, Tree.SCHEDULER = None, [], {}, None
+
+def prepend_items(feed: bytes, count: int) -> bytes:
+	"""Returns RSS feed generated by generate_feed with count newer items added before its items"""
+	items = ''.join(f'<item><title>breaking {i}</title><link>https://new.example.com/{i}.html</link><guid>new-{i}</guid>'
+					f'<pubDate>Fri, 27 May 2022 0{i}:00:00 GMT</pubDate><description>new</description></item>' for i in range(count))
+	head, _, tail = feed.partition(b'<item>')
+	return head + items.encode('utf-8') + b'<item>' + tail
+
+def test_tree_limited_run_keeps_high_water_mark(tmp_path, ):
+	filepath = str(tmp_path / 'feed.xml')
+	db_filepath = str(tmp_path / 'news.db')
+	items = [f'<item><title>story {i}</title><link>https://a.com/{i}</link><pubDate>2022-05-26T{14 - i:02}:00:00Z</pubDate></item>' 
+			for i in range(15)] # newest first
+	with patch('rss_parser.rss_parser.Tree.print_news'):
+		for start, limit in ((5, -1), (0, 2), (0, -1)):
+			with open(filepath, 'w') as file:
+				file.write(f'<rss><channel><title>a</title>{"".join(items[start:])}</channel></rss>')
+			Tree(filepath, json_=True, html_filepath=None, pdf_filepath=None, limit=limit, filter_src=None, filter_date=None, 
+				db_filepath=db_filepath)
+	db = sqlite3.connect(db_filepath)
+	assert db.execute("SELECT COUNT(*) FROM cached_news").fetchone() == (15, ) # stories 2-4 left out by --limit 2 are ingested
+	assert db.execute("SELECT last_key FROM feed_state").fetchone() == ('https://a.com/0', )
+	db.close()
+	Tree.URL, Tree.CACHE, Tree.BREAKERS, Tree.SCHEDULER = None, [], {}, None
+
+@pytest.mark.parametrize(
+	('new', 'reorder', 'parsed', ),
+	(
+		(3, False, 3 + Tree.HWM_MARGIN),
+		(0, False, Tree.HWM_MARGIN),
+		(3, True, 3 + Tree.HWM_MARGIN + 1),
+	)
+)
+def test_feed_stream_high_water_mark(tmp_path, new, reorder, parsed, ):
+	feed = generate_feed('hwm', 500, 'rss')
+	filepath = str(tmp_path / 'feed.xml')
+	with open(filepath, 'wb') as file:
+		file.write(feed)
+	tree = object.__new__(Tree)
+	first = list(tree.feed_stream(filepath, None))
+	state, profile = tree.state, tree.profile()
+	assert len(first) == 500 and state['last_key'] == 'https://hwm.example.com/0' and state['last_ts'] == Tree.timestamp(first[0]['news_date'])
+	if reorder: # second article moved above the newest one of last ingest
+		items = re.findall(rb'<item>.*?</item>', feed, flags=re.S)
+		feed = feed.replace(items[0] + items[1], items[1] + items[0], 1)
+	feed = prepend_items(feed, new)
+	with open(filepath, 'wb') as file:
+		file.write(feed + b'\n')
+	with patch.object(Tree, 'parse_article', autospec=True, side_effect=Tree.parse_article) as mock_parse:
+		second = list(tree.feed_stream(filepath, profile, state=state))
+	assert mock_parse.call_count == parsed
+	assert [article['news_guid'] for article in second] == [f'new-{i}' for i in range(new)] # margin is not yielded again
+	assert tree.state['body_sha256'] == hashlib.sha256(feed + b'\n').hexdigest()
+	if new:
+		assert tree.state['last_key'] == f'new-{new - 1}' and tree.state['last_ts'] > state['last_ts']
+	else:
+		assert tree.state['last_key'] == state['last_key']
+
+def test_feed_stream_oldest_first_not_cut(tmp_path, ):
+	filepath = str(tmp_path / 'feed.xml')
+	items = [f'<item><title>story {i}</title><link>https://a.com/{i}</link><pubDate>2022-05-26T0{i}:00:00Z</pubDate></item>' for i in range(8)]
+	with open(filepath, 'w') as file:
+		file.write(f'<rss><channel><title>a</title>{"".join(items[:5])}</channel></rss>')
+	tree = object.__new__(Tree)
+	list(tree.feed_stream(filepath, None))
+	state = tree.state
+	with open(filepath, 'w') as file:
+		file.write(f'<rss><channel><title>a</title>{"".join(items)}</channel></rss>')
+	with patch.object(Tree, 'parse_article', autospec=True, side_effect=Tree.parse_article) as mock_parse:
+		assert [article['news_title'] for article in tree.feed_stream(filepath, None, state=state)] == [f'story {i}' for i in range(5, 8)]
+	assert mock_parse.call_count == 8
+	assert tree.state['last_key'] == 'https://a.com/7'
+
+@pytest.mark.parametrize(
+	('workers', ),
+	(
+		(1, ),
+		(2, ),
+	)
+)
+def test_create_html_pages(tmp_path, workers, ):
+	articles = [dict(digest_article(i % 10, '2022-05-26', 'ab'[i // 12]), news_title=f'Story {i}', 
+					news_url=f'https://a.com/{i} (link)\nhttps://a.com/{i}.jpg (content)') for i in range(23)]
+	db = sqlite3.connect(':memory:')
+	Tree.db_migrate(db)
+	Tree.DB, Tree.LIMIT = db, -1
+	try:
+		pages = Tree.create_html_pages(str(tmp_path / 'news.html'), iter(articles), 10, workers)
+		assert pages == 3
+	finally:
+		Tree.DB, Tree.LIMIT = None, None
+		db.close()
+	index = (tmp_path / 'news.html').read_text()
+	assert index.count('<li>') == 3 and '<a href="news-3.html">Page 3</a> 3 articles' in index
+	texts = [(tmp_path / f'news-{number}.html').read_text() for number in (1, 2, 3)]
+	assert [text.count('<h3>') for text in texts] == [10, 10, 3]
+	assert 'Previous' not in texts[0] and '<a href="news-2.html">Next &rarr;</a>' in texts[0]
+	assert '<a href="news-1.html">&larr; Previous</a>' in texts[1] and '<a href="news-3.html">Next &rarr;</a>' in texts[1]
+	assert 'Next' not in texts[2] and '<a href="news.html">Index</a>' in texts[2]
+	# feed title is shown once for every feed on every page
+	assert [text.count('<h2>') for text in texts] == [1, 2, 1]
+	assert '<img src="https://a.com/0.jpg" alt="" width="640" height="360" loading="lazy">' in texts[0]
+	assert not (tmp_path / 'news-4.html').exists()
+
+def test_tree_html_pages_from_database(tmp_path, ):
+	db_filepath = str(tmp_path / 'news.db')
+	db = sqlite3.connect(db_filepath)
+	Tree.db_migrate(db)
+	with db:
+		Tree.db_insert_many(db, [digest_article(i, '2022-05-26', 'a') for i in range(7)])
+	db.close()
+	with patch('rss_parser.rss_parser.Tree.cache_news') as mock_cache:
+		Tree(None, json_=False, html_filepath=str(tmp_path / 'news.html'), pdf_filepath=None, limit=5, filter_src=None, 
+			filter_date='2022-05-26', db_filepath=db_filepath, workers=1, page_size=2)
+	assert not mock_cache.called
+	assert [(tmp_path / f'news-{number}.html').exists() for number in (1, 2, 3, 4)] == [True, True, True, False]
+	assert (tmp_path / 'news.html').read_text().count('<li>') == 3
+	Tree.URL, Tree.CACHE, Tree.PAGE_SIZE, Tree.FILTER_K, Tree.FILTER_V, Tree.LIMIT = None, [], None, None, None, None